@@ -27,6 +27,7 @@ class Config(BaseSettings):
     db_name: str = "aigc"  # Database name
     db_charset: str = "utf8mb4"  # Database charset
     db_auto_migrate: bool = False  # Database auto migration
+    db_bulk_batch_size: int = 1000  # Rows per INSERT batch (and commit) for bulk writes
     """
     Logger configuration
     """
@@ -37,11 +38,57 @@ class Config(BaseSettings):
     """
     datasets_device: str = "cpu"  # Device for datasets
     datasets_model_name: str = "uer/sbert-base-chinese-nli"  # Model name for datasets
+    datasets_allowed_models: str = ""  # Comma separated models tasks may select besides datasets_model_name
+    datasets_model_max_resident: int = 2  # Models kept loaded per process (or in the model server), least recently used evicted
+    datasets_model_memory_budget: int = 0  # Bytes of model weights kept loaded before evicting, 0 only limits the count
+    datasets_upload_chunk_size: int = 1024 * 1024  # Bytes read from an uploaded dataset file at a time
+    datasets_ingest_batch_size: int = 1000  # Segments flushed to the database per batch while ingesting
+    datasets_encode_batch_size: int = 64  # Texts sent to the embedding model per batch
+    datasets_encoder_backend: str = "torch"  # Embedding backend, torch or onnx (ONNX Runtime on CPU, needs onnxruntime)
+    datasets_onnx_quantize: bool = True  # Use the dynamically int8 quantized ONNX model
+    datasets_onnx_threads: int = 0  # Intra-op threads of ONNX Runtime, 0 lets it decide
+    datasets_encode_workers: int = 0  # Encoder processes to shard large encodes across, 0 or 1 encodes in-process
+    datasets_encode_worker_threads: int = 0  # Compute threads per encoder process, 0 splits the CPUs evenly
+    datasets_encode_pin_cpus: bool = True  # Pin each encoder process to its own CPUs where the OS supports it
+    datasets_embedding_cache_max_bytes: int = 1024 * 1024 * 1024  # Size of the on-disk embedding cache, 0 disables it
+    datasets_embedding_cache_dtype: str = "float16"  # Storage type of cached embeddings, float16 or float32
+    datasets_similarity_block_size: int = 2048  # Rows per block when searching similar questions
+    datasets_similarity_ann_min_size: int = 0  # Use an HNSW index (hnswlib) from this many questions on, 0 disables it
+    datasets_similarity_ann_top_k: int = 50  # Neighbours looked up per question with the HNSW index
+    datasets_model_server_socket: str = ""  # Unix socket of the shared model server, empty loads the model in each worker
+    datasets_model_server_timeout: float = 300  # Seconds to wait for the model server to answer one request
+    datasets_model_server_max_batch: int = 256  # Texts the model server collects before running a coalesced batch
+    datasets_model_server_max_wait_ms: int = 5  # How long the model server waits for more requests to coalesce
+    datasets_search_max_indexes: int = 4  # Dataset search indexes kept in memory per process, least recently used evicted
+    datasets_search_ann_min_size: int = 20000  # Search with an HNSW index (hnswlib) from this many rows on, 0 disables it
+    datasets_search_top_k_max: int = 100  # Maximum number of hits one search returns
+    datasets_search_sync_batch: int = 1000  # Segments read and encoded per batch while catching a search index up
+
+    """
+    Annotation configuration
+    """
+    annotation_lease_seconds: int = 600  # How long a claimed segment stays reserved for one annotator
+    annotation_prefetch_max: int = 20  # Maximum number of segments an annotator can claim at once
+    annotation_batch_mark_max: int = 1000  # Maximum number of items in one batch mark request
+    annotation_delta_page_max: int = 10000  # Maximum number of segments returned by one delta export page
+    annotation_detect_workers: int = 1  # Detect jobs running at the same time in one process
+    annotation_detect_queue_max: int = 8  # Detect jobs allowed to wait or run in one process before rejecting new ones
+    annotation_detect_heartbeat_seconds: int = 30  # How often a worker refreshes updated_at of its pending or running detect jobs
+    annotation_detect_stale_seconds: int = 300  # Pending or running detect jobs without a heartbeat for this long are marked failed
+    annotation_conflict_threshold: float = 0.9  # Question similarity from which a mark with another intent is a conflict
+    annotation_conflict_max_tasks: int = 32  # Task indexes kept in memory per process for conflict checks at mark time
+    annotation_conflict_max_results: int = 10  # Conflicts returned by one mark
+    annotation_intent_matrix_max: int = 200  # Most used intents included in the intent similarity matrix
+    annotation_detect_result_max: int = 100000  # Mismatched question pairs stored per detect job, the counts stay exact
+    annotation_grounding_threshold: float = 0.5  # RAG/GENERAL answers matching their document and question below this are ungrounded
+    annotation_duplicate_question_threshold: float = 0.9  # Question similarity from which RAG/GENERAL questions are near duplicates
+    annotation_document_chunk_size: int = 200  # Characters per document chunk an answer is compared with
 
     """
     Storage configuration
     """
     storage_dir: str = "./storage"  # Storage directory
+    export_cache_max_bytes: int = 5 * 1024 * 1024 * 1024  # Size budget of cached export artifacts under storage_dir
 
     model_config = SettingsConfigDict(env_file=".env", extra=Extra.allow)  # Configuration dictionary
 
@@ -0,0 +1,230 @@
+"""
+检测性能基准：生成合成的 FAQ 标注数据，分别记录编码耗时、相似度计算耗时、峰值内存和结果数量，输出 JSON
+
+    python -m app.core.datasets.benchmark --sizes 1000 10000 100000 --output detect_benchmark.json
+    python -m app.core.datasets.benchmark --kind rag --sizes 50000
+
+默认使用确定性的假编码器（字符二元组哈希），不需要模型和网络，结果可以跨版本对比；
+--model 改为按配置加载真实模型
+每个规模在独立的子进程中运行，峰值内存互不影响
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+import numpy as np
+
+from app.core.datasets.encoder import Encoder
+from app.logger.logger import get_logger
+
+logger = get_logger("benchmark")
+
+
+class HashingEncoder(Encoder):
+    """把字符二元组哈希到固定维度，字面相近的文本得到相近的向量，输出只取决于文本"""
+
+    def __init__(self, dim: int = 64):
+        self._dim = dim
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        result = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for i in range(max(1, len(text) - 1)):
+                digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self._dim
+                result[row, bucket] += 1 if digest[4] & 1 else -1
+        return result
+
+
+class TimingEncoder(Encoder):
+    """记录编码累计耗时"""
+
+    def __init__(self, encoder: Encoder):
+        self.encoder = encoder
+        self.seconds = 0.0
+        self.texts = 0
+
+    @property
+    def dim(self) -> int:
+        return self.encoder.dim
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        start = time.perf_counter()
+        try:
+            return self.encoder.encode(texts)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.texts += len(texts)
+
+
+_CHARS = "的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动方期它头经长儿回位分爱老因很给名法间斯知世什两次使身者被高已亲其进此话常与活正感"
+
+
+def generate_corpus(rows: int, seed: int = 0, mismatch_rate: float = 0.02):
+    """
+    生成合成的 FAQ 数据：每个意图有一个基础问法，样本的问题是基础问法的随机改写，
+    约 mismatch_rate 的样本故意标成另一个意图，制造意图不一致的相似问题
+    """
+    from app.core.datasets.datasets_model import QuestionIntent
+
+    rng = random.Random(seed)
+    intents = max(2, rows // 20)
+    bases = ["".join(rng.choice(_CHARS) for _ in range(rng.randint(8, 16))) for _ in range(intents)]
+    data = []
+    for _ in range(rows):
+        intent = rng.randrange(intents)
+        questions = []
+        for _ in range(rng.randint(1, 2)):
+            chars = list(bases[intent])
+            chars[rng.randrange(len(chars))] = rng.choice(_CHARS)
+            questions.append("".join(chars))
+        label = rng.randrange(intents) if rng.random() < mismatch_rate else intent
+        data.append(QuestionIntent(input=f"[{','.join(questions)}]", intent=f"intent-{label}",
+                                   output=f"answer-{label}"))
+    return data
+
+
+def generate_rag_corpus(rows: int, seed: int = 0, ungrounded_rate: float = 0.02):
+    """
+    生成合成的 RAG 数据：文档由若干随机句子组成，答案摘自文档中的一句，问题是该句的改写，
+    约 ungrounded_rate 的样本换成与文档无关的答案
+    """
+    from app.core.datasets.datasets_model import ContextAnswer
+
+    rng = random.Random(seed)
+
+    def sentence():
+        return "".join(rng.choice(_CHARS) for _ in range(rng.randint(10, 30)))
+
+    data = []
+    for _ in range(rows):
+        sentences = [sentence() for _ in range(rng.randint(3, 12))]
+        answer = rng.choice(sentences)
+        chars = list(answer)
+        chars[rng.randrange(len(chars))] = rng.choice(_CHARS)
+        output = sentence() if rng.random() < ungrounded_rate else answer
+        data.append(ContextAnswer(question="".join(chars), document="。".join(sentences) + "。", output=output))
+    return data
+
+
+def run_one(rows: int, seed: int, use_model: bool, block_size: int, threshold: float, kind: str = "faq") -> dict:
+    from app.core.datasets.datasets_model import DatasetsModel
+
+    if use_model:
+        from app.config.config import get_config
+        from app.core.datasets.encoder import create_model_encoder
+        encoder = TimingEncoder(create_model_encoder(get_config()))
+    else:
+        encoder = TimingEncoder(HashingEncoder())
+    model = DatasetsModel(encoder, block_size=block_size)
+    if kind == "rag":
+        data = generate_rag_corpus(rows, seed)
+        start = time.perf_counter()
+        result = model.analyze_context(data, duplicate_threshold=threshold)
+        findings = {"ungroundedOutputs": len(result.ungroundedOutputs),
+                    "duplicateQuestions": len(result.duplicateQuestions)}
+    else:
+        data = generate_corpus(rows, seed)
+        start = time.perf_counter()
+        result = model.analyze(data, similarity_threshold=threshold, intent_similarity_threshold=threshold)
+        findings = {"mismatchedPairs": len(result.mismatchedIntents), "similarIntents": len(result.similarIntents)}
+    total = time.perf_counter() - start
+
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_bytes = peak if sys.platform == "darwin" else peak * 1024
+    return {
+        "rows": rows,
+        "texts": encoder.texts,
+        "encodeSeconds": round(encoder.seconds, 4),
+        "similaritySeconds": round(total - encoder.seconds, 4),
+        "totalSeconds": round(total, 4),
+        "peakRssBytes": peak_bytes,
+        **findings,
+    }
+
+
+def _child(queue, rows: int, *args):
+    try:
+        queue.put(run_one(rows, *args))
+    except Exception as e:
+        queue.put({"rows": rows, "error": f"{type(e).__name__}: {e}"})
+
+
+def _wait_result(queue, process, rows: int, timeout: float) -> dict:
+    """等待子进程的结果；子进程异常退出（例如内存不足被杀）或超时时记录失败，不会一直阻塞"""
+    import queue as queue_module
+
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except queue_module.Empty:
+            pass
+        if not process.is_alive():
+            # 子进程可能在退出前刚好放入了结果
+            try:
+                return queue.get(timeout=1)
+            except queue_module.Empty:
+                return {"rows": rows, "error": "benchmark process died", "exitcode": process.exitcode}
+        if deadline is not None and time.monotonic() > deadline:
+            process.kill()
+            process.join()
+            return {"rows": rows, "error": f"timed out after {timeout} seconds", "exitcode": process.exitcode}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DatasetsModel.analyze on synthetic FAQ data.")
+    parser.add_argument("--kind", choices=["faq", "rag"], default="faq", help="annotation type of the corpus")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="rows per corpus")
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed")
+    parser.add_argument("--model", action="store_true", help="use the configured model instead of the fake encoder")
+    parser.add_argument("--block-size", type=int, default=2048, help="similarity block size")
+    parser.add_argument("--threshold", type=float, default=0.9, help="similarity threshold")
+    parser.add_argument("--timeout", type=float, default=0, help="seconds allowed per corpus size, 0 for no limit")
+    parser.add_argument("--output", type=str, default="detect_benchmark.json", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for rows in args.sizes:
+        queue = context.Queue()
+        process = context.Process(target=_child,
+                                  args=(queue, rows, args.seed, args.model, args.block_size, args.threshold,
+                                        args.kind))
+        process.start()
+        result = _wait_result(queue, process, rows, args.timeout)
+        process.join()
+        results.append(result)
+        logger.info(f"Benchmark {json.dumps(result)}")
+
+    report = {
+        "createdAt": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "kind": args.kind,
+        "encoder": "model" if args.model else "hashing",
+        "seed": args.seed,
+        "blockSize": args.block_size,
+        "threshold": args.threshold,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
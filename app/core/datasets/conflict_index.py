@@ -0,0 +1,184 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, ContextManager, List, Dict, NamedTuple, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from app.core.datasets.datasets_model import DatasetsModel, split_questions
+from app.core.datasets.similarity import normalize
+
+
+class IndexedSegment(NamedTuple):
+    """A changed segment to apply to the index, detached from the database session."""
+    id: int
+    uuid: str
+    change_seq: int
+    completed: bool
+    input: str
+    intent: str
+
+
+class IntentConflict(BaseModel):
+    """A near duplicate question labelled with another intent."""
+    question: str = ""
+    """The question of the marked segment."""
+    intent: str = ""
+    """The intent of the marked segment."""
+    similarQuestion: str = ""
+    """The near duplicate question."""
+    similarIntent: str = ""
+    """The intent of the near duplicate question."""
+    segmentId: str = ""
+    """The ID of the segment the near duplicate question belongs to."""
+    similarity: float = 0
+    """The cosine similarity of the two questions."""
+
+
+class TaskConflictIndex:
+    """
+    单个标注任务已完成样本的问题向量索引
+    重新标注或放弃的样本先标记删除，删除的行超过一半时压缩
+    意图按出现顺序编号，和向量一起维护整数编号数组，检测时直接比较编号
+    """
+
+    def __init__(self, model_name: str = ""):
+        self.lock = threading.Lock()
+        self.model_name = model_name
+        self.watermark: Tuple[int, int] = (0, 0)
+        # 第一次追上任务的全部变更后才用于检测，之后每次只应用少量增量
+        self.ready = False
+        # 维度在第一次加入向量时确定
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.size = 0
+        self.owners: List[str] = []
+        self.questions: List[str] = []
+        self.intent_names: List[str] = []
+        self.intent_codes: Dict[str, int] = {}
+        self.rows: Dict[str, List[int]] = {}
+
+    def remove(self, segment_uuid: str):
+        for row in self.rows.pop(segment_uuid, []):
+            self.alive[row] = False
+
+    def add(self, segment_uuid: str, questions: List[str], intent: str, vectors: np.ndarray):
+        count = len(questions)
+        if self.size + count > len(self.vectors):
+            self._compact(self.size + count, vectors.shape[1])
+        code = self.intent_codes.get(intent)
+        if code is None:
+            code = self.intent_codes[intent] = len(self.intent_names)
+            self.intent_names.append(intent)
+        rows = list(range(self.size, self.size + count))
+        self.vectors[self.size:self.size + count] = vectors
+        self.alive[self.size:self.size + count] = True
+        self.codes[self.size:self.size + count] = code
+        self.size += count
+        self.owners.extend([segment_uuid] * count)
+        self.questions.extend(questions)
+        self.rows[segment_uuid] = rows
+
+    def intent(self, row: int) -> str:
+        return self.intent_names[self.codes[row]]
+
+    def _compact(self, required: int, dim: int):
+        keep = np.nonzero(self.alive[:self.size])[0]
+        capacity = max(required - self.size + len(keep), 2 * len(keep), 64)
+        vectors = np.zeros((capacity, dim), dtype=np.float32)
+        codes = np.zeros(capacity, dtype=np.int32)
+        if len(keep):
+            vectors[:len(keep)] = self.vectors[keep]
+            codes[:len(keep)] = self.codes[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(keep)] = True
+        self.vectors, self.alive, self.codes, self.size = vectors, alive, codes, len(keep)
+        self.owners = [self.owners[row] for row in keep]
+        self.questions = [self.questions[row] for row in keep]
+        self.rows = {}
+        for row, owner in enumerate(self.owners):
+            self.rows.setdefault(owner, []).append(row)
+
+
+class ConflictDetector:
+    """
+    标注时的增量冲突检测：每个任务维护一个问题向量索引，只把新变更的样本编码加入索引，
+    新标注的问题与索引做一次矩阵向量乘，找出意图不同的近似问题
+    每个进程最多保留 max_tasks 个任务的索引，按 LRU 淘汰，淘汰后由调用方在后台重新加载，加载完成前不做检测
+    models 按名称返回模型，任务换了模型后索引重建，不同模型的向量不能混用
+    """
+
+    def __init__(self, models: Callable[[str], ContextManager[DatasetsModel]], threshold: float = 0.9, max_tasks: int = 32,
+                 max_conflicts: int = 10):
+        self.models = models
+        self.threshold = threshold
+        self.max_tasks = max_tasks
+        self.max_conflicts = max_conflicts
+        self._lock = threading.Lock()
+        self._tasks: OrderedDict[int, TaskConflictIndex] = OrderedDict()
+
+    def _index(self, annotation_id: int, model_name: str) -> TaskConflictIndex:
+        with self._lock:
+            index = self._tasks.get(annotation_id)
+            if index is None or index.model_name != model_name:
+                index = TaskConflictIndex(model_name)
+                self._tasks[annotation_id] = index
+                while len(self._tasks) > self.max_tasks:
+                    self._tasks.popitem(last=False)
+            self._tasks.move_to_end(annotation_id)
+            return index
+
+    def watermark(self, annotation_id: int, model_name: str) -> Tuple[int, int]:
+        """The (change_seq, id) of the last segment applied to the index of a task."""
+        return self._index(annotation_id, model_name).watermark
+
+    def ready(self, annotation_id: int, model_name: str) -> bool:
+        """Whether the index of a task has caught up with the task once and can be checked against."""
+        return self._index(annotation_id, model_name).ready
+
+    def mark_ready(self, annotation_id: int, model_name: str):
+        self._index(annotation_id, model_name).ready = True
+
+    def apply(self, annotation_id: int, model_name: str, segments: List[IndexedSegment]):
+        """把按 (change_seq, id) 排序的变更样本应用到索引，已应用过的跳过"""
+        index = self._index(annotation_id, model_name)
+        with index.lock:
+            segments = [s for s in segments if (s.change_seq, s.id) > index.watermark]
+            if not segments:
+                return
+            added = []
+            for segment in segments:
+                index.remove(segment.uuid)
+                if segment.completed and segment.input and segment.intent:
+                    added.append((segment, split_questions(segment.input)))
+            texts = [q for _, questions in added for q in questions]
+            vectors = None
+            if texts:
+                with self.models(model_name) as model:
+                    vectors = normalize(model.encode(texts))
+            offset = 0
+            for segment, questions in added:
+                index.add(segment.uuid, questions, segment.intent, vectors[offset:offset + len(questions)])
+                offset += len(questions)
+            index.watermark = (segments[-1].change_seq, segments[-1].id)
+
+    def check(self, annotation_id: int, model_name: str, segment_uuid: str) -> List[IntentConflict]:
+        """返回与该样本的问题相似度不低于阈值、但意图不同的已标注问题，按相似度从高到低"""
+        index = self._index(annotation_id, model_name)
+        with index.lock:
+            rows = index.rows.get(segment_uuid, [])
+            if not rows:
+                return []
+            code = index.codes[rows[0]]
+            intent = index.intent_names[code]
+            scores = index.vectors[rows] @ index.vectors[:index.size].T
+            # 排除已删除的行、自己的问题和同一意图的问题
+            mask = index.alive[:index.size] & (index.codes[:index.size] != code)
+            scores[:, ~mask] = -1
+            q, other = np.nonzero(scores >= self.threshold)
+            order = np.argsort(-scores[q, other], kind="stable")[:self.max_conflicts]
+            return [IntentConflict(question=index.questions[rows[q[i]]], intent=intent,
+                                   similarQuestion=index.questions[other[i]], similarIntent=index.intent(other[i]),
+                                   segmentId=index.owners[other[i]], similarity=float(scores[q[i], other[i]]))
+                    for i in order]
@@ -1,12 +1,15 @@
+import asyncio
+import functools
+import re
 from collections import defaultdict
-from typing import List
+from typing import List, Callable
 
-import torch
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
+from app.core.datasets.encoder import Encoder
+from app.core.datasets.similarity import similar_pairs, similar_pairs_ann, ann_available, normalize
+
 
 class QuestionIntent(BaseModel):
     """The request model for creating an annotation."""
@@ -35,6 +38,8 @@ class SimilarIntents(BaseModel):
     """The similar intents of the annotation."""
     intentPair: List[str] = []
     """The intent pair of the annotation."""
+    similarity: float = 0
+    """The cosine similarity of the two intents."""
 
 
 class SimilarQuestionIntent(BaseModel):
@@ -43,28 +48,128 @@ class SimilarQuestionIntent(BaseModel):
     similarIntents: List[SimilarIntents] = []
 
 
+class ContextAnswer(BaseModel):
+    """A RAG or GENERAL sample: the question, the context the answer should rely on, and the answer."""
+    question: str = ""
+    document: str = ""
+    output: str = ""
+
+
+class UngroundedOutput(BaseModel):
+    """An answer that is not supported by the document or the question of its sample."""
+    question: str = ""
+    """The question of the sample."""
+    output: str = ""
+    """The answer of the sample."""
+    score: float = 0
+    """The highest cosine similarity between the answer and a document chunk or the question."""
+    lineNumber: int = 0
+    """The line number of the sample."""
+
+
+class DuplicateQuestions(BaseModel):
+    """Near duplicate questions of two samples."""
+    questionPair: List[str] = []
+    """The question pair."""
+    answer1: str = ""
+    """The answer of the first question."""
+    answer2: str = ""
+    """The answer of the second question."""
+    similarity: float = 0
+    """The cosine similarity of the two questions."""
+    lineNumbers: List[int] = []
+    """The line numbers of the two samples."""
+
+
+class ContextConsistency(BaseModel):
+    """The consistency findings of a RAG or GENERAL annotation."""
+    ungroundedOutputs: List[UngroundedOutput] = []
+    duplicateQuestions: List[DuplicateQuestions] = []
+
+
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;\n])")
+
+
+def split_document(text: str, chunk_size: int = 200) -> List[str]:
+    """按句子把文档切成不超过 chunk_size 个字符的片段，超长的句子直接截断，模型对长文本只看开头"""
+    chunks, current = [], ""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        while len(sentence) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:chunk_size])
+            sentence = sentence[chunk_size:]
+        if not sentence:
+            continue
+        if len(current) + len(sentence) > chunk_size:
+            chunks.append(current)
+            current = ""
+        current += sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_questions(text: str) -> List[str]:
+    """FAQ 样本的 input 形如 [问题1,问题2]，拆分出其中的问题"""
+    return [q.strip() for q in text[1:-1].split(',')]
+
+
+class DetectCancelledError(Exception):
+    """Raised when a running analysis is cancelled."""
+
+
 class DatasetsModel:
     """The datasets model."""
 
-    def __init__(self, model_path: str = "", device: str = ""):
-        """Construct a new model."""
-        if not model_path:
-            model_path = "uer/sbert-base-chinese-nli"
-        self.model_path = model_path
+    def __init__(self, encoder: Encoder, block_size: int = 2048, ann_min_size: int = 0, ann_top_k: int = 50):
+        """
+        Construct a new model on top of an encoder, either loaded in this process or served by the model server.
+        Question similarity is computed block_size rows at a time; from ann_min_size questions on, an HNSW index
+        limited to ann_top_k neighbours is used instead when hnswlib is installed, 0 disables it.
+        """
+        self.encoder = encoder
+        self.block_size = block_size
+        self.ann_min_size = ann_min_size
+        self.ann_top_k = ann_top_k
 
-        if not device:
-            # 如果是mac系统，使用mps
-            if "mac" in torch.__file__:
-                device = "mps"
-            else:
-                device = "cuda" if torch.cuda.is_available() else "cpu"
+    @property
+    def memory_bytes(self) -> int:
+        return self.encoder.memory_bytes
 
-        self.device = device
-        self.model = SentenceTransformer(model_name_or_path=model_path, device=device)
+    def close(self):
+        self.encoder.close()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into a float32 matrix, one row per text."""
+        return self.encoder.encode(texts)
+
+    def intent_similarity_matrix(self, intents: List[str]) -> np.ndarray:
+        """The cosine similarity of every pair of intents, a len(intents) × len(intents) matrix."""
+        if not intents:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = normalize(self.encode(intents))
+        return embeddings @ embeddings.T
 
     async def analyze_similar_questions_and_intents(self, data: List[QuestionIntent], similarity_threshold: float = 0.9,
                                                     intent_similarity_threshold: float = 0.9) -> SimilarQuestionIntent:
-        """Analyze similar questions and intents."""
+        """Analyze similar questions and intents in the default executor, without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.analyze, data, similarity_threshold,
+                                                                  intent_similarity_threshold))
+
+    def analyze(self, data: List[QuestionIntent], similarity_threshold: float = 0.9,
+                intent_similarity_threshold: float = 0.9, cancelled: Callable[[], bool] = None) -> SimilarQuestionIntent:
+        """
+        Analyze similar questions and intents. This is CPU bound and blocks the calling thread.
+        cancelled is polled between phases, DetectCancelledError is raised when it returns True.
+        """
+
+        def check_cancelled():
+            if cancelled and cancelled():
+                raise DetectCancelledError()
 
         all_query = []
         all_intents = []
@@ -72,8 +177,7 @@ class DatasetsModel:
         indices = []
 
         for i, item in enumerate(data):
-            questions = item.input[1:-1].split(',')
-            questions = [q.strip() for q in questions]
+            questions = split_questions(item.input)
             intents = item.intent
             answers = item.output
             for q in questions:
@@ -84,42 +188,114 @@ class DatasetsModel:
                 indices.append(i)
             i += 1
 
-        sentence_embeddings = self.model.encode(all_query)
-        cosine_score = cosine_similarity(sentence_embeddings)
-        similar_indices = np.argwhere(cosine_score >= similarity_threshold)
+        check_cancelled()
+        sentence_embeddings = self.encode(all_query)
+        check_cancelled()
+        # 分块计算相似度，避免生成 n×n 的矩阵；样本很多且安装了 hnswlib 时使用近似检索
+        if self.ann_min_size and len(all_query) >= self.ann_min_size and ann_available():
+            rows, cols = similar_pairs_ann(sentence_embeddings, similarity_threshold, self.ann_top_k)
+        else:
+            rows, cols = similar_pairs(sentence_embeddings, similarity_threshold, self.block_size, cancelled)
+        check_cancelled()
         intent_question = defaultdict(list)
 
-        for row, col in similar_indices:
-            if row < col:
-                intent1 = all_intents[row]
-                intent2 = all_intents[col]
-                if intent1 != intent2:  # 不考虑同一个意图的情况
-                    question1 = all_query[row]
-                    question2 = all_query[col]
-                    answer1 = all_answers[row]
-                    answer2 = all_answers[col]
-                    intent_question[tuple((intent1, intent2))].append({
-                        "question_pair": [question1, question2],
-                        "intent1": intent1,
-                        "intent2": intent2,
-                        "answer1": answer1,
-                        "answer2": answer2,
-                        "line_numbers": [indices[row], indices[col]]
-                    })
-
-        # 比较相似问题的意图是否相似
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            intent1 = all_intents[row]
+            intent2 = all_intents[col]
+            if intent1 != intent2:  # 不考虑同一个意图的情况
+                question1 = all_query[row]
+                question2 = all_query[col]
+                answer1 = all_answers[row]
+                answer2 = all_answers[col]
+                intent_question[tuple((intent1, intent2))].append(MismatchedIntents(
+                    questionPair=[question1, question2],
+                    intent1=intent1,
+                    intent2=intent2,
+                    answer1=answer1,
+                    answer2=answer2,
+                    lineNumbers=[indices[row], indices[col]]
+                ))
+
+        check_cancelled()
+        # 比较相似问题的意图是否相似，每个意图只编码一次，所有意图对一次算完
         similar_intents: List[SimilarIntents] = []
-        intents_ = [intent for intent_pair in intent_question.keys()
-                    for intent in intent_pair]
-        if intents_:
-            sentence_embeddings = self.model.encode(intents_)
-            for i in range(0, len(sentence_embeddings), 2):
-                intent_sim = cosine_similarity([sentence_embeddings[i]], [
-                    sentence_embeddings[i + 1]])[0][0]
+        intent_pairs = list(intent_question.keys())
+        if intent_pairs:
+            unique_intents = list(dict.fromkeys(intent for intent_pair in intent_pairs for intent in intent_pair))
+            position = {intent: i for i, intent in enumerate(unique_intents)}
+            intent_embeddings = normalize(self.encode(unique_intents))
+            left = intent_embeddings[[position[intent1] for intent1, _ in intent_pairs]]
+            right = intent_embeddings[[position[intent2] for _, intent2 in intent_pairs]]
+            intent_sims = np.einsum("ij,ij->i", left, right)
+            for (intent1, intent2), intent_sim in zip(intent_pairs, intent_sims.tolist()):
                 if intent_sim > intent_similarity_threshold:
-                    intent_sim = float(intent_sim)
-
-                    similar_intents.append(SimilarIntents(intent_pair=[intents_[i], intents_[i + 1]]))
+                    similar_intents.append(SimilarIntents(intentPair=[intent1, intent2], similarity=intent_sim))
 
         return SimilarQuestionIntent(similarIntents=similar_intents,
                                      mismatchedIntents=[v for pairs in intent_question.values() for v in pairs])
+
+    def analyze_context(self, data: List[ContextAnswer], grounding_threshold: float = 0.5,
+                        duplicate_threshold: float = 0.9, chunk_size: int = 200,
+                        cancelled: Callable[[], bool] = None) -> ContextConsistency:
+        """
+        Check RAG and GENERAL samples. This is CPU bound and blocks the calling thread.
+        An answer is ungrounded when its best match among the document chunks and the question is below
+        grounding_threshold; questions of different samples at or above duplicate_threshold are near duplicates.
+        cancelled is polled between blocks, DetectCancelledError is raised when it returns True.
+        """
+
+        def check_cancelled():
+            if cancelled and cancelled():
+                raise DetectCancelledError()
+
+        # 相似问题：与 FAQ 相同，分块计算问题两两之间的相似度
+        lines = [i for i, item in enumerate(data) if item.question.strip()]
+        questions = [data[i].question.strip() for i in lines]
+        duplicates: List[DuplicateQuestions] = []
+        check_cancelled()
+        if questions:
+            embeddings = normalize(self.encode(questions))
+            check_cancelled()
+            if self.ann_min_size and len(questions) >= self.ann_min_size and ann_available():
+                rows, cols = similar_pairs_ann(embeddings, duplicate_threshold, self.ann_top_k)
+            else:
+                rows, cols = similar_pairs(embeddings, duplicate_threshold, self.block_size, cancelled)
+            check_cancelled()
+            sims = np.einsum("ij,ij->i", embeddings[rows], embeddings[cols])
+            for row, col, sim in zip(rows.tolist(), cols.tolist(), sims.tolist()):
+                duplicates.append(DuplicateQuestions(
+                    questionPair=[questions[row], questions[col]],
+                    answer1=data[lines[row]].output, answer2=data[lines[col]].output,
+                    similarity=sim, lineNumbers=[lines[row], lines[col]]))
+
+        # 答案是否有依据：每个答案只与自己样本的文档片段和问题比较，按块编码，内存只与块大小有关
+        ungrounded: List[UngroundedOutput] = []
+        answered = [i for i, item in enumerate(data) if item.output.strip()]
+        for start in range(0, len(answered), self.block_size):
+            check_cancelled()
+            block = answered[start:start + self.block_size]
+            chunks, offsets = [], []
+            for i in block:
+                offsets.append(len(chunks))
+                chunks.extend(split_document(data[i].document, chunk_size))
+                if data[i].question.strip():
+                    chunks.append(data[i].question.strip())
+            counts = np.diff(np.append(offsets, len(chunks)))
+            # 没有文档也没有问题的样本无从判断，不计入结果
+            scores = np.full(len(block), np.nan, dtype=np.float32)
+            if chunks:
+                outputs = normalize(self.encode([data[i].output.strip() for i in block]))
+                chunk_vectors = normalize(self.encode(chunks))
+                owners = np.repeat(np.arange(len(block)), counts)
+                chunk_scores = np.einsum("ij,ij->i", outputs[owners], chunk_vectors)
+                has_chunks = counts > 0
+                # 片段按样本连续存放，reduceat 一次求出每个样本的最高分
+                scores[has_chunks] = np.maximum.reduceat(chunk_scores, np.asarray(offsets)[has_chunks])
+            for i, score in zip(block, scores.tolist()):
+                if not np.isnan(score) and score < grounding_threshold:
+                    ungrounded.append(UngroundedOutput(question=data[i].question, output=data[i].output,
+                                                       score=max(score, 0.0), lineNumber=i))
+
+        check_cancelled()
+        ungrounded.sort(key=lambda item: item.score)
+        return ContextConsistency(ungroundedOutputs=ungrounded, duplicateQuestions=duplicates)
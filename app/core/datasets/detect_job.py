@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class DetectQueueFullError(Exception):
+    """Raised when too many detect jobs are waiting or running."""
+
+
+class DetectJobHandle:
+    """A submitted detect job."""
+
+    def __init__(self, job_id: str, future: asyncio.Future, started: asyncio.Event, cancelled: threading.Event):
+        self.job_id = job_id
+        self.future = future
+        """Resolves to the job result, or raises the job error."""
+        self.started = started
+        """Set once a worker thread picks up the job."""
+        self.cancelled = cancelled
+        """Polled by the job between phases."""
+
+
+class DetectJobRunner:
+    """
+    在独立的线程池中运行检测作业，避免阻塞事件循环
+    max_workers 限制同时运行的作业数，max_queue 限制排队加运行中的作业数
+    """
+
+    def __init__(self, max_workers: int = 1, max_queue: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="detect")
+        self._max_queue = max(1, max_queue)
+        self._jobs: Dict[str, DetectJobHandle] = {}
+
+    def submit(self, job_id: str, fn: Callable[[Callable[[], bool]], T]) -> DetectJobHandle:
+        """
+        提交作业，fn 在工作线程中以取消检查函数为参数调用
+        :param job_id: 作业ID
+        :param fn: 作业函数
+        :return: 作业句柄
+        """
+        if len(self._jobs) >= self._max_queue:
+            raise DetectQueueFullError(f"Too many detect jobs, at most {self._max_queue} are allowed.")
+
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+        cancelled = threading.Event()
+
+        def run() -> T:
+            loop.call_soon_threadsafe(started.set)
+            return fn(cancelled.is_set)
+
+        work = self._executor.submit(run)
+        future = asyncio.wrap_future(work, loop=loop)
+        handle = DetectJobHandle(job_id, future, started, cancelled)
+        self._jobs[job_id] = handle
+        # 取消时 asyncio 的 future 立即结束，但运行中的线程要到下一个检查点才退出；
+        # 按线程池中的 future 移出，作业真正结束前仍然计入并发和排队限制
+        work.add_done_callback(lambda _: loop.call_soon_threadsafe(self._jobs.pop, job_id, None))
+        return handle
+
+    def get(self, job_id: str) -> DetectJobHandle | None:
+        """Return the handle of a job running in this process."""
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消作业，排队中的作业不会再运行，运行中的作业在下一个检查点退出
+        :return: 作业是否在当前进程中
+        """
+        handle = self._jobs.get(job_id)
+        if not handle:
+            return False
+        handle.cancelled.set()
+        handle.future.cancel()
+        return True
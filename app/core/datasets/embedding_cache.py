@@ -0,0 +1,151 @@
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import List, Dict
+
+import numpy as np
+
+from app.logger.logger import get_logger
+
+logger = get_logger("embedding_cache")
+
+
+def normalize_text(text: str) -> str:
+    """文本归一化，全半角等写法不同但内容相同的文本共用一个向量"""
+    return unicodedata.normalize("NFKC", text).strip()
+
+
+def text_key(text: str) -> str:
+    """The cache key of a text, the hash of its normalized form."""
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    持久化的向量缓存，每个模型一个目录，同一目录可以被多个进程、多个实例同时使用：
+    vectors.npy 是按槽位存放向量的内存映射矩阵，index.sqlite3 记录文本哈希、槽位和最近使用时间
+    读取时持有共享文件锁，写入时持有排他文件锁，槽位的分配和淘汰在锁内完成，不会把同一个槽位分给两个文本
+    槽位用完后淘汰最久未使用的文本，复用它的槽位；每次写入只更新涉及的行
+    """
+
+    # SQLite 单条语句的参数个数有上限，按批查询
+    _QUERY_BATCH = 500
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int, max_bytes: int, dtype: str = "float16"):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.capacity = max(1, max_bytes // (dim * self.dtype.itemsize))
+        self.model_name = model_name
+        self.path = os.path.join(cache_dir, hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:16])
+        os.makedirs(self.path, exist_ok=True)
+        # 文件锁只在进程之间（以及同一进程的不同实例之间）互斥，同一实例的线程之间再加一把锁
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(self.path, "lock"), "a+")
+        self._db = sqlite3.connect(os.path.join(self.path, "index.sqlite3"), timeout=60, check_same_thread=False,
+                                   isolation_level=None)
+        self._vectors = self._open()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.npy")
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open(self) -> np.memmap:
+        layout = f"{self.model_name}|{self.dim}|{self.dtype.name}|{self.capacity}"
+        with self._locked(exclusive=True):
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER UNIQUE, "
+                             "used INTEGER)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_used ON entries (used)")
+            row = self._db.execute("SELECT value FROM meta WHERE name = 'layout'").fetchone()
+            try:
+                if row is not None and row[0] == layout:
+                    vectors = np.load(self._vectors_path, mmap_mode="r+")
+                    if vectors.dtype == self.dtype and vectors.shape == (self.capacity, self.dim):
+                        return vectors
+                if row is not None:
+                    logger.warn(f"Rebuild embedding cache {self.path}: layout changed from {row[0]}")
+            except (FileNotFoundError, ValueError) as e:
+                logger.warn(f"Rebuild embedding cache {self.path}: {e}")
+
+            vectors = np.lib.format.open_memmap(self._vectors_path, mode="w+", dtype=self.dtype,
+                                                shape=(self.capacity, self.dim))
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('layout', ?)", (layout,))
+            self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('next_slot', '0')")
+            self._db.execute("COMMIT")
+            return vectors
+
+    def _lookup(self, keys: List[str]) -> Dict[str, int]:
+        slots = {}
+        for start in range(0, len(keys), self._QUERY_BATCH):
+            batch = keys[start:start + self._QUERY_BATCH]
+            rows = self._db.execute(f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})",
+                                    batch).fetchall()
+            slots.update(rows)
+        return slots
+
+    def _touch(self, keys: List[str]):
+        now = time.time_ns()
+        self._db.executemany("UPDATE entries SET used = ? WHERE key = ?", [(now, key) for key in keys])
+
+    def get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """返回命中的向量（float32），并刷新它们的使用时间"""
+        with self._locked(exclusive=False):
+            slots = self._lookup(keys)
+            if not slots:
+                return {}
+            found = {key: np.asarray(self._vectors[slot], dtype=np.float32) for key, slot in slots.items()}
+            self._db.execute("BEGIN")
+            self._touch(list(slots))
+            self._db.execute("COMMIT")
+            return found
+
+    def put(self, keys: List[str], vectors: np.ndarray):
+        """写入向量，keys 不能重复；槽位不足时按 LRU 淘汰"""
+        keys = keys[:self.capacity]
+        if not keys:
+            return
+        with self._locked(exclusive=True):
+            existing = self._lookup(keys)
+            missing = [key for key in keys if key not in existing]
+            self._db.execute("BEGIN")
+            self._touch(list(existing))
+            next_slot = int(self._db.execute("SELECT value FROM meta WHERE name = 'next_slot'").fetchone()[0])
+            fresh = list(range(next_slot, min(next_slot + len(missing), self.capacity)))
+            self._db.execute("UPDATE meta SET value = ? WHERE name = 'next_slot'", (str(next_slot + len(fresh)),))
+            evicted = []
+            if len(fresh) < len(missing):
+                needed = len(missing) - len(fresh)
+                # 本批已有的文本刚刷新过使用时间，一般排在最后，多取几行以防时钟回拨
+                rows = self._db.execute("SELECT key, slot FROM entries ORDER BY used LIMIT ?",
+                                        (needed + len(existing),)).fetchall()
+                evicted = [(key, slot) for key, slot in rows if key not in existing][:needed]
+                self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            # 先提交淘汰，再覆盖向量，最后登记新文本；中途退出时最多丢失缓存，不会读到错位的向量
+            self._db.execute("COMMIT")
+
+            new_slots = iter(fresh + [slot for _, slot in evicted])
+            slots = [existing[key] if key in existing else next(new_slots) for key in keys]
+            self._vectors[slots] = np.asarray(vectors[:len(slots)], dtype=self.dtype)
+            self._vectors.flush()
+
+            now = time.time_ns()
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT INTO entries (key, slot, used) VALUES (?, ?, ?)",
+                                 [(key, slot, now) for key, slot in zip(keys, slots) if key not in existing])
+            self._db.execute("COMMIT")
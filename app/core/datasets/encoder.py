@@ -0,0 +1,149 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+import numpy as np
+
+from app.config.config import Config
+from app.core.datasets.embedding_cache import EmbeddingCache, text_key
+
+
+class Encoder(ABC):
+    """文本向量编码器"""
+
+    @property
+    @abstractmethod
+    def dim(self) -> int:
+        """The dimension of the embeddings."""
+
+    @abstractmethod
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into a float32 matrix, one row per text."""
+
+    @property
+    def memory_bytes(self) -> int:
+        """The memory held by the model weights, 0 when unknown."""
+        return 0
+
+    def close(self):
+        """Release the resources held outside of Python objects, such as worker processes."""
+
+
+class SentenceTransformerEncoder(Encoder):
+    """在当前进程中加载 SentenceTransformer 模型，torch 只在这里导入"""
+
+    def __init__(self, model_path: str = "", device: str = "", batch_size: int = 64, threads: int = 0):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+
+        if not model_path:
+            model_path = "uer/sbert-base-chinese-nli"
+        self.model_path = model_path
+
+        if not device:
+            # 如果是mac系统，使用mps
+            if "mac" in torch.__file__:
+                device = "mps"
+            else:
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        self.device = device
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name_or_path=model_path, device=device)
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(p.numel() * p.element_size() for p in self.model.parameters())
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=self.batch_size), dtype=np.float32)
+
+
+class CachedEncoder(Encoder):
+    """重复的文本只编码一次，有缓存时只把未命中的文本交给模型"""
+
+    def __init__(self, encoder: Encoder, cache: EmbeddingCache = None):
+        self.encoder = encoder
+        self.cache = cache
+
+    @property
+    def dim(self) -> int:
+        return self.encoder.dim
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.encoder.memory_bytes
+
+    def close(self):
+        self.encoder.close()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        keys = [text_key(text) for text in texts]
+        unique = dict(zip(keys, texts))
+        vectors = self.cache.get(list(unique.keys())) if self.cache else {}
+
+        misses = [key for key in unique if key not in vectors]
+        if misses:
+            embeddings = self.encoder.encode([unique[key] for key in misses])
+            if self.cache:
+                self.cache.put(misses, embeddings)
+            vectors.update(zip(misses, embeddings))
+
+        if not keys:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+
+
+def create_model_encoder(config: Config, threads: int = 0) -> Encoder:
+    """
+    按配置的后端在当前进程中加载模型
+    :param config: 配置
+    :param threads: 计算线程数，为 0 时使用后端自己的设置
+    """
+    if config.datasets_encoder_backend == "onnx":
+        from app.core.datasets.onnx_encoder import OnnxEncoder
+        return OnnxEncoder(config.datasets_model_name, f"{config.storage_dir}/onnx", config.datasets_onnx_quantize,
+                           config.datasets_encode_batch_size, threads or config.datasets_onnx_threads)
+    if config.datasets_encoder_backend == "torch":
+        return SentenceTransformerEncoder(config.datasets_model_name, config.datasets_device,
+                                          config.datasets_encode_batch_size, threads)
+    raise ValueError(f"unknown encoder backend: {config.datasets_encoder_backend}")
+
+
+def cache_model_name(config: Config) -> str:
+    """向量缓存的模型名称，量化后的向量与 fp32 有偏差，缓存分开存放"""
+    if config.datasets_encoder_backend == "onnx":
+        return f"{config.datasets_model_name}#onnx{'-int8' if config.datasets_onnx_quantize else ''}"
+    return config.datasets_model_name
+
+
+def create_local_encoder(config: Config) -> Encoder:
+    """按配置在当前进程中加载模型和向量缓存，配置了多个编码进程时模型加载在子进程中"""
+    if config.datasets_encode_workers > 1:
+        from app.core.datasets.sharded_encoder import ShardedEncoder
+        encoder = ShardedEncoder(config.datasets_encode_workers, config.datasets_encode_worker_threads,
+                                 config.datasets_encode_pin_cpus, config.datasets_encode_batch_size,
+                                 config=config)
+    else:
+        encoder = create_model_encoder(config)
+
+    cache = None
+    if config.datasets_embedding_cache_max_bytes > 0:
+        cache = EmbeddingCache(f"{config.storage_dir}/embedding_cache", cache_model_name(config), encoder.dim,
+                               config.datasets_embedding_cache_max_bytes, config.datasets_embedding_cache_dtype)
+    return CachedEncoder(encoder, cache)
+
+
+def create_encoder(config: Config) -> Encoder:
+    """配置了模型服务时通过 Unix socket 调用模型服务，否则在当前进程中加载模型"""
+    if config.datasets_model_server_socket:
+        from app.core.datasets.model_server import RemoteEncoder
+        return RemoteEncoder(config.datasets_model_server_socket, config.datasets_model_server_timeout,
+                             config.datasets_model_name, config.datasets_device)
+    return create_local_encoder(config)
@@ -0,0 +1,167 @@
+import gc
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Dict, Generic, Iterator, Tuple, TypeVar
+
+from app.config.config import Config, get_config
+from app.core.datasets.datasets_model import DatasetsModel
+from app.core.datasets.encoder import create_encoder
+from app.logger.logger import get_logger
+
+logger = get_logger("model_registry")
+
+T = TypeVar("T")
+
+# 新加载的模型先用这批文本跑一次，首个真实请求不再承担初始化的开销
+WARMUP_TEXTS = ["模型预热", "warm up the model"] * 4
+
+
+def model_config(config: Config, model_name: str = "", device: str = "") -> Config:
+    """The config with another model and device, empty values keep the configured ones."""
+    return config.model_copy(update={
+        "datasets_model_name": model_name or config.datasets_model_name,
+        "datasets_device": device or config.datasets_device,
+    })
+
+
+def allowed_models(config: Config) -> list[str]:
+    """The models tasks may select, the configured default model first."""
+    names = [config.datasets_model_name]
+    for name in config.datasets_allowed_models.split(","):
+        if name.strip() and name.strip() not in names:
+            names.append(name.strip())
+    return names
+
+
+class ModelRegistry(Generic[T]):
+    """
+    按 (模型名称, 设备) 按需加载模型，最多常驻 max_models 个，模型占用的内存合计超过 memory_budget 时
+    按 LRU 淘汰；同一个模型同时只加载一次，加载和预热在调用线程中进行，不要在事件循环中调用 acquire
+    使用方通过 lease 或 acquire/release 租用模型，被淘汰的模型等最后一个租用归还后才关闭
+    """
+
+    def __init__(self, factory: Callable[[str, str], T], max_models: int = 2, memory_budget: int = 0,
+                 warmup: Callable[[T], None] = None):
+        self.factory = factory
+        self.max_models = max(1, max_models)
+        self.memory_budget = memory_budget
+        self.warmup = warmup
+        self._lock = threading.Lock()
+        self._models: OrderedDict[Tuple[str, str], T] = OrderedDict()
+        self._loading: Dict[Tuple[str, str], threading.Lock] = {}
+        # 按模型对象计数，同一个 key 淘汰后重新加载的是另一个对象
+        self._leases: Dict[int, int] = {}
+        # 已经淘汰但仍有租用的模型，计数归零时关闭
+        self._retired: Dict[int, Tuple[Tuple[str, str], T]] = {}
+
+    def acquire(self, model_name: str, device: str = "") -> T:
+        """租用模型，用完后必须调用 release"""
+        key = (model_name, device)
+        with self._lock:
+            model = self._lease_resident(key)
+            if model is not None:
+                return model
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                model = self._lease_resident(key)
+                if model is not None:
+                    return model
+
+            logger.info(f"Loading model {model_name} on {device or 'default device'}")
+            model = self.factory(model_name, device)
+            if self.warmup:
+                self.warmup(model)
+
+            with self._lock:
+                self._models[key] = model
+                self._loading.pop(key, None)
+                self._leases[id(model)] = 1
+                self._evict(key)
+            return model
+
+    def release(self, model: T):
+        """归还租用，已淘汰的模型在最后一个租用归还后关闭"""
+        with self._lock:
+            count = self._leases.get(id(model), 0) - 1
+            if count > 0:
+                self._leases[id(model)] = count
+                return
+            self._leases.pop(id(model), None)
+            retired = self._retired.pop(id(model), None)
+        if retired is not None:
+            self._close(*retired)
+            gc.collect()
+
+    @contextmanager
+    def lease(self, model_name: str, device: str = "") -> Iterator[T]:
+        model = self.acquire(model_name, device)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def loaded(self) -> list[Tuple[str, str]]:
+        """The resident models, the least recently used first."""
+        with self._lock:
+            return list(self._models.keys())
+
+    def _lease_resident(self, key: Tuple[str, str]) -> T | None:
+        model = self._models.get(key)
+        if model is not None:
+            self._models.move_to_end(key)
+            self._leases[id(model)] = self._leases.get(id(model), 0) + 1
+        return model
+
+    @staticmethod
+    def _close(key: Tuple[str, str], model):
+        close = getattr(model, "close", None)
+        if close:
+            close()
+        logger.info(f"Closed model {key[0]} on {key[1] or 'default device'}")
+
+    def _evict(self, keep: Tuple[str, str]):
+        def over_budget() -> bool:
+            if len(self._models) > self.max_models:
+                return True
+            if self.memory_budget <= 0:
+                return False
+            return sum(getattr(m, "memory_bytes", 0) for m in self._models.values()) > self.memory_budget
+
+        evicted = False
+        for key in list(self._models.keys()):
+            if not over_budget():
+                break
+            if key == keep:
+                continue
+            model = self._models.pop(key)
+            logger.info(f"Evicted model {key[0]} on {key[1] or 'default device'}")
+            if self._leases.get(id(model), 0) > 0:
+                # 仍在使用，新的请求会重新加载，关闭推迟到最后一个租用归还
+                self._retired[id(model)] = (key, model)
+                continue
+            self._close(key, model)
+            evicted = True
+        if evicted:
+            gc.collect()
+
+
+def load_datasets_model(model_name: str, device: str) -> DatasetsModel:
+    config = model_config(get_config(), model_name, device)
+    return DatasetsModel(create_encoder(config), block_size=config.datasets_similarity_block_size,
+                         ann_min_size=config.datasets_similarity_ann_min_size,
+                         ann_top_k=config.datasets_similarity_ann_top_k)
+
+
+# web 进程中按需加载的 DatasetsModel，标注检测和语义搜索共用；
+# 配置了模型服务时各个 worker 共用模型服务进程中的模型，这里只保留客户端
+datasets_models: ModelRegistry[DatasetsModel] = ModelRegistry(load_datasets_model, get_config().datasets_model_max_resident,
+                                get_config().datasets_model_memory_budget,
+                                warmup=lambda model: model.encode(WARMUP_TEXTS))
+
+
+def use_datasets_model(model_name: str = "") -> ContextManager[DatasetsModel]:
+    """从注册表中租用模型，可能需要加载，不要在事件循环中调用"""
+    return datasets_models.lease(model_name or get_config().datasets_model_name, get_config().datasets_device)
@@ -0,0 +1,225 @@
+"""
+本地模型服务：单独的进程加载模型，通过 Unix socket 为各个 web worker 提供编码，
+同一时间窗口内不同 worker 的请求合并成一次前向计算
+
+    python -m app.core.datasets.model_server
+
+web worker 配置 datasets_model_server_socket 后不再加载模型，也不会导入 torch；
+服务端按请求中的模型名称和设备从 ModelRegistry 取模型，常驻模型的数量和内存由服务端的配置限制
+"""
+import asyncio
+import json
+import os
+import socket
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+
+from app.config.config import get_config
+from app.core.datasets.encoder import Encoder, create_local_encoder
+from app.core.datasets.model_registry import ModelRegistry, WARMUP_TEXTS, allowed_models, model_config
+from app.logger.logger import get_logger
+
+logger = get_logger("model_server")
+
+# 每一帧以 4 字节大端长度开头；请求是一帧 JSON，响应是一帧 JSON 头，编码成功时再跟一帧 float32 向量
+_LENGTH = struct.Struct(">I")
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("model server closed the connection")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    size, = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return _recv_exactly(sock, size)
+
+
+def _send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+class RemoteEncoder(Encoder):
+    """模型服务的客户端，每次调用使用一个新的连接，可以在多个线程中同时使用"""
+
+    def __init__(self, socket_path: str, timeout: float = 300, model_name: str = "", device: str = ""):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.model_name = model_name
+        self.device = device
+        self._dim = 0
+
+    def _call(self, request: dict) -> Tuple[dict, bytes]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            _send_frame(sock, json.dumps(request, ensure_ascii=False).encode("utf-8"))
+            header = json.loads(_recv_frame(sock))
+            if not header.get("ok"):
+                raise RuntimeError(f"model server error: {header.get('error')}")
+            body = _recv_frame(sock) if header.get("rows") is not None else b""
+            return header, body
+
+    @property
+    def dim(self) -> int:
+        if not self._dim:
+            header, _ = self._call({"op": "dim", "model": self.model_name, "device": self.device})
+            self._dim = header["dim"]
+        return self._dim
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        header, body = self._call({"op": "encode", "model": self.model_name, "device": self.device,
+                                   "texts": texts})
+        self._dim = header["dim"]
+        return np.frombuffer(body, dtype=np.float32).reshape(header["rows"], header["dim"])
+
+
+class ModelServer:
+    """
+    模型服务端，请求进入队列，批处理协程等待 max_wait_ms 或攒够 max_batch 条文本后按模型分组合并编码，
+    再按请求拆分结果；模型的加载和计算都只在一个线程中进行
+    """
+
+    def __init__(self, models: ModelRegistry[Encoder], socket_path: str, max_batch: int = 256,
+                 max_wait_ms: int = 5, default_model: str = "", default_device: str = "",
+                 allowed: List[str] = None):
+        self.models = models
+        self.default_model = default_model
+        self.default_device = default_device
+        self.allowed = allowed
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+
+    async def _read_frame(self, reader: asyncio.StreamReader) -> bytes:
+        size, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+        return await reader.readexactly(size)
+
+    @staticmethod
+    def _write_frame(writer: asyncio.StreamWriter, payload: bytes):
+        writer.write(_LENGTH.pack(len(payload)) + payload)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await self._read_frame(reader))
+            key = (request.get("model") or self.default_model, request.get("device") or self.default_device)
+            if self.allowed is not None and key[0] not in self.allowed:
+                self._write_frame(writer, json.dumps({"ok": False, "error": f"model {key[0]} is not allowed"})
+                                  .encode("utf-8"))
+            elif request.get("op") == "dim":
+                dim = await asyncio.get_running_loop().run_in_executor(self._executor, lambda: self._dim(key))
+                self._write_frame(writer, json.dumps({"ok": True, "dim": dim}).encode("utf-8"))
+            elif request.get("op") == "encode":
+                future = asyncio.get_running_loop().create_future()
+                await self._queue.put((key, request["texts"], future))
+                try:
+                    vectors = await future
+                except Exception as e:
+                    logger.error(f"Encode failed: {e}")
+                    self._write_frame(writer, json.dumps({"ok": False, "error": str(e)}).encode("utf-8"))
+                else:
+                    header = {"ok": True, "rows": int(vectors.shape[0]), "dim": int(vectors.shape[1])}
+                    self._write_frame(writer, json.dumps(header).encode("utf-8"))
+                    self._write_frame(writer, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            else:
+                self._write_frame(writer, json.dumps({"ok": False, "error": "unknown op"}).encode("utf-8"))
+            await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    def _dim(self, key: Tuple[str, str]) -> int:
+        with self.models.lease(*key) as encoder:
+            return encoder.dim
+
+    def _encode(self, key: Tuple[str, str], texts: List[str]) -> np.ndarray:
+        with self.models.lease(*key) as encoder:
+            return encoder.encode(texts)
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            total = len(batch[0][1])
+            deadline = loop.time() + self.max_wait
+            while total < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                total += len(item[1])
+
+            groups = OrderedDict()
+            for item in batch:
+                groups.setdefault(item[0], []).append(item[1:])
+            for key, items in groups.items():
+                await self._encode_group(key, items)
+
+    async def _encode_group(self, key: Tuple[str, str], items: list):
+        texts = [text for item_texts, _ in items for text in item_texts]
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self._executor, lambda: self._encode(key, texts))
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        offset = 0
+        for item_texts, future in items:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+        if len(items) > 1:
+            logger.info(f"Coalesced {len(items)} requests into one batch of {len(texts)} texts")
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        batcher = asyncio.create_task(self._batch_loop())
+        logger.info(f"Model server listening on {self.socket_path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def main():
+    config = get_config()
+    socket_path = config.datasets_model_server_socket or f"{config.storage_dir}/model_server.sock"
+    models = ModelRegistry(lambda name, device: create_local_encoder(model_config(config, name, device)),
+                           config.datasets_model_max_resident, config.datasets_model_memory_budget,
+                           warmup=lambda encoder: encoder.encode(WARMUP_TEXTS))
+    # 启动时先加载默认模型，第一个请求不用等待
+    with models.lease(config.datasets_model_name, config.datasets_device):
+        pass
+    server = ModelServer(models, socket_path, config.datasets_model_server_max_batch,
+                         config.datasets_model_server_max_wait_ms, config.datasets_model_name,
+                         config.datasets_device, allowed_models(config))
+    asyncio.run(server.serve())
+
+
+if __name__ == "__main__":
+    main()
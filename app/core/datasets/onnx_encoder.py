@@ -0,0 +1,176 @@
+"""
+ONNX Runtime 编码后端，面向只有 CPU 的节点：
+第一次使用时把 SentenceTransformer 的 transformer 部分导出成 ONNX，并做动态 int8 量化，之后只依赖 onnxruntime
+
+对比当前配置的 ONNX 后端与 fp32 PyTorch 的向量差异：
+
+    python -m app.core.datasets.onnx_encoder parity [texts.txt]
+"""
+import hashlib
+import json
+import os
+import sys
+from typing import List
+
+import numpy as np
+
+from app.core.datasets.encoder import Encoder
+from app.logger.logger import get_logger
+
+logger = get_logger("onnx_encoder")
+
+_INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def export_onnx(model_path: str, output_dir: str, quantize: bool = True):
+    """
+    导出 ONNX 模型、分词器和池化配置到 output_dir，需要 torch 和 sentence-transformers
+    :param model_path: SentenceTransformer 模型名称或路径
+    :param output_dir: 输出目录
+    :param quantize: 是否额外生成动态 int8 量化的模型
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Pooling, Normalize
+
+    model = SentenceTransformer(model_name_or_path=model_path, device="cpu")
+    transformer = model[0].auto_model.eval()
+    pooling = next(m for m in model if isinstance(m, Pooling))
+    if pooling.pooling_mode_cls_token:
+        pooling_mode = "cls"
+    elif pooling.pooling_mode_max_tokens:
+        pooling_mode = "max"
+    else:
+        pooling_mode = "mean"
+
+    class Wrapper(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs)))[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    dummy = model.tokenizer(["样例"], return_tensors="pt")
+    input_names = [name for name in _INPUT_NAMES if name in dummy]
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(Wrapper(), tuple(dummy[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=14)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(output_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    model.tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": model_path, "dim": model.get_sentence_embedding_dimension(), "pooling": pooling_mode,
+                   "normalize": any(isinstance(m, Normalize) for m in model),
+                   "max_seq_length": model.max_seq_length, "input_names": input_names}, f)
+    logger.info(f"Exported {model_path} to {output_dir}")
+
+
+def pool(hidden: np.ndarray, attention_mask: np.ndarray, mode: str) -> np.ndarray:
+    """与 SentenceTransformer 的 Pooling 层一致的池化"""
+    if mode == "cls":
+        return hidden[:, 0]
+    mask = attention_mask[:, :, None].astype(hidden.dtype)
+    if mode == "max":
+        return np.where(mask > 0, hidden, -1e9).max(axis=1)
+    return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+class OnnxEncoder(Encoder):
+    """
+    用 ONNX Runtime 在 CPU 上编码，输入按长度排序后分批，减少补齐带来的无效计算
+    导出的模型缓存在 export_dir 下，按模型名称区分
+    """
+
+    def __init__(self, model_path: str, export_dir: str, quantize: bool = True, batch_size: int = 64,
+                 threads: int = 0):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.model_path = model_path
+        self.quantize = quantize
+        self.batch_size = batch_size
+        model_dir = os.path.join(export_dir, hashlib.sha256(model_path.encode("utf-8")).hexdigest()[:16])
+        onnx_path = os.path.join(model_dir, "model.int8.onnx" if quantize else "model.onnx")
+        if not os.path.exists(onnx_path) or not os.path.exists(os.path.join(model_dir, "meta.json")):
+            export_onnx(model_path, model_dir, quantize)
+
+        with open(os.path.join(model_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self._memory_bytes = os.path.getsize(onnx_path)
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"]
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        result = np.zeros((len(texts), self.dim), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            inputs = self.tokenizer([texts[row] for row in rows], padding=True, truncation=True,
+                                    max_length=self.meta["max_seq_length"], return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in self.meta["input_names"]}
+            hidden = self.session.run(None, feed)[0]
+            result[rows] = pool(hidden, inputs["attention_mask"], self.meta["pooling"])
+        if self.meta["normalize"]:
+            result /= np.clip(np.linalg.norm(result, axis=1, keepdims=True), 1e-12, None)
+        return result
+
+
+def parity_check(reference: Encoder, candidate: Encoder, texts: List[str]) -> dict:
+    """
+    比较两个编码器对同一批文本的向量，返回逐条余弦相似度的统计，drift 是 1 - 余弦相似度
+    """
+    a = reference.encode(texts)
+    b = candidate.encode(texts)
+    cosine = (a * b).sum(axis=1) / np.clip(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12, None)
+    return {
+        "texts": len(texts),
+        "meanCosine": float(cosine.mean()),
+        "minCosine": float(cosine.min()),
+        "meanDrift": float(1 - cosine.mean()),
+        "maxDrift": float(1 - cosine.min()),
+    }
+
+
+def main():
+    from app.config.config import get_config
+    from app.core.datasets.encoder import SentenceTransformerEncoder
+
+    if len(sys.argv) < 2 or sys.argv[1] != "parity":
+        print("usage: python -m app.core.datasets.onnx_encoder parity [texts.txt]")
+        sys.exit(1)
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = ["今天天气怎么样", "我想查询一下订单状态", "如何修改收货地址", "退款多久能到账",
+                 "你们的客服电话是多少", "这个商品有优惠吗", "怎么开发票", "会员积分怎么使用"]
+
+    config = get_config()
+    reference = SentenceTransformerEncoder(config.datasets_model_name, "cpu", config.datasets_encode_batch_size)
+    candidate = OnnxEncoder(config.datasets_model_name, f"{config.storage_dir}/onnx", config.datasets_onnx_quantize,
+                            config.datasets_encode_batch_size, config.datasets_onnx_threads)
+    print(json.dumps(parity_check(reference, candidate, texts), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, ContextManager, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from app.core.datasets.datasets_model import DatasetsModel
+from app.core.datasets.similarity import normalize, ann_available
+
+
+class SearchEntry(NamedTuple):
+    """A text to index, detached from the database session."""
+    owner: str
+    """The UUID of the dataset segment or annotation segment the text belongs to."""
+    source: str
+    """segment or annotation."""
+    text: str
+    serial_number: int = 0
+    annotation_uuid: str = ""
+
+
+class SearchHit(BaseModel):
+    """A segment matching a search query."""
+    source: str = ""
+    """segment for a dataset segment, annotation for an annotated input or question."""
+    uuid: str = ""
+    """The UUID of the dataset segment or annotation segment."""
+    text: str = ""
+    """The matching text."""
+    score: float = 0
+    """The cosine similarity of the text and the query."""
+    serialNumber: int = 0
+    """The serial number of the dataset segment."""
+    annotationId: str = ""
+    """The annotation task of an annotation segment."""
+
+
+class VectorIndex:
+    """
+    只追加的向量矩阵，每个 owner 可以有多行；更新时旧行标记删除，容量不足时先压缩掉删除的行
+    精确检索是一次矩阵向量乘加 argpartition，受内存带宽限制，十万行、768 维单核约几十毫秒；
+    行数达到 ann_min_size 且安装了 hnswlib 时另建 HNSW 索引，新增的行直接加入，删除的行标记删除，
+    只有压缩改变行号后才重建；HNSW 由调用方在锁外根据快照构建，建好之前用精确检索
+    """
+
+    def __init__(self, ann_min_size: int = 0):
+        self.ann_min_size = ann_min_size
+        self.ann = None
+        # 维度在第一次加入向量时确定
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.size = 0
+        self.entries: List[SearchEntry] = []
+        self.rows: Dict[str, List[int]] = {}
+        # 压缩后行号改变，旧快照构建的 HNSW 索引作废
+        self.generation = 0
+
+    def remove(self, owner: str):
+        for row in self.rows.pop(owner, []):
+            self.alive[row] = False
+            if self.ann is not None:
+                self.ann.mark_deleted(row)
+
+    def add(self, entries: List[SearchEntry], vectors: np.ndarray):
+        count = len(entries)
+        if self.size + count > len(self.vectors):
+            self._compact(self.size + count, vectors.shape[1])
+        self.vectors[self.size:self.size + count] = vectors
+        self.alive[self.size:self.size + count] = True
+        for row, entry in enumerate(entries, self.size):
+            self.rows.setdefault(entry.owner, []).append(row)
+        self.entries.extend(entries)
+        if self.ann is not None:
+            if self.size + count > self.ann.get_max_elements():
+                self.ann.resize_index(len(self.vectors))
+            self.ann.add_items(vectors, np.arange(self.size, self.size + count))
+        self.size += count
+
+    def ann_snapshot(self) -> Tuple[int, int, np.ndarray, np.ndarray] | None:
+        """需要建 HNSW 索引时返回 (generation, size, 存活行号, 向量副本)，在锁内调用"""
+        if self.ann is not None or not self.ann_min_size or self.size < self.ann_min_size or not ann_available():
+            return None
+        rows = np.nonzero(self.alive[:self.size])[0]
+        return self.generation, self.size, rows, self.vectors[rows]
+
+    def build_ann(self, rows: np.ndarray, vectors: np.ndarray):
+        """根据快照构建 HNSW 索引，耗时较长，在锁外调用"""
+        import hnswlib
+
+        ann = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        ann.init_index(max_elements=len(self.vectors), ef_construction=200, M=16)
+        ann.add_items(vectors, rows)
+        return ann
+
+    def install_ann(self, ann, generation: int, size: int, rows: np.ndarray) -> bool:
+        """在锁内换上快照构建的索引，补上快照之后的增删；期间发生过压缩则丢弃"""
+        if generation != self.generation or self.ann is not None:
+            return False
+        deleted = rows[~self.alive[rows]]
+        for row in deleted.tolist():
+            ann.mark_deleted(row)
+        added = np.arange(size, self.size)[self.alive[size:self.size]]
+        if len(added):
+            ann.add_items(self.vectors[added], added)
+        self.ann = ann
+        return True
+
+    def search(self, vector: np.ndarray, top_k: int) -> List[Tuple[SearchEntry, float]]:
+        """每个 owner 只返回得分最高的一行，按得分从高到低"""
+        if not self.size or top_k <= 0:
+            return []
+        # 同一个 owner 可能占多行，多取一些候选再去重
+        candidates = min(self.size, top_k * 4)
+        if self.ann is not None:
+            alive = int(self.alive[:self.size].sum())
+            if not alive:
+                return []
+            self.ann.set_ef(max(candidates, 64))
+            labels, distances = self.ann.knn_query(vector, k=min(candidates, alive))
+            # inner product 空间的距离是 1 - 相似度
+            rows, scores = labels[0].astype(np.int64), 1 - distances[0]
+        else:
+            all_scores = self.vectors[:self.size] @ vector
+            all_scores[~self.alive[:self.size]] = -np.inf
+            rows = np.argpartition(-all_scores, candidates - 1)[:candidates]
+            rows = rows[np.argsort(-all_scores[rows], kind="stable")]
+            scores = all_scores[rows]
+        hits, seen = [], set()
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            if score == -np.inf or len(hits) >= top_k:
+                break
+            entry = self.entries[row]
+            if entry.owner not in seen:
+                seen.add(entry.owner)
+                hits.append((entry, float(score)))
+        return hits
+
+    def _compact(self, required: int, dim: int):
+        keep = np.nonzero(self.alive[:self.size])[0]
+        capacity = max(required - self.size + len(keep), 2 * len(keep), 1024)
+        vectors = np.zeros((capacity, dim), dtype=np.float32)
+        if len(keep):
+            vectors[:len(keep)] = self.vectors[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(keep)] = True
+        self.vectors, self.alive, self.size = vectors, alive, len(keep)
+        self.entries = [self.entries[row] for row in keep]
+        self.rows = {}
+        for row, entry in enumerate(self.entries):
+            self.rows.setdefault(entry.owner, []).append(row)
+        # 行号变了，HNSW 索引需要重建
+        self.ann = None
+        self.generation += 1
+
+
+class DatasetSearchIndex:
+    """
+    单个数据集的检索索引：数据集切片的内容，加上基于该数据集的标注任务中已完成样本的输入和问题
+    切片只追加，按 ID 记录水位；标注样本按任务记录 (change_seq, id) 水位
+    """
+
+    def __init__(self, model_name: str = "", ann_min_size: int = 0):
+        self.lock = threading.Lock()
+        self.model_name = model_name
+        self.index = VectorIndex(ann_min_size)
+        self.segment_watermark = 0
+        self.annotation_watermarks: Dict[int, Tuple[int, int]] = {}
+
+
+class DatasetSearcher:
+    """
+    数据集语义搜索：每个进程为最近搜索的数据集维护向量索引，由后台同步把新增或变更的样本编码加入索引，
+    搜索只查询当前索引，不等待同步；编码和 HNSW 构建都在索引锁之外进行，不阻塞并发的搜索
+    最多保留 max_datasets 个数据集的索引，按 LRU 淘汰；编码经过向量缓存，淘汰或重启后重建时不再重新计算
+    """
+
+    def __init__(self, models: Callable[[str], ContextManager[DatasetsModel]], max_datasets: int = 4,
+                 ann_min_size: int = 0):
+        self.models = models
+        self.max_datasets = max_datasets
+        self.ann_min_size = ann_min_size
+        self._lock = threading.Lock()
+        self._datasets: OrderedDict[int, DatasetSearchIndex] = OrderedDict()
+
+    def _index(self, dataset_id: int, model_name: str) -> DatasetSearchIndex:
+        with self._lock:
+            index = self._datasets.get(dataset_id)
+            if index is None or index.model_name != model_name:
+                index = DatasetSearchIndex(model_name, self.ann_min_size)
+                self._datasets[dataset_id] = index
+                while len(self._datasets) > self.max_datasets:
+                    self._datasets.popitem(last=False)
+            self._datasets.move_to_end(dataset_id)
+            return index
+
+    def has_index(self, dataset_id: int, model_name: str) -> bool:
+        """本进程是否已有该数据集的索引，写入时只同步已有的索引"""
+        with self._lock:
+            index = self._datasets.get(dataset_id)
+            return index is not None and index.model_name == model_name
+
+    def segment_watermark(self, dataset_id: int, model_name: str) -> int:
+        """The ID of the last dataset segment added to the index."""
+        return self._index(dataset_id, model_name).segment_watermark
+
+    def annotation_watermarks(self, dataset_id: int, model_name: str,
+                              annotation_ids: List[int]) -> Dict[int, Tuple[int, int]]:
+        """The (change_seq, id) of the last annotation segment of each task applied to the index."""
+        index = self._index(dataset_id, model_name)
+        with index.lock:
+            return {annotation_id: index.annotation_watermarks.get(annotation_id, (0, 0))
+                    for annotation_id in annotation_ids}
+
+    def _encode(self, model_name: str, entries: List[SearchEntry]) -> np.ndarray:
+        with self.models(model_name) as model:
+            return normalize(model.encode([entry.text for entry in entries]))
+
+    def add_segments(self, dataset_id: int, model_name: str, segments: List[Tuple[int, SearchEntry]]):
+        """加入按 ID 排序的 (切片ID, 文本) 新切片，已经加入的跳过"""
+        index = self._index(dataset_id, model_name)
+        with index.lock:
+            segments = [(segment_id, entry) for segment_id, entry in segments if segment_id > index.segment_watermark]
+        if not segments:
+            return
+        entries = [entry for _, entry in segments]
+        vectors = self._encode(model_name, entries)
+        with index.lock:
+            # 编码期间其他同步可能已经加入了一部分
+            keep = [i for i, (segment_id, _) in enumerate(segments) if segment_id > index.segment_watermark]
+            if keep:
+                index.index.add([entries[i] for i in keep], vectors[keep])
+                index.segment_watermark = segments[-1][0]
+        self.refresh_ann(dataset_id, model_name)
+
+    def apply_annotations(self, dataset_id: int, model_name: str, watermarks: Dict[int, Tuple[int, int]],
+                          changed: Dict[str, List[SearchEntry]]):
+        """
+        应用一页按 (任务, change_seq, id) 排序的变更，watermarks 是这一页中每个任务的最后水位，
+        changed 是样本 UUID 到其当前文本的映射，没有文本（放弃、重新标注中）的样本只从索引中删除
+        """
+        index = self._index(dataset_id, model_name)
+        entries = [entry for texts in changed.values() for entry in texts]
+        vectors = self._encode(model_name, entries) if entries else None
+        with index.lock:
+            for owner in changed:
+                index.index.remove(owner)
+            if entries:
+                index.index.add(entries, vectors)
+            for annotation_id, watermark in watermarks.items():
+                if watermark > index.annotation_watermarks.get(annotation_id, (0, 0)):
+                    index.annotation_watermarks[annotation_id] = watermark
+        self.refresh_ann(dataset_id, model_name)
+
+    def refresh_ann(self, dataset_id: int, model_name: str):
+        """行数达到阈值或压缩之后，在锁外根据快照重建 HNSW 索引再换上，构建期间搜索用精确检索"""
+        index = self._index(dataset_id, model_name)
+        with index.lock:
+            snapshot = index.index.ann_snapshot()
+        if snapshot is None:
+            return
+        generation, size, rows, vectors = snapshot
+        ann = index.index.build_ann(rows, vectors)
+        with index.lock:
+            index.index.install_ann(ann, generation, size, rows)
+
+    def search(self, dataset_id: int, model_name: str, query: str, top_k: int = 10) -> List[SearchHit]:
+        index = self._index(dataset_id, model_name)
+        vector = self._encode(model_name, [SearchEntry(owner="", source="", text=query)])[0]
+        with index.lock:
+            hits = index.index.search(vector, top_k)
+        return [SearchHit(source=entry.source, uuid=entry.owner, text=entry.text, score=score,
+                          serialNumber=entry.serial_number, annotationId=entry.annotation_uuid)
+                for entry, score in hits]
@@ -0,0 +1,143 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+from typing import List
+
+import numpy as np
+
+from app.config.config import Config, get_config
+from app.core.datasets.encoder import Encoder
+from app.logger.logger import get_logger
+
+logger = get_logger("sharded_encoder")
+
+
+def _worker_main(config: Config, threads: int, cpus: List[int], tasks: multiprocessing.Queue,
+                 results: multiprocessing.Queue):
+    """编码子进程：先固定 CPU 和线程数再加载模型，向量直接写进共享内存，只回传完成状态"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    # 线程库在导入时读取这些变量，必须在加载模型之前设置
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+
+    from app.core.datasets.encoder import create_model_encoder
+
+    try:
+        encoder = create_model_encoder(config or get_config(), threads)
+        results.put(("ready", encoder.dim))
+    except Exception as e:
+        results.put(("ready", repr(e)))
+        return
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, shm_name, shape, rows, texts = task
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+                out[rows] = encoder.encode(texts)
+                del out
+            finally:
+                shm.close()
+            results.put((task_id, None))
+        except Exception as e:
+            results.put((task_id, repr(e)))
+
+
+class ShardedEncoder(Encoder):
+    """
+    把一次编码拆分到多个子进程，每个子进程固定线程数（可选绑定 CPU），各自加载一份模型
+    结果写入父进程创建的共享内存，大数组不经过 pickle；文本按长度交错分片，使各分片的计算量接近
+    """
+
+    def __init__(self, workers: int, threads: int = 0, pin_cpus: bool = True, batch_size: int = 64,
+                 timeout: float = 600, config: Config = None):
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers
+        self.threads = threads or max(1, cpu_count // workers)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+
+        context = multiprocessing.get_context("spawn")
+        self._results = context.Queue()
+        self._tasks = []
+        self._processes = []
+        for i in range(workers):
+            cpus = list(range(i * self.threads, (i + 1) * self.threads)) if pin_cpus else []
+            cpus = [cpu % cpu_count for cpu in cpus]
+            tasks = context.Queue()
+            process = context.Process(target=_worker_main, args=(config, self.threads, cpus, tasks, self._results),
+                                      daemon=True, name=f"encoder-{i}")
+            process.start()
+            self._tasks.append(tasks)
+            self._processes.append(process)
+
+        dims = {self._get()[1] for _ in range(workers)}
+        errors = [dim for dim in dims if not isinstance(dim, int)]
+        if errors:
+            self.close()
+            raise RuntimeError(f"encoder worker failed to start: {errors[0]}")
+        self._dim = dims.pop()
+        logger.info(f"Started {workers} encoder workers with {self.threads} threads each")
+
+    def _get(self):
+        # 分段等待，子进程意外退出时尽快报错而不是一直阻塞
+        waited = 0
+        while True:
+            try:
+                return self._results.get(timeout=5)
+            except queue.Empty:
+                waited += 5
+                dead = [p.name for p in self._processes if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"encoder worker exited: {', '.join(dead)}")
+                if waited >= self.timeout:
+                    raise TimeoutError("encoder workers did not answer in time")
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        shards = min(self.workers, -(-len(texts) // self.batch_size))
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        shape = (len(texts), self.dim)
+        with self._lock:
+            shm = shared_memory.SharedMemory(create=True, size=len(texts) * self.dim * 4)
+            try:
+                pending = {}
+                for i in range(shards):
+                    rows = order[i::shards]
+                    task_id = next(self._task_ids)
+                    pending[task_id] = i
+                    self._tasks[i].put((task_id, shm.name, shape, rows, [texts[row] for row in rows]))
+
+                errors = []
+                while pending:
+                    task_id, error = self._get()
+                    if pending.pop(task_id, None) is not None and error:
+                        errors.append(error)
+                if errors:
+                    raise RuntimeError(f"encoder worker failed: {errors[0]}")
+                return np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+            finally:
+                shm.close()
+                shm.unlink()
+
+    def close(self):
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
@@ -0,0 +1,82 @@
+import importlib.util
+from typing import Callable, Tuple
+
+import numpy as np
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """L2 normalize rows into float32, so that a dot product is the cosine similarity."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+
+def similar_pairs(embeddings: np.ndarray, threshold: float, block_size: int = 2048,
+                  cancelled: Callable[[], bool] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    找出余弦相似度不低于 threshold 的所有 (row, col) 对，row < col，按 row、col 升序
+    按块计算上三角部分，内存占用为 block_size²，不随样本数平方增长
+    :param embeddings: 向量矩阵，每行一个文本
+    :param threshold: 相似度阈值
+    :param block_size: 每块的行数
+    :param cancelled: 每块计算前调用，返回 True 时停止并返回已找到的结果
+    :return: rows, cols
+    """
+    vectors = normalize(embeddings)
+    n = len(vectors)
+    rows, cols = [], []
+    for start in range(0, n, block_size):
+        if cancelled and cancelled():
+            break
+        end = min(start + block_size, n)
+        block_rows, block_cols = [], []
+        for other in range(start, n, block_size):
+            other_end = min(other + block_size, n)
+            scores = vectors[start:end] @ vectors[other:other_end].T
+            r, c = np.nonzero(scores >= threshold)
+            r += start
+            c += other
+            upper = r < c
+            block_rows.append(r[upper])
+            block_cols.append(c[upper])
+        r = np.concatenate(block_rows)
+        c = np.concatenate(block_cols)
+        order = np.lexsort((c, r))
+        rows.append(r[order])
+        cols.append(c[order])
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def ann_available() -> bool:
+    return importlib.util.find_spec("hnswlib") is not None
+
+
+def similar_pairs_ann(embeddings: np.ndarray, threshold: float, top_k: int = 50) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    用 HNSW 近似检索相似对，每个文本只看最近的 top_k 个邻居，结果可能漏掉少量相似对
+    返回格式与 similar_pairs 相同
+    """
+    import hnswlib
+
+    vectors = normalize(embeddings)
+    n, dim = vectors.shape
+    if n < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    k = min(top_k + 1, n)
+    index = hnswlib.Index(space="ip", dim=dim)
+    index.init_index(max_elements=n, ef_construction=200, M=16)
+    index.add_items(vectors, np.arange(n))
+    index.set_ef(max(k, 64))
+    labels, distances = index.knn_query(vectors, k=k)
+
+    # inner product 空间的距离是 1 - 相似度
+    r = np.repeat(np.arange(n), k)
+    c = labels.reshape(-1).astype(np.int64)
+    keep = (1 - distances.reshape(-1)) >= threshold
+    r, c = r[keep], c[keep]
+    pairs = np.unique(np.stack([np.minimum(r, c), np.maximum(r, c)], axis=1), axis=0)
+    pairs = pairs[pairs[:, 0] < pairs[:, 1]]
+    return pairs[:, 0], pairs[:, 1]
@@ -1,6 +1,7 @@
 import enum
 
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, text, Text
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, text, Text, Index, Float
+from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.orm import relationship
 
 from app.models.base import Base
@@ -25,6 +26,14 @@ class DataAnnotationSegmentType(str, enum.Enum):
     TEST = "test"
 
 
+class DataAnnotationDetectJobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
 class DataAnnotation(Base):
     """
     标注任务表
@@ -48,6 +57,8 @@ class DataAnnotation(Base):
     test_total = Column(Integer, nullable=True, default=0, comment="测试数据总量")
     remark = Column(String(1000), nullable=True, comment="备注")
     test_repo = Column(Text, nullable=True, comment="测试数据仓库")
+    model_name = Column(String(128), nullable=True, comment="检测使用的向量模型，为空时使用默认模型")
+    content_version = Column(Integer, nullable=False, default=0, server_default=text('0'), comment="内容版本号")
     created_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'), comment="创建时间")
     updated_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'), comment="更新时间")
     deleted_at = Column(DateTime, nullable=True, comment="删除时间")
@@ -61,11 +72,18 @@ class DataAnnotationSegments(Base):
     标注任务样本表
     """
     __tablename__ = "data_annotation_segments"
+    __table_args__ = (
+        Index("idx_data_annotation_segments_status", "data_annotation_id", "status"),
+        Index("idx_data_annotation_segments_lease", "data_annotation_id", "lease_owner"),
+        Index("idx_data_annotation_segments_ordinal", "data_annotation_id", "ordinal", unique=True),
+        Index("idx_data_annotation_segments_change_seq", "data_annotation_id", "change_seq"),
+    )
 
     id = Column(Integer, primary_key=True)
     uuid = Column(String(64), unique=True, index=True, comment="样本ID")
     data_annotation_id = Column(Integer, ForeignKey("data_annotations.id"), comment="标注任务ID")
     segment_id = Column(Integer, ForeignKey("dataset_segments.id"), comment="样本ID")
+    ordinal = Column(Integer, nullable=True, comment="任务内序号")
     annotation_type = Column(String(12), index=True, comment="标注类型")
     segment_content = Column(Text, nullable=True, comment="样本内容")
     document = Column(String(2000), nullable=True, comment="标注文本")
@@ -78,9 +96,111 @@ class DataAnnotationSegments(Base):
     segment_type = Column(String(12), nullable=True, index=True, default=DataAnnotationSegmentType.TRAIN,
                           comment="样本类型")
     creator_email = Column(String(32), nullable=True, comment="创建人邮箱")
+    lease_owner = Column(String(64), nullable=True, comment="领取人")
+    lease_expires_at = Column(DateTime, nullable=True, comment="领取过期时间")
+    change_seq = Column(Integer, nullable=True, comment="变更序号，取变更时任务的内容版本号")
     created_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'), comment="创建时间")
     updated_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'), comment="更新时间")
     deleted_at = Column(DateTime, nullable=True, comment="删除时间")
 
     DataAnnotation = relationship("DataAnnotation", back_populates="Segments")
     Segments = relationship("DatasetSegments", back_populates="DataAnnotationSegments")
+
+
+class DataAnnotationDetectJob(Base):
+    """
+    标注任务检测作业表
+    """
+    __tablename__ = "data_annotation_detect_jobs"
+
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(64), unique=True, index=True, comment="作业ID")
+    tenant_id = Column(Integer, index=True, comment="租户ID")
+    data_annotation_id = Column(Integer, ForeignKey("data_annotations.id"), index=True, comment="标注任务ID")
+    status = Column(String(12), index=True, default=DataAnnotationDetectJobStatus.PENDING, comment="作业状态")
+    message = Column(String(1000), nullable=True, comment="失败原因")
+    result = Column(Text().with_variant(LONGTEXT, "mysql"), nullable=True, comment="检测结果")
+    started_at = Column(DateTime, nullable=True, comment="开始时间")
+    finished_at = Column(DateTime, nullable=True, comment="结束时间")
+    created_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'), comment="创建时间")
+    updated_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'), comment="更新时间")
+
+
+class DataAnnotationMismatchedIntent(Base):
+    """
+    检测结果：相似的问题被标成了不同的意图
+    """
+    __tablename__ = "data_annotation_mismatched_intents"
+    __table_args__ = (
+        Index("idx_data_annotation_mismatched_intents_pair", "detect_job_id", "intent1", "intent2"),
+        Index("idx_data_annotation_mismatched_intents_intent2", "detect_job_id", "intent2"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    data_annotation_id = Column(Integer, ForeignKey("data_annotations.id"), index=True, comment="标注任务ID")
+    detect_job_id = Column(Integer, ForeignKey("data_annotation_detect_jobs.id"), comment="检测作业ID")
+    intent1 = Column(String(32), comment="意图1")
+    intent2 = Column(String(32), comment="意图2")
+    question1 = Column(String(2000), comment="问题1")
+    question2 = Column(String(2000), comment="问题2")
+    answer1 = Column(String(2000), nullable=True, comment="答案1")
+    answer2 = Column(String(2000), nullable=True, comment="答案2")
+    line_number1 = Column(Integer, comment="问题1所在样本的序号")
+    line_number2 = Column(Integer, comment="问题2所在样本的序号")
+
+
+class DataAnnotationSimilarIntent(Base):
+    """
+    检测结果：含义相近的意图
+    """
+    __tablename__ = "data_annotation_similar_intents"
+    __table_args__ = (
+        Index("idx_data_annotation_similar_intents_pair", "detect_job_id", "intent1", "intent2"),
+        Index("idx_data_annotation_similar_intents_intent2", "detect_job_id", "intent2"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    data_annotation_id = Column(Integer, ForeignKey("data_annotations.id"), index=True, comment="标注任务ID")
+    detect_job_id = Column(Integer, ForeignKey("data_annotation_detect_jobs.id"), comment="检测作业ID")
+    intent1 = Column(String(32), comment="意图1")
+    intent2 = Column(String(32), comment="意图2")
+    similarity = Column(Float, comment="相似度")
+
+
+class DataAnnotationUngroundedOutput(Base):
+    """
+    检测结果：RAG/通用样本的答案与文档和问题都不相关
+    """
+    __tablename__ = "data_annotation_ungrounded_outputs"
+    __table_args__ = (
+        Index("idx_data_annotation_ungrounded_outputs_score", "detect_job_id", "score"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    data_annotation_id = Column(Integer, ForeignKey("data_annotations.id"), index=True, comment="标注任务ID")
+    detect_job_id = Column(Integer, ForeignKey("data_annotation_detect_jobs.id"), comment="检测作业ID")
+    question = Column(String(2000), nullable=True, comment="问题")
+    output = Column(String(2000), comment="答案")
+    score = Column(Float, comment="答案与文档片段、问题的最高相似度")
+    line_number = Column(Integer, comment="样本的序号")
+
+
+class DataAnnotationDuplicateQuestion(Base):
+    """
+    检测结果：RAG/通用样本之间近似重复的问题
+    """
+    __tablename__ = "data_annotation_duplicate_questions"
+    __table_args__ = (
+        Index("idx_data_annotation_duplicate_questions_similarity", "detect_job_id", "similarity"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    data_annotation_id = Column(Integer, ForeignKey("data_annotations.id"), index=True, comment="标注任务ID")
+    detect_job_id = Column(Integer, ForeignKey("data_annotation_detect_jobs.id"), comment="检测作业ID")
+    question1 = Column(String(2000), comment="问题1")
+    question2 = Column(String(2000), comment="问题2")
+    answer1 = Column(String(2000), nullable=True, comment="答案1")
+    answer2 = Column(String(2000), nullable=True, comment="答案2")
+    similarity = Column(Float, comment="相似度")
+    line_number1 = Column(Integer, comment="问题1所在样本的序号")
+    line_number2 = Column(Integer, comment="问题2所在样本的序号")
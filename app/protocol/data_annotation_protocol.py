@@ -3,7 +3,8 @@ from typing import List
 from fastapi import UploadFile, File
 from pydantic import BaseModel
 
-from app.core.datasets.datasets_model import MismatchedIntents, SimilarIntents
+from app.core.datasets.conflict_index import IntentConflict
+from app.core.datasets.datasets_model import MismatchedIntents, SimilarIntents, UngroundedOutput, DuplicateQuestions
 
 
 class AnnotationCreateRequest(BaseModel):
@@ -20,6 +21,8 @@ class AnnotationCreateRequest(BaseModel):
     """The data sequence of the annotation."""
     annotationType: str
     """The type of the annotation."""
+    modelName: str = ""
+    """The embedding model used by detection, empty uses the default model."""
 
 
 class DataAnnotationResponse(BaseModel):
@@ -56,6 +59,8 @@ class DataAnnotationResponse(BaseModel):
     """The test total of the annotation."""
     testRepo: str = ""
     """The test repo of the annotation."""
+    modelName: str = ""
+    """The embedding model used by detection."""
 
 
 class DataAnnotationsResponse(BaseModel):
@@ -100,6 +105,14 @@ class DataAnnotationSegmentResponse(BaseModel):
     """The creator email of the segment."""
     index: int = 0
     """The index of the segment."""
+    leaseExpiresAt: str = ""
+    """The time the annotator's claim on the segment expires."""
+    ordinal: int = -1
+    """The position of the segment in the task, starting from 0."""
+    previousOrdinal: int = -1
+    """The ordinal of the previous segment, -1 for the first segment."""
+    nextOrdinal: int = -1
+    """The ordinal of the next segment, -1 for the last segment."""
 
 
 class DataAnnotationSegmentMarkRequest(BaseModel):
@@ -117,17 +130,185 @@ class DataAnnotationSegmentMarkRequest(BaseModel):
     output: str = None
 
 
+class DataAnnotationSegmentMarkResponse(BaseModel):
+    """The response model for marking a segment."""
+    conflicts: List[IntentConflict] = []
+    """Near duplicate questions already marked with another intent, FAQ only."""
+
+
+class DataAnnotationSegmentBatchMarkItem(DataAnnotationSegmentMarkRequest):
+    """One mark or abandon in a batch request."""
+    segmentId: str
+    """The ID of the segment."""
+    action: str = "mark"
+    """The action to apply, mark or abandon."""
+
+
+class DataAnnotationSegmentBatchMarkRequest(BaseModel):
+    """The request model for marking segments in batch."""
+    items: List[DataAnnotationSegmentBatchMarkItem] = []
+    """The marks and abandons to apply."""
+
+
+class DataAnnotationSegmentBatchMarkResult(BaseModel):
+    """The result of one item in a batch mark request."""
+    segmentId: str
+    """The ID of the segment."""
+    success: bool = True
+    """Whether the item was applied."""
+    message: str = ""
+    """The reason the item was rejected."""
+    conflicts: List[IntentConflict] = []
+    """Near duplicate questions already marked with another intent, FAQ marks only."""
+
+
+class DataAnnotationSegmentBatchMarkResponse(BaseModel):
+    """The response model for marking segments in batch."""
+    results: List[DataAnnotationSegmentBatchMarkResult] = []
+    """The per-item results, in request order."""
+    succeeded: int = 0
+    """The number of items applied."""
+    failed: int = 0
+    """The number of items rejected."""
+
+
 class DataAnnotationSplitRequest(BaseModel):
     """The request model for splitting an annotation."""
     trainPercent: float = 1.0
     """The train percent of the annotation."""
     testPercent: float = 0.0
     """The test percent of the annotation."""
+    seed: int = 0
+    """The seed of the split, the same seed always gives the same split."""
+    stratifyByIntent: bool = False
+    """Whether to split each intent separately."""
+
+
+class DataAnnotationDeltaSegment(BaseModel):
+    """A segment changed since the requested watermark."""
+    uuid: str
+    """The ID of the segment."""
+    status: str
+    """The status of the segment."""
+    segmentType: str = ""
+    """The segment type, train or test."""
+    document: str = ""
+    """The document of the segment."""
+    instruction: str = ""
+    """The instruction of the segment."""
+    input: str = ""
+    """The input of the segment."""
+    question: str = ""
+    """The question of the segment."""
+    intent: str = ""
+    """The intent of the segment."""
+    output: str = ""
+    """The output of the segment."""
+    changeSeq: int = 0
+    """The change sequence of the segment."""
+    updatedAt: str = ""
+    """The updated time of the segment."""
+
+
+class DataAnnotationDeltaResponse(BaseModel):
+    """The response model for an incremental export."""
+    list: List[DataAnnotationDeltaSegment] = []
+    """The changed segments, ordered by change sequence."""
+    watermark: int = 0
+    """The watermark to pass as since on the next request."""
+    watermarkId: int = 0
+    """The watermark to pass as sinceId on the next request."""
+    hasMore: bool = False
+    """Whether more changes are available after the watermark."""
 
 
 class DataAnnotationDetectResponse(BaseModel):
-    """The response model for detecting an annotation."""
-    mismatchedIntents: List[MismatchedIntents] = []
-    """The mismatched intents of the annotation."""
-    similarIntents: List[SimilarIntents] = []
-    """The similar intents of the annotation."""
+    """The summary of detecting an annotation, the findings are listed page by page."""
+    mismatchedTotal: int = 0
+    """The number of similar question pairs labelled with different intents."""
+    mismatchedIntentPairs: int = 0
+    """The number of distinct intent pairs among the mismatched questions."""
+    similarTotal: int = 0
+    """The number of similar intent pairs."""
+    ungroundedTotal: int = 0
+    """The number of RAG/GENERAL answers not grounded in their document and question."""
+    duplicateQuestionTotal: int = 0
+    """The number of near duplicate RAG/GENERAL question pairs."""
+    truncated: bool = False
+    """Whether only the first annotation_detect_result_max findings of a kind were stored."""
+
+
+class DataAnnotationMismatchedIntentsResponse(BaseModel):
+    """The response model for a page of mismatched intents."""
+    list: List[MismatchedIntents] = []
+    """The mismatched question pairs."""
+    total: int = 0
+    """The total of the matching question pairs."""
+    page: int = 1
+    """The page of the question pairs."""
+    pageSize: int = 20
+    """The page size of the question pairs."""
+
+
+class DataAnnotationSimilarIntentsResponse(BaseModel):
+    """The response model for a page of similar intents."""
+    list: List[SimilarIntents] = []
+    """The similar intent pairs, the most similar first."""
+    total: int = 0
+    """The total of the matching intent pairs."""
+    page: int = 1
+    """The page of the intent pairs."""
+    pageSize: int = 20
+    """The page size of the intent pairs."""
+
+
+class DataAnnotationUngroundedOutputsResponse(BaseModel):
+    """The response model for a page of ungrounded answers."""
+    list: List[UngroundedOutput] = []
+    """The ungrounded answers, the least grounded first."""
+    total: int = 0
+    """The total of the ungrounded answers."""
+    page: int = 1
+    """The page of the answers."""
+    pageSize: int = 20
+    """The page size of the answers."""
+
+
+class DataAnnotationDuplicateQuestionsResponse(BaseModel):
+    """The response model for a page of near duplicate questions."""
+    list: List[DuplicateQuestions] = []
+    """The near duplicate question pairs, the most similar first."""
+    total: int = 0
+    """The total of the question pairs."""
+    page: int = 1
+    """The page of the question pairs."""
+    pageSize: int = 20
+    """The page size of the question pairs."""
+
+
+class DataAnnotationDetectJobResponse(BaseModel):
+    """The response model for a detect job."""
+    jobId: str
+    """The ID of the job."""
+    status: str
+    """The status of the job, pending, running, completed, failed or cancelled."""
+    message: str = ""
+    """The reason of a failed job."""
+    createdAt: str = ""
+    """The created time of the job."""
+    startedAt: str = ""
+    """The started time of the job."""
+    finishedAt: str = ""
+    """The finished time of the job."""
+    result: DataAnnotationDetectResponse | None = None
+    """The detect result, only set when the job completed."""
+
+
+class DataAnnotationIntentMatrixResponse(BaseModel):
+    """The response model for the intent similarity matrix of an annotation."""
+    intents: List[str] = []
+    """The intents, the most used first."""
+    counts: List[int] = []
+    """The number of completed segments of each intent."""
+    matrix: List[List[float]] = []
+    """The cosine similarity of every pair of intents, in the order of intents."""
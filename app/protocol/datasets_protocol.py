@@ -3,6 +3,8 @@ from typing import List
 from fastapi import UploadFile, File
 from pydantic import BaseModel
 
+from app.core.datasets.search_index import SearchHit
+
 
 class DatasetCreateRequest(BaseModel):
     """Create dataset request model."""
@@ -64,3 +66,13 @@ class DatasetsResponse(BaseModel):
     """页码"""
     pageSize: int = 10
     """每页数量"""
+
+
+class DatasetSearchResponse(BaseModel):
+    """Dataset semantic search response model."""
+    list: List[SearchHit] = []
+    """命中的切片和标注样本，相似度高的在前"""
+    query: str = ""
+    """查询内容"""
+    indexing: bool = False
+    """后台仍在同步索引，最近新增或变更的样本可能还搜不到"""
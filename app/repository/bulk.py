@@ -0,0 +1,38 @@
+from typing import Iterable, Any, Dict
+
+from sqlalchemy import Table
+from sqlalchemy.orm import Session
+
+from app.config.config import get_config
+
+
+def bulk_insert(db: Session, table: Table, rows: Iterable[Dict[str, Any]], batch_size: int = 0) -> int:
+    """
+    使用 Core insert() + executemany 分批写入，不创建 ORM 对象，每批提交一次
+    :param db: 数据库连接
+    :param table: 目标表，如 DatasetSegments.__table__
+    :param rows: 待写入的行，每行是列名到值的字典，所有行的列必须一致
+    :param batch_size: 每批写入的行数，为 0 时使用配置 db_bulk_batch_size
+    :return: 写入的总行数
+    """
+    if batch_size <= 0:
+        batch_size = get_config().db_bulk_batch_size
+    stmt = table.insert()
+    total = 0
+    batch = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                db.execute(stmt, batch)
+                db.commit()
+                total += len(batch)
+                batch = []
+        if batch:
+            db.execute(stmt, batch)
+            db.commit()
+            total += len(batch)
+    except Exception:
+        db.rollback()
+        raise
+    return total
@@ -1,13 +1,19 @@
-from datetime import datetime
-from typing import Type, List
+from datetime import datetime, timedelta
+from typing import Type, List, Iterable, Any, Dict, Tuple
 
-from sqlalchemy import desc, select, func
+from sqlalchemy import desc, select, func, insert, literal, String, or_, and_, case, update, bindparam
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import Session, joinedload
 
 from app.models.data_annotation import DataAnnotation, DataAnnotationSegments, DataAnnotationStatus, \
-    DataAnnotationSegmentType
+    DataAnnotationSegmentType, DataAnnotationDetectJob, DataAnnotationDetectJobStatus, DataAnnotationMismatchedIntent, \
+    DataAnnotationSimilarIntent, DataAnnotationUngroundedOutput, DataAnnotationDuplicateQuestion
 from app.models.datasets import DatasetSegments
+from app.repository.bulk import bulk_insert
+
+# 各类检测结果表，删除作业结果时一并清理
+_DETECT_RESULT_MODELS = (DataAnnotationMismatchedIntent, DataAnnotationSimilarIntent, DataAnnotationUngroundedOutput,
+                         DataAnnotationDuplicateQuestion)
 
 
 class DataAnnotationRepository:
@@ -56,6 +62,11 @@ class DataAnnotationRepository:
             query = query.options(joinedload(DataAnnotation.Segments))
         return query.first()
 
+    async def get_annotations_by_dataset(self, dataset_id: int) -> List[DataAnnotation]:
+        """获取基于某个数据集的全部标注任务"""
+        return self.db.query(DataAnnotation).filter(DataAnnotation.dataset_id == dataset_id,
+                                                    DataAnnotation.deleted_at == None).order_by(DataAnnotation.id).all()
+
     async def get_segment_by_sn(self, dataset_id: int, serial_number: int) -> Type[DatasetSegments] | None:
         """根据sn号获取标注记录"""
         return self.db.query(DatasetSegments).filter(DatasetSegments.dataset_id == dataset_id,
@@ -76,11 +87,36 @@ class DataAnnotationRepository:
             page_size).all()
         return annotations, total
 
-    async def add_annotation_segments(self, segments: List[DataAnnotationSegments]) -> List[DataAnnotationSegments]:
-        """Add segments to a data annotation."""
-        self.db.add_all(segments)
-        self.db.commit()
-        return segments
+    async def add_annotation_segments(self, segments: Iterable[Dict[str, Any]], batch_size: int = 0) -> int:
+        """Bulk insert segment rows into a data annotation, returns the number of rows written."""
+        return bulk_insert(self.db, DataAnnotationSegments.__table__, segments, batch_size)
+
+    async def copy_segments_from_dataset(self, data_annotation: DataAnnotation, dataset_id: int, start: int,
+                                         end: int) -> int:
+        """
+        用 INSERT ... SELECT 在数据库内把数据集切片复制到标注任务，切片内容不经过应用服务
+        :return: 写入的样本数
+        """
+        columns = ["uuid", "data_annotation_id", "segment_id", "ordinal", "annotation_type", "segment_content",
+                   "status", "segment_type"]
+        query = select(func.concat("das-", func.uuid()),
+                       literal(data_annotation.id),
+                       DatasetSegments.id,
+                       func.row_number().over(order_by=DatasetSegments.serial_number) - 1,
+                       literal(data_annotation.annotation_type, String),
+                       DatasetSegments.content,
+                       literal(DataAnnotationStatus.PENDING, String),
+                       literal(DataAnnotationSegmentType.TRAIN, String)).where(
+            DatasetSegments.dataset_id == dataset_id,
+            DatasetSegments.serial_number >= start,
+            DatasetSegments.serial_number < end).order_by(DatasetSegments.serial_number)
+        try:
+            result = self.db.execute(insert(DataAnnotationSegments).from_select(columns, query))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return result.rowcount
 
     async def get_annotation_one_segment(self, annotation_id: int, index: int = -1,
                                          status: DataAnnotationStatus = None,
@@ -93,40 +129,197 @@ class DataAnnotationRepository:
             query = query.options(joinedload(DataAnnotationSegments.Segments))
         if index == -1:
             return query.order_by(DataAnnotationSegments.id).first()
-        return query.order_by(DataAnnotationSegments.id).offset(index * 1).limit(1).first()
+        # 按任务内序号定位，走 (data_annotation_id, ordinal) 索引，不再 OFFSET 扫描
+        found = query.filter(DataAnnotationSegments.ordinal == index).first()
+        if found is None and index >= 0 and await self.backfill_ordinals(annotation_id):
+            found = query.filter(DataAnnotationSegments.ordinal == index).first()
+        return found
+
+    async def backfill_ordinals(self, annotation_id: int) -> int:
+        """
+        为引入序号之前创建的任务补齐序号，按 (created_at, id) 排序用 ROW_NUMBER 一次写入；
+        任务已有序号时只做一次索引查询，返回补齐的行数
+        """
+        missing = self.db.query(DataAnnotationSegments.id).filter(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            DataAnnotationSegments.ordinal == None).first()
+        if missing is None:
+            return 0
+        numbered = select(DataAnnotationSegments.id.label("id"),
+                          (func.row_number().over(order_by=(DataAnnotationSegments.created_at,
+                                                            DataAnnotationSegments.id)) - 1).label("ordinal")).where(
+            DataAnnotationSegments.data_annotation_id == annotation_id).subquery()
+        try:
+            result = self.db.execute(update(DataAnnotationSegments).where(
+                DataAnnotationSegments.id == numbered.c.id).values(ordinal=numbered.c.ordinal))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return result.rowcount
+
+    async def claim_annotation_segments(self, annotation_id: int, owner: str, size: int = 1,
+                                        lease_seconds: int = 600) -> List[DataAnnotationSegments]:
+        """
+        领取待标注的样本，领取后在租期内不会分配给其他人，租期过期后自动回收
+        :param annotation_id: 标注任务ID
+        :param owner: 领取人
+        :param size: 领取数量
+        :param lease_seconds: 租期（秒）
+        :return: 领取到的样本，按ID排序
+        """
+        now = datetime.now()
+        query = self.db.query(DataAnnotationSegments.id).filter(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            DataAnnotationSegments.status == DataAnnotationStatus.PENDING)
+        try:
+            # 先取回自己仍在租期内的样本，再用 SKIP LOCKED 领取未被占用或已过期的样本
+            ids = [row.id for row in query.filter(DataAnnotationSegments.lease_owner == owner,
+                                                  DataAnnotationSegments.lease_expires_at >= now).order_by(
+                DataAnnotationSegments.id).limit(size).with_for_update(skip_locked=True).all()]
+            if len(ids) < size:
+                ids += [row.id for row in query.filter(or_(DataAnnotationSegments.lease_expires_at == None,
+                                                           DataAnnotationSegments.lease_expires_at < now)).order_by(
+                    DataAnnotationSegments.id).limit(size - len(ids)).with_for_update(skip_locked=True).all()]
+            if ids:
+                self.db.query(DataAnnotationSegments).filter(DataAnnotationSegments.id.in_(ids)).update(
+                    {"lease_owner": owner, "lease_expires_at": now + timedelta(seconds=lease_seconds)},
+                    synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        if not ids:
+            return []
+        return self.db.query(DataAnnotationSegments).options(joinedload(DataAnnotationSegments.Segments)).filter(
+            DataAnnotationSegments.id.in_(ids)).order_by(DataAnnotationSegments.id).all()
 
     async def get_annotation_segment_by_uuid(self, annotation_id: int, uid: str) -> DataAnnotationSegments:
         """Find a segment by UUID."""
         return self.db.query(DataAnnotationSegments).filter(DataAnnotationSegments.data_annotation_id == annotation_id,
                                                             DataAnnotationSegments.uuid == uid).first()
 
-    async def update_annotation_segment(self, data_annotation: DataAnnotation,
-                                        data_annotation_segment: DataAnnotationSegments) -> DataAnnotationSegments:
-        """Update a data annotation segment."""
-        if (data_annotation.completed + data_annotation.abandoned) == data_annotation.total:
-            data_annotation.status = DataAnnotationStatus.COMPLETED
-            data_annotation.completed_at = datetime.now()
-        if data_annotation.status == DataAnnotationStatus.PENDING:
-            data_annotation.status = DataAnnotationStatus.PROCESSING
+    async def update_annotation_segment(self, data_annotation_id: int, segment_id: int, update_data: dict):
+        """
+        Update a data annotation segment and the task counters in one transaction.
+        The counters are incremented in SQL, and the task status is moved to processing/completed in the same UPDATE.
+        """
+        now = datetime.now()
+        try:
+            # 锁住样本行，拿到更新前的状态用于计算计数器增量
+            old_status, segment_type = self.db.query(DataAnnotationSegments.status,
+                                                     DataAnnotationSegments.segment_type).filter(
+                DataAnnotationSegments.id == segment_id).with_for_update().one()
+            completed, abandoned = _status_delta(update_data.get("status"), old_status)
+            # 完成数的变化计入样本所属的训练集或测试集
+            test = segment_type == DataAnnotationSegmentType.TEST
+            self._increment_counters(data_annotation_id, completed, abandoned, now,
+                                     train=0 if test else completed, test=completed if test else 0)
 
-        update_data = {
-            "segment_content": data_annotation_segment.segment_content,
-            "status": data_annotation_segment.status,
-            "updated_at": datetime.now(),
-            "document": data_annotation_segment.document,
-            "instruction": data_annotation_segment.instruction,
-            "input": data_annotation_segment.input,
-            "question": data_annotation_segment.question,
-            "intent": data_annotation_segment.intent,
-            "output": data_annotation_segment.output,
-            "creator_email": data_annotation_segment.creator_email
-        }
-        self.db.query(DataAnnotationSegments).filter(DataAnnotationSegments.id == data_annotation_segment.id).update(
-            update_data)
+            # 先更新任务（持有任务行锁直到提交），再用新的内容版本号作为样本的变更序号，保证序号按提交顺序递增
+            self.db.execute(update(DataAnnotationSegments).where(DataAnnotationSegments.id == segment_id).values(
+                **update_data, updated_at=now, lease_owner=None, lease_expires_at=None,
+                change_seq=self._content_version_subquery(data_annotation_id)))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def batch_update_annotation_segments(self, data_annotation_id: int,
+                                               items: Dict[str, dict]) -> Dict[str, str | None]:
+        """
+        批量更新标注样本，所有样本与计数器在同一个事务内更新
+        :param data_annotation_id: 标注任务ID
+        :param items: 样本UUID到更新内容的映射，更新字段相同的样本合并为一次 executemany
+        :return: 样本UUID到错误信息的映射，成功为 None
+        """
+        now = datetime.now()
+        results: Dict[str, str | None] = {uid: "Segment not found." for uid in items}
+        try:
+            rows = self.db.query(DataAnnotationSegments.id, DataAnnotationSegments.uuid,
+                                 DataAnnotationSegments.status, DataAnnotationSegments.segment_type).filter(
+                DataAnnotationSegments.data_annotation_id == data_annotation_id,
+                DataAnnotationSegments.uuid.in_(list(items.keys()))).with_for_update().all()
+
+            groups: Dict[tuple, List[dict]] = {}
+            completed, abandoned, train, test = 0, 0, 0, 0
+            for row in rows:
+                update_data = items[row.uuid]
+                params = {f"b_{key}": value for key, value in update_data.items()}
+                groups.setdefault(tuple(sorted(update_data.keys())), []).append(dict(params, b_id=row.id))
+                c, a = _status_delta(update_data.get("status"), row.status)
+                completed += c
+                abandoned += a
+                if row.segment_type == DataAnnotationSegmentType.TEST:
+                    test += c
+                else:
+                    train += c
+                results[row.uuid] = None
+
+            if rows:
+                self._increment_counters(data_annotation_id, completed, abandoned, now, train=train, test=test)
+
+            table = DataAnnotationSegments.__table__
+            for keys, params in groups.items():
+                values = {key: bindparam(f"b_{key}") for key in keys}
+                values.update(updated_at=now, lease_owner=None, lease_expires_at=None,
+                              change_seq=self._content_version_subquery(data_annotation_id))
+                self.db.execute(update(table).where(table.c.id == bindparam("b_id")).values(values), params)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return results
+
+    def _increment_counters(self, data_annotation_id: int, completed: int, abandoned: int, now: datetime,
+                            train: int = 0, test: int = 0):
+        """
+        Atomically add to completed/abandoned/train_total/test_total and advance the task status, without committing.
+        train and test split the completed delta by the segment type of the changed segments.
+        """
+        finished = and_(DataAnnotation.status.in_([DataAnnotationStatus.PENDING, DataAnnotationStatus.PROCESSING]),
+                        DataAnnotation.completed + DataAnnotation.abandoned + (completed + abandoned) >=
+                        DataAnnotation.total)
+        # MySQL 按从左到右的顺序执行 SET，状态字段要放在计数器之前，读取的才是更新前的计数
+        self.db.execute(update(DataAnnotation).where(DataAnnotation.id == data_annotation_id).ordered_values(
+            (DataAnnotation.completed_at, case((finished, now), else_=DataAnnotation.completed_at)),
+            (DataAnnotation.status, case((finished, literal(DataAnnotationStatus.COMPLETED, String)),
+                                         (DataAnnotation.status == DataAnnotationStatus.PENDING,
+                                          literal(DataAnnotationStatus.PROCESSING, String)),
+                                         else_=DataAnnotation.status)),
+            (DataAnnotation.completed, DataAnnotation.completed + completed),
+            (DataAnnotation.abandoned, DataAnnotation.abandoned + abandoned),
+            (DataAnnotation.train_total, DataAnnotation.train_total + train),
+            (DataAnnotation.test_total, DataAnnotation.test_total + test),
+            (DataAnnotation.content_version, DataAnnotation.content_version + 1),
+            (DataAnnotation.updated_at, now),
+        ))
+
+    @staticmethod
+    def _content_version_subquery(data_annotation_id: int):
+        return select(DataAnnotation.content_version).where(
+            DataAnnotation.id == data_annotation_id).scalar_subquery()
+
+    async def clean_data_annotation(self, data_annotation_id: int) -> bool:
+        """
+        把待标注或标注中的任务标为已清理，只更新状态相关的列，不覆盖标注时在 SQL 中累加的计数器
+        :return: 任务在更新时已经不是待标注或标注中的状态（例如刚刚标完）时返回 False
+        """
+        now = datetime.now()
+        count = self.db.query(DataAnnotation).filter(
+            DataAnnotation.id == data_annotation_id,
+            DataAnnotation.status.in_([DataAnnotationStatus.PENDING, DataAnnotationStatus.PROCESSING])).update(
+            {"status": DataAnnotationStatus.CLEANED, "completed_at": now, "updated_at": now,
+             "content_version": DataAnnotation.content_version + 1}, synchronize_session=False)
+        self.db.commit()
+        return count > 0
+
+    async def update_split_totals(self, data_annotation_id: int, test_total: int):
+        """拆分后只更新训练集和测试集的数量，训练集数量在 SQL 中由 total 计算"""
+        self.db.query(DataAnnotation).filter(DataAnnotation.id == data_annotation_id).update(
+            {"test_total": test_total, "train_total": DataAnnotation.total - test_total,
+             "updated_at": datetime.now()}, synchronize_session=False)
         self.db.commit()
-        await self.update_data_annotation(data_annotation.id, data_annotation)
-        return await self.get_annotation_segment_by_uuid(data_annotation_segment.data_annotation_id,
-                                                         data_annotation_segment.uuid)
 
     async def update_data_annotation(self, data_annotation_id: int, data_annotation: DataAnnotation) -> DataAnnotation:
         """Update a data annotation."""
@@ -161,21 +354,118 @@ class DataAnnotationRepository:
         segments = query.order_by(DataAnnotationSegments.id).all()
         return segments, len(segments)
 
-    async def get_annotation_segment_by_rank(self, annotation_id: int, test_percent: float = 0.0,
-                                             status: DataAnnotationStatus = None,
-                                             segment_type: DataAnnotationSegmentType = DataAnnotationSegmentType.TRAIN,
-                                             ) -> List[DataAnnotationSegments]:
-        """Get segments by annotation ID and rank."""
-        query = self.db.query(DataAnnotationSegments).filter(DataAnnotationSegments.data_annotation_id == annotation_id,
-                                                             DataAnnotationSegments.segment_type == segment_type)
-        if status:
-            query = query.filter(DataAnnotationSegments.status == status)
+    async def count_completed_segments_by_type(self, annotation_id: int) -> Dict[str, int]:
+        """Count completed segments of an annotation grouped by segment type."""
+        rows = self.db.query(DataAnnotationSegments.segment_type, func.count(DataAnnotationSegments.id)).filter(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            DataAnnotationSegments.deleted_at == None,
+            DataAnnotationSegments.status == DataAnnotationStatus.COMPLETED).group_by(
+            DataAnnotationSegments.segment_type).all()
+        return {segment_type: total for segment_type, total in rows}
+
+    async def count_completed_intents(self, annotation_id: int, limit: int = 200) -> List[tuple]:
+        """Count completed segments of an annotation per intent, the most used intents first."""
+        total = func.count(DataAnnotationSegments.id)
+        return self.db.query(DataAnnotationSegments.intent, total).filter(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            DataAnnotationSegments.deleted_at == None,
+            DataAnnotationSegments.status == DataAnnotationStatus.COMPLETED,
+            DataAnnotationSegments.intent != None,
+            DataAnnotationSegments.intent != "").group_by(
+            DataAnnotationSegments.intent).order_by(desc(total), DataAnnotationSegments.intent).limit(limit).all()
+
+    async def stream_completed_segments(self, annotation_id: int, train: bool | None = True,
+                                        batch_size: int = 1000) -> Iterable[DataAnnotationSegments]:
+        """
+        用服务端游标逐批读取已完成的样本，内存占用只与 batch_size 有关
+        :param annotation_id: 标注任务ID
+        :param train: True 读取训练集，False 读取其余样本，None 读取全部
+        :param batch_size: 每批读取的行数
+        """
+        query = self.db.query(DataAnnotationSegments).filter(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            DataAnnotationSegments.deleted_at == None,
+            DataAnnotationSegments.status == DataAnnotationStatus.COMPLETED)
+        if train is True:
+            query = query.filter(DataAnnotationSegments.segment_type == DataAnnotationSegmentType.TRAIN)
+        elif train is False:
+            query = query.filter(DataAnnotationSegments.segment_type != DataAnnotationSegmentType.TRAIN)
+        # 返回未执行的查询，迭代时才发起，保证同一连接上同时只有一个流式游标
+        return query.order_by(DataAnnotationSegments.id).yield_per(batch_size)
 
-        if test_percent > 0:
-            query = query.filter(DataAnnotationSegments.segment_type == segment_type)
-            query = query.order_by(func.rand()).limit(int(test_percent * query.count()))
-            return query.all()
-        return query.order_by(func.rand()).all()
+    async def get_changed_segments(self, annotation_id: int, since: int = 0, since_id: int = 0,
+                                   limit: int = 1000) -> List[DataAnnotationSegments]:
+        """
+        获取水位 (since, since_id) 之后变更过的样本（标注、放弃或重新划分训练/测试集），按 (变更序号, ID) 排序
+        :param annotation_id: 标注任务ID
+        :param since: 上次同步的变更序号
+        :param since_id: 上次同步的最后一条样本ID，同一变更序号的样本可能跨页
+        :param limit: 最多返回的条数
+        """
+        return self.db.query(DataAnnotationSegments).filter(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            or_(DataAnnotationSegments.change_seq > since,
+                and_(DataAnnotationSegments.change_seq == since, DataAnnotationSegments.id > since_id))).order_by(
+            DataAnnotationSegments.change_seq, DataAnnotationSegments.id).limit(limit).all()
+
+    async def get_changed_segments_by_tasks(self, watermarks: Dict[int, Tuple[int, int]],
+                                            limit: int = 1000) -> List[DataAnnotationSegments]:
+        """
+        一次查询多个任务在各自水位之后变更过的样本，按 (任务ID, 变更序号, ID) 排序
+        :param watermarks: 任务ID 到 (since, since_id) 水位的映射
+        :param limit: 最多返回的条数
+        """
+        if not watermarks:
+            return []
+        return self.db.query(DataAnnotationSegments).filter(
+            DataAnnotationSegments.data_annotation_id.in_(list(watermarks.keys())),
+            or_(*[and_(DataAnnotationSegments.data_annotation_id == annotation_id,
+                       or_(DataAnnotationSegments.change_seq > since,
+                           and_(DataAnnotationSegments.change_seq == since, DataAnnotationSegments.id > since_id)))
+                  for annotation_id, (since, since_id) in watermarks.items()])).order_by(
+            DataAnnotationSegments.data_annotation_id, DataAnnotationSegments.change_seq,
+            DataAnnotationSegments.id).limit(limit).all()
+
+    async def split_annotation_segments(self, annotation_id: int, test_percent: float, seed: int = 0,
+                                        stratify: bool = False) -> int:
+        """
+        按 seed 的哈希对已完成的样本排序，前 test_percent 的样本标为测试集，其余为训练集，样本只用一条 UPDATE 完成
+        :param annotation_id: 标注任务ID
+        :param test_percent: 测试集比例
+        :param seed: 随机种子，相同的种子得到相同的拆分结果
+        :param stratify: 是否按意图分层拆分
+        :return: 测试集数量
+        """
+        partition_by = [DataAnnotationSegments.intent] if stratify else None
+        order_by = [func.md5(func.concat(str(seed), ":", DataAnnotationSegments.uuid)), DataAnnotationSegments.id]
+        ranked = select(DataAnnotationSegments.id,
+                        func.row_number().over(partition_by=partition_by, order_by=order_by).label("rn"),
+                        func.count().over(partition_by=partition_by).label("cnt")).where(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            DataAnnotationSegments.status == DataAnnotationStatus.COMPLETED).subquery()
+        segment_type = case((ranked.c.rn <= func.floor(ranked.c.cnt * test_percent),
+                             literal(DataAnnotationSegmentType.TEST, String)),
+                            else_=literal(DataAnnotationSegmentType.TRAIN, String))
+        try:
+            self.db.query(DataAnnotation).filter(DataAnnotation.id == annotation_id).update(
+                {"content_version": DataAnnotation.content_version + 1}, synchronize_session=False)
+            version = self.db.query(DataAnnotation.content_version).filter(DataAnnotation.id == annotation_id).scalar()
+            # 只有类型发生变化的样本才更新变更序号；MySQL 从左到右执行 SET，change_seq 要在 segment_type 之前
+            change_seq = case((DataAnnotationSegments.segment_type != segment_type, version),
+                              else_=DataAnnotationSegments.change_seq)
+            stmt = update(DataAnnotationSegments).where(DataAnnotationSegments.id == ranked.c.id).ordered_values(
+                (DataAnnotationSegments.change_seq, change_seq),
+                (DataAnnotationSegments.segment_type, segment_type),
+            )
+            self.db.execute(stmt.execution_options(synchronize_session=False))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return self.db.query(func.count(DataAnnotationSegments.id)).filter(
+            DataAnnotationSegments.data_annotation_id == annotation_id,
+            DataAnnotationSegments.status == DataAnnotationStatus.COMPLETED,
+            DataAnnotationSegments.segment_type == DataAnnotationSegmentType.TEST).scalar()
 
     async def update_annotation_segment_type(self, segment_id: list[int],
                                              segment_type: DataAnnotationSegmentType = DataAnnotationSegmentType.TEST):
@@ -184,3 +474,156 @@ class DataAnnotationRepository:
             {"segment_type": segment_type})
         self.db.commit()
         return
+
+    async def create_detect_job(self, job: DataAnnotationDetectJob) -> DataAnnotationDetectJob:
+        """Create a detect job."""
+        self.db.add(job)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    async def get_detect_job_by_uuid(self, annotation_id: int, uid: str) -> DataAnnotationDetectJob:
+        """Find a detect job of an annotation by UUID."""
+        return self.db.query(DataAnnotationDetectJob).filter(DataAnnotationDetectJob.data_annotation_id == annotation_id,
+                                                             DataAnnotationDetectJob.uuid == uid).first()
+
+    async def update_detect_job(self, job_id: int, update_data: dict) -> bool:
+        """
+        Update a detect job that is still pending or running.
+        Returns False when the job already finished, e.g. it was cancelled by another worker.
+        """
+        update_data["updated_at"] = datetime.now()
+        count = self.db.query(DataAnnotationDetectJob).filter(
+            DataAnnotationDetectJob.id == job_id,
+            DataAnnotationDetectJob.status.in_([DataAnnotationDetectJobStatus.PENDING,
+                                                DataAnnotationDetectJobStatus.RUNNING])).update(
+            update_data, synchronize_session=False)
+        self.db.commit()
+        return count > 0
+
+    async def fail_stale_detect_jobs(self, before: datetime, job_id: int = None) -> int:
+        """
+        把 updated_at 早于 before 的待运行或运行中作业标为失败，这些作业所在的进程已经退出，不会再有心跳
+        :param before: 最后一次心跳早于这个时间的作业视为失效
+        :param job_id: 只检查这个作业，为空时检查全部
+        :return: 标为失败的作业数
+        """
+        query = self.db.query(DataAnnotationDetectJob).filter(
+            DataAnnotationDetectJob.status.in_([DataAnnotationDetectJobStatus.PENDING,
+                                                DataAnnotationDetectJobStatus.RUNNING]),
+            DataAnnotationDetectJob.updated_at < before)
+        if job_id is not None:
+            query = query.filter(DataAnnotationDetectJob.id == job_id)
+        now = datetime.now()
+        count = query.update({"status": DataAnnotationDetectJobStatus.FAILED,
+                              "message": "The worker running the job stopped.",
+                              "finished_at": now, "updated_at": now}, synchronize_session=False)
+        self.db.commit()
+        return count
+
+    async def get_latest_detect_job(self, annotation_id: int) -> DataAnnotationDetectJob:
+        """The most recently completed detect job of an annotation."""
+        return self.db.query(DataAnnotationDetectJob).filter(
+            DataAnnotationDetectJob.data_annotation_id == annotation_id,
+            DataAnnotationDetectJob.status == DataAnnotationDetectJobStatus.COMPLETED).order_by(
+            desc(DataAnnotationDetectJob.finished_at), desc(DataAnnotationDetectJob.id)).first()
+
+    async def add_detect_results(self, annotation_id: int, job_id: int, mismatched: Iterable[Dict[str, Any]],
+                                 similar: Iterable[Dict[str, Any]]) -> (int, int):
+        """
+        保存检测作业的结果，返回写入的 (意图不一致的问题对, 相似意图对) 行数
+        mismatched 和 similar 的每一行是不含任务和作业ID的列字典
+        """
+        common = {"data_annotation_id": annotation_id, "detect_job_id": job_id}
+        mismatched_total = bulk_insert(self.db, DataAnnotationMismatchedIntent.__table__,
+                                       ({**common, **row} for row in mismatched))
+        similar_total = bulk_insert(self.db, DataAnnotationSimilarIntent.__table__,
+                                    ({**common, **row} for row in similar))
+        return mismatched_total, similar_total
+
+    async def add_context_results(self, annotation_id: int, job_id: int, ungrounded: Iterable[Dict[str, Any]],
+                                  duplicates: Iterable[Dict[str, Any]]) -> (int, int):
+        """保存 RAG/通用任务检测作业的结果，返回写入的 (答案无依据的样本, 重复问题对) 行数"""
+        common = {"data_annotation_id": annotation_id, "detect_job_id": job_id}
+        ungrounded_total = bulk_insert(self.db, DataAnnotationUngroundedOutput.__table__,
+                                       ({**common, **row} for row in ungrounded))
+        duplicate_total = bulk_insert(self.db, DataAnnotationDuplicateQuestion.__table__,
+                                      ({**common, **row} for row in duplicates))
+        return ungrounded_total, duplicate_total
+
+    async def delete_detect_results(self, job_id: int):
+        """Delete the results of a detect job."""
+        for model in _DETECT_RESULT_MODELS:
+            self.db.query(model).filter(model.detect_job_id == job_id).delete(synchronize_session=False)
+        self.db.commit()
+
+    async def delete_stale_detect_results(self, annotation_id: int, latest_job_id: int):
+        """Delete the results of an annotation left by detect jobs other than latest_job_id."""
+        for model in _DETECT_RESULT_MODELS:
+            self.db.query(model).filter(model.data_annotation_id == annotation_id,
+                                        model.detect_job_id != latest_job_id).delete(synchronize_session=False)
+        self.db.commit()
+
+    async def get_mismatched_intents(self, job_id: int, intent: str = None, intent1: str = None, intent2: str = None,
+                                     page: int = 1, page_size: int = 20) -> (
+            List[DataAnnotationMismatchedIntent], int):
+        """分页获取意图不一致的问题对，intent 匹配任意一侧，intent1、intent2 按意图对过滤"""
+        query = self.db.query(DataAnnotationMismatchedIntent).filter(
+            DataAnnotationMismatchedIntent.detect_job_id == job_id)
+        if intent:
+            query = query.filter(or_(DataAnnotationMismatchedIntent.intent1 == intent,
+                                     DataAnnotationMismatchedIntent.intent2 == intent))
+        if intent1:
+            query = query.filter(DataAnnotationMismatchedIntent.intent1 == intent1)
+        if intent2:
+            query = query.filter(DataAnnotationMismatchedIntent.intent2 == intent2)
+        total = query.count()
+        rows = query.order_by(DataAnnotationMismatchedIntent.id).offset((page - 1) * page_size).limit(page_size).all()
+        return rows, total
+
+    async def get_similar_intents(self, job_id: int, intent: str = None, page: int = 1, page_size: int = 20) -> (
+            List[DataAnnotationSimilarIntent], int):
+        """分页获取相似的意图对，intent 匹配任意一侧，相似度高的在前"""
+        query = self.db.query(DataAnnotationSimilarIntent).filter(DataAnnotationSimilarIntent.detect_job_id == job_id)
+        if intent:
+            query = query.filter(or_(DataAnnotationSimilarIntent.intent1 == intent,
+                                     DataAnnotationSimilarIntent.intent2 == intent))
+        total = query.count()
+        rows = query.order_by(desc(DataAnnotationSimilarIntent.similarity), DataAnnotationSimilarIntent.id).offset(
+            (page - 1) * page_size).limit(page_size).all()
+        return rows, total
+
+    async def get_ungrounded_outputs(self, job_id: int, page: int = 1, page_size: int = 20) -> (
+            List[DataAnnotationUngroundedOutput], int):
+        """分页获取答案无依据的样本，最不相关的在前"""
+        query = self.db.query(DataAnnotationUngroundedOutput).filter(
+            DataAnnotationUngroundedOutput.detect_job_id == job_id)
+        total = query.count()
+        rows = query.order_by(DataAnnotationUngroundedOutput.score, DataAnnotationUngroundedOutput.id).offset(
+            (page - 1) * page_size).limit(page_size).all()
+        return rows, total
+
+    async def get_duplicate_questions(self, job_id: int, page: int = 1, page_size: int = 20) -> (
+            List[DataAnnotationDuplicateQuestion], int):
+        """分页获取近似重复的问题对，相似度高的在前"""
+        query = self.db.query(DataAnnotationDuplicateQuestion).filter(
+            DataAnnotationDuplicateQuestion.detect_job_id == job_id)
+        total = query.count()
+        rows = query.order_by(desc(DataAnnotationDuplicateQuestion.similarity),
+                              DataAnnotationDuplicateQuestion.id).offset((page - 1) * page_size).limit(page_size).all()
+        return rows, total
+
+
+def _status_delta(new_status, old_status) -> (int, int):
+    """The (completed, abandoned) counter change caused by moving a segment from old_status to new_status."""
+
+    def weight(status) -> (int, int):
+        if status == DataAnnotationStatus.COMPLETED:
+            return 1, 0
+        if status == DataAnnotationStatus.ABANDONED:
+            return 0, 1
+        return 0, 0
+
+    new_completed, new_abandoned = weight(new_status)
+    old_completed, old_abandoned = weight(old_status)
+    return new_completed - old_completed, new_abandoned - old_abandoned
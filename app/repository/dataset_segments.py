@@ -1,6 +1,7 @@
-from typing import List
+from typing import List, Iterable, Any, Dict
 
 from app.models.datasets import DatasetSegments
+from app.repository.bulk import bulk_insert
 
 
 class DatasetSegmentsRepository:
@@ -10,11 +11,34 @@ class DatasetSegmentsRepository:
         """Construct a new repository for dataset segments."""
         self.db = db
 
-    async def add_segments(self, segments: list[DatasetSegments]):
-        """Add segments to a dataset."""
-        db = self.db
-        db.add_all(segments)
-        db.commit()
+    async def add_segments(self, segments: Iterable[Dict[str, Any]], batch_size: int = 0) -> int:
+        """Bulk insert segment rows into a dataset, returns the number of rows written."""
+        return bulk_insert(self.db, DatasetSegments.__table__, segments, batch_size)
+
+    async def delete_by_dataset_id(self, dataset_id: int) -> int:
+        """Delete all segments of a dataset, returns the number of rows deleted."""
+        try:
+            count = self.db.query(DatasetSegments).filter(DatasetSegments.dataset_id == dataset_id).delete(
+                synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return count
+
+    async def exists_by_dataset_id_and_sn(self, dataset_id: int, start: int = 0, end: int = 0) -> bool:
+        """Check whether any segment exists in the serial number range."""
+        return self.db.query(self.db.query(DatasetSegments.id).filter(
+            DatasetSegments.dataset_id == dataset_id,
+            DatasetSegments.serial_number >= start,
+            DatasetSegments.serial_number < end).exists()).scalar()
+
+    async def get_segments_after(self, dataset_id: int, after_id: int = 0, limit: int = 1000) -> List[DatasetSegments]:
+        """Get segments of a dataset with an ID greater than after_id, ordered by ID."""
+        return self.db.query(DatasetSegments).filter(DatasetSegments.dataset_id == dataset_id,
+                                                     DatasetSegments.id > after_id,
+                                                     DatasetSegments.deleted_at == None).order_by(
+            DatasetSegments.id).limit(limit).all()
 
     async def get_by_dataset_id_and_sn(self, dataset_id: int, start: int = 0, end: int = 0) -> List[DatasetSegments]:
         """Get segments by dataset ID and serial number."""
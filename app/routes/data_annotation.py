@@ -1,26 +1,40 @@
+import asyncio
+import importlib.util
 import json
-import os
 import uuid
-import zipfile
-from datetime import datetime
-from typing import List, Type
+from datetime import datetime, timedelta
+from typing import List, Type, Iterable, Iterator, Dict
 
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from starlette.responses import FileResponse
+from starlette.background import BackgroundTask
+from starlette.responses import StreamingResponse, FileResponse, Response
 
 from app.config.config import get_config
-from app.core.datasets.datasets_model import QuestionIntent, DatasetsModel
+from app.core.datasets.conflict_index import ConflictDetector, IndexedSegment, IntentConflict
+from app.core.datasets.datasets_model import QuestionIntent, DetectCancelledError, ContextAnswer, \
+    ContextConsistency, SimilarQuestionIntent, UngroundedOutput, DuplicateQuestions
+from app.core.datasets.model_registry import allowed_models, use_datasets_model
+from app.core.datasets.detect_job import DetectJobRunner, DetectJobHandle, DetectQueueFullError
 from app.logger.logger import get_logger
-from app.models.base import get_db
+from app.models.base import get_db, SessionLocal
 from app.models.data_annotation import DataAnnotation, DataAnnotationSegments, DataAnnotationStatus, DataAnnotationType, \
-    DataAnnotationSegmentType
+    DataAnnotationSegmentType, DataAnnotationDetectJob, DataAnnotationDetectJobStatus
 from app.models.datasets import Datasets
 from app.protocol.api_protocol import SuccessResponse
 from app.protocol.data_annotation_protocol import DataAnnotationResponse, AnnotationCreateRequest, \
     DataAnnotationsResponse, DataAnnotationSegmentResponse, DataAnnotationSegmentMarkRequest, \
-    DataAnnotationSplitRequest, DataAnnotationDetectResponse, MismatchedIntents, SimilarIntents
+    DataAnnotationSplitRequest, DataAnnotationDetectResponse, MismatchedIntents, SimilarIntents, \
+    DataAnnotationSegmentBatchMarkRequest, DataAnnotationSegmentBatchMarkResult, DataAnnotationSegmentBatchMarkResponse, \
+    DataAnnotationDeltaSegment, DataAnnotationDeltaResponse, DataAnnotationDetectJobResponse, \
+    DataAnnotationSegmentMarkResponse, DataAnnotationIntentMatrixResponse, DataAnnotationMismatchedIntentsResponse, \
+    DataAnnotationSimilarIntentsResponse, DataAnnotationUngroundedOutputsResponse, \
+    DataAnnotationDuplicateQuestionsResponse
 from app.repository.repository import get_repository, Repository
+from app.routes.datasets import schedule_search_sync
+from app.utils.export_cache import ExportCache
+from app.utils.export_formats import JSONL_FORMATS, COLUMNAR_FORMATS, segments_to_jsonl, segments_to_columnar
+from app.utils.zip_stream import stream_zip
 
 router = APIRouter(
     prefix="/annotation",
@@ -31,25 +45,123 @@ router = APIRouter(
 
 logger = get_logger("annotation")
 
-# 从配置文件中获取模型名称和设备
-# TODO: 可能会有个问题，多个进程的时候，这个模型会被多次加载，会不会有问题？
-datasets_model = DatasetsModel(get_config().datasets_model_name, get_config().datasets_device)
 
+def task_model_name(annotation: DataAnnotation) -> str:
+    return annotation.model_name or get_config().datasets_model_name
 
-def write_segments_to_file(segments: List[DataAnnotationSegments], file_path: str, format_type: str):
-    with open(file_path, 'w', encoding='utf-8', newline='') as file:
-        for segment in segments:
-            messages = [{
-                "role": "system",
-                "content": segment.input
-            }, {
-                "role": "user",
-                "content": segment.question
-            }, {
-                "role": "assistant",
-                "content": segment.output
-            }]
-            file.write(json.dumps({"messages": messages}, ensure_ascii=False) + "\n")
+
+# 标注时检测意图冲突，每个进程为最近标注的任务维护问题向量索引
+conflict_detector = ConflictDetector(use_datasets_model, threshold=get_config().annotation_conflict_threshold,
+                                     max_tasks=get_config().annotation_conflict_max_tasks,
+                                     max_conflicts=get_config().annotation_conflict_max_results)
+
+# 检测作业在独立的线程池中运行，限制单个进程的并发数和排队数
+detect_runner = DetectJobRunner(get_config().annotation_detect_workers, get_config().annotation_detect_queue_max)
+# 持有后台任务的引用，避免任务在运行中被垃圾回收
+detect_tasks = set()
+
+export_cache = ExportCache(f"{get_config().storage_dir}/export_cache", get_config().export_cache_max_bytes)
+
+
+def stream_export_zip(db: Session, annotation_uuid: str, format_type: str, train_segments: Iterable,
+                      test_segments: Iterable | None) -> Iterator[bytes]:
+    """
+    同步生成器，StreamingResponse 在线程池中迭代，读游标和压缩不阻塞事件循环；
+    响应体在请求的数据库会话关闭后才开始发送，db 是路由单独打开的会话，输出结束后关闭
+    """
+    try:
+        entries = [(f"{annotation_uuid}-train.jsonl", segments_to_jsonl(train_segments, format_type))]
+        if test_segments is not None:
+            entries.append((f"{annotation_uuid}-test.jsonl", segments_to_jsonl(test_segments, format_type)))
+        yield from stream_zip(entries)
+    finally:
+        db.close()
+
+
+def stream_export_columnar(db: Session, segments: Iterable, format_type: str) -> Iterator[bytes]:
+    try:
+        yield from segments_to_columnar(segments, format_type)
+    finally:
+        db.close()
+
+
+async def sync_conflict_index(store: Repository, annotation_id: int, model_name: str):
+    """把水位之后的变更（包括其他标注人和其他进程的）同步到本进程的任务索引"""
+    loop = asyncio.get_running_loop()
+    page_size = get_config().annotation_delta_page_max
+    since, since_id = conflict_detector.watermark(annotation_id, model_name)
+    while True:
+        changed = await store.data_annotation().get_changed_segments(annotation_id, since, since_id, page_size)
+        if not changed:
+            break
+        segments = [IndexedSegment(id=segment.id, uuid=segment.uuid, change_seq=segment.change_seq,
+                                   completed=segment.status == DataAnnotationStatus.COMPLETED,
+                                   input=segment.input or "", intent=segment.intent or "")
+                    for segment in changed]
+        # 编码是 CPU 密集的操作，放到线程池中执行
+        await loop.run_in_executor(None, conflict_detector.apply, annotation_id, model_name, segments)
+        since, since_id = segments[-1].change_seq, segments[-1].id
+        if len(changed) < page_size:
+            break
+
+
+# 每个任务同时只有一个后台预热，持有引用避免任务在运行中被垃圾回收
+conflict_warmup_tasks: Dict[int, asyncio.Task] = {}
+
+
+async def warm_conflict_index(annotation_id: int, model_name: str):
+    db = SessionLocal()
+    try:
+        await sync_conflict_index(get_repository(db), annotation_id, model_name)
+        conflict_detector.mark_ready(annotation_id, model_name)
+    except Exception as e:
+        logger.error(f"Failed to warm conflict index of annotation {annotation_id}: {e}")
+    finally:
+        db.close()
+        conflict_warmup_tasks.pop(annotation_id, None)
+
+
+def schedule_conflict_warmup(annotation: DataAnnotation) -> bool:
+    """FAQ 任务的索引还没有加载时在后台加载，返回索引是否已经可以检测"""
+    if DataAnnotationType(annotation.annotation_type) != DataAnnotationType.FAQ:
+        return False
+    model_name = task_model_name(annotation)
+    if conflict_detector.ready(annotation.id, model_name):
+        return True
+    if annotation.id not in conflict_warmup_tasks:
+        conflict_warmup_tasks[annotation.id] = asyncio.create_task(warm_conflict_index(annotation.id, model_name))
+    return False
+
+
+async def check_intent_conflicts(store: Repository, annotation: DataAnnotation,
+                                 segment_uuids: List[str]) -> Dict[str, List[IntentConflict]]:
+    """
+    同步增量后检查这些样本的问题是否与其他意图的问题重复；
+    索引还在后台加载时不做检测，不让第一个标注请求承担整个任务的编码
+    """
+    if not segment_uuids or not schedule_conflict_warmup(annotation):
+        return {}
+    model_name = task_model_name(annotation)
+    await sync_conflict_index(store, annotation.id, model_name)
+    return await asyncio.get_running_loop().run_in_executor(
+        None, lambda: {uid: conflict_detector.check(annotation.id, model_name, uid) for uid in segment_uuids})
+
+
+def segment_to_response(segment: DataAnnotationSegments) -> DataAnnotationSegmentResponse:
+    return DataAnnotationSegmentResponse(
+        uuid=segment.uuid,
+        segmentContent=segment.segment_content,
+        createdAt=segment.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        updatedAt=segment.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
+        status=segment.status, annotationType=segment.annotation_type,
+        document=segment.document or "", instruction=segment.instruction or "",
+        input=segment.input or "", question=segment.question or "",
+        intent=segment.intent or "", output=segment.output or "",
+        creatorEmail=segment.creator_email or "",
+        index=segment.Segments.serial_number,
+        leaseExpiresAt=segment.lease_expires_at.strftime("%Y-%m-%d %H:%M:%S") if segment.lease_expires_at else "",
+        ordinal=segment.ordinal if segment.ordinal is not None else -1,
+    )
 
 
 # 将标注数据拆分成训练集和测试集
@@ -71,22 +183,16 @@ async def split_annotation(request: Request, annotationId: str, req: DataAnnotat
         logger.warn(f"The test percent must be between 0 and 1: {req.testPercent}")
         raise HTTPException(status_code=400, detail="The test percent must be between 0 and 1.")
 
-    # 根据比例随机取出相应条数据更新成测试集
-    segments: List[DataAnnotationSegments] = await store.data_annotation().get_annotation_segment_by_rank(
-        data_annotation.id,
-        status=DataAnnotationStatus.COMPLETED,
-        test_percent=req.testPercent)
-
-    segment_ids: List[int] = [segment.id for segment in segments]
+    # 根据种子哈希按比例取出相应条数据更新成测试集，可重复执行
     try:
-        await store.data_annotation().update_annotation_segment_type(segment_ids, DataAnnotationSegmentType.TEST)
+        test_total = await store.data_annotation().split_annotation_segments(data_annotation.id, req.testPercent,
+                                                                             seed=req.seed,
+                                                                             stratify=req.stratifyByIntent)
     except Exception as e:
         logger.error(f"Split annotation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Split annotation failed: {e}")
 
-    data_annotation.test_total = len(segment_ids)
-    data_annotation.train_total = data_annotation.total - data_annotation.test_total
-    await store.data_annotation().update_data_annotation(data_annotation.id, data_annotation)
+    await store.data_annotation().update_split_totals(data_annotation.id, test_total)
 
     return SuccessResponse()
 
@@ -106,40 +212,94 @@ async def export_annotation(request: Request, annotationId: str, format_type: st
         logger.warn(f"The annotation task is not completed, cannot be exported: {annotationId}")
         raise HTTPException(status_code=400, detail="The annotation task is not completed, cannot be exported.")
 
-    segments, total = await store.data_annotation().get_annotation_segments(data_annotation.id,
-                                                                            status=[
-                                                                                DataAnnotationStatus.COMPLETED])
-    if not segments:
+    if format_type not in JSONL_FORMATS and format_type not in COLUMNAR_FORMATS:
+        logger.warn(f"Export format not supported: {format_type}")
+        raise HTTPException(status_code=400, detail=f"Export format not supported: {format_type}")
+
+    if format_type in COLUMNAR_FORMATS:
+        if importlib.util.find_spec("pyarrow") is None:
+            logger.warn(f"Export format {format_type} requires pyarrow")
+            raise HTTPException(status_code=400, detail=f"Export format {format_type} requires pyarrow.")
+        filename = f"{data_annotation.uuid}.{format_type}"
+        media_type = "application/vnd.apache.parquet" if format_type == "parquet" else \
+            "application/vnd.apache.arrow.file"
+    else:
+        filename = f"{data_annotation.uuid}-train.zip"
+        media_type = "application/zip"
+
+    # 同一任务、格式和内容版本的导出结果相同，命中缓存时直接返回文件或 304
+    cache_key = ExportCache.key(data_annotation.uuid, format_type, data_annotation.content_version)
+    etag = f'"{cache_key}"'
+    headers = {"ETag": etag, "Content-Disposition": f'attachment; filename="{filename}"'}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    cached_path = export_cache.get(cache_key)
+    if cached_path:
+        return FileResponse(path=cached_path, media_type=media_type, headers=headers)
+
+    totals = await store.data_annotation().count_completed_segments_by_type(data_annotation.id)
+    train_total = totals.get(DataAnnotationSegmentType.TRAIN.value, 0)
+    test_total = sum(totals.values()) - train_total
+    if not totals:
         logger.warn(f"Segments not found: {annotationId}")
         raise HTTPException(status_code=404, detail="Segments not found.")
 
-    train_segments = [s for s in segments if
-                      DataAnnotationSegmentType(s.segment_type) == DataAnnotationSegmentType.TRAIN]
-    test_segments = [s for s in segments if
-                     DataAnnotationSegmentType(s.segment_type) != DataAnnotationSegmentType.TRAIN]
-
-    storage_dir = get_config().storage_dir
-    os.makedirs(f"{storage_dir}/temp_files", exist_ok=True)
-    train_file = f"{storage_dir}/{data_annotation.uuid}-train.jsonl"
-    test_file = f"{storage_dir}/{data_annotation.uuid}-test.jsonl"
-
-    # 使用函数来减少重复代码
-    write_segments_to_file(train_segments, train_file, format_type)
-    if test_segments:
-        write_segments_to_file(test_segments, test_file, format_type)
-
-    zip_filename = f"{storage_dir}/temp_files/{data_annotation.uuid}-files.zip"
-    with zipfile.ZipFile(zip_filename, 'w') as zipf:
-        zipf.write(train_file, arcname=os.path.basename(train_file))
-        if test_segments:
-            zipf.write(test_file, arcname=os.path.basename(test_file))
-
-    # 清理临时文件
-    os.remove(train_file)
-    if test_segments:
-        os.remove(test_file)
+    # 直接从服务端游标流式生成文件，不写临时文件，同时写入导出缓存
+    # 查询在这里构造，迭代时才执行；生成器还没开始就断开时由后台任务关闭会话
+    export_db = SessionLocal()
+    try:
+        export_store: Repository = get_repository(export_db)
+        if format_type in COLUMNAR_FORMATS:
+            segments = await export_store.data_annotation().stream_completed_segments(data_annotation.id, train=None)
+            content = stream_export_columnar(export_db, segments, format_type)
+        else:
+            train_segments = await export_store.data_annotation().stream_completed_segments(data_annotation.id,
+                                                                                            train=True)
+            test_segments = await export_store.data_annotation().stream_completed_segments(
+                data_annotation.id, train=False) if test_total > 0 else None
+            content = stream_export_zip(export_db, data_annotation.uuid, format_type, train_segments, test_segments)
+    except Exception:
+        export_db.close()
+        raise
+    return StreamingResponse(export_cache.tee(cache_key, content), media_type=media_type, headers=headers,
+                             background=BackgroundTask(export_db.close))
+
+
+# 增量导出，只返回水位之后发生变化的样本
+@router.get("/task/{annotationId}/export/delta", tags=["annotation"], description="增量导出标注任务数据")
+async def export_annotation_delta(request: Request, annotationId: str, since: int = 0, sinceId: int = 0,
+                                  limit: int = 1000, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId, datasets=False)
+    if not data_annotation:
+        logger.warn(f"Annotation not found: {annotationId}")
+        raise HTTPException(status_code=404, detail="Annotation not found.")
 
-    return FileResponse(path=zip_filename, filename=f"{data_annotation.uuid}-train.zip", media_type='application/zip')
+    page_max = get_config().annotation_delta_page_max
+    if limit < 1 or limit > page_max:
+        logger.warn(f"Delta export limit out of range: {limit}")
+        raise HTTPException(status_code=400, detail=f"The limit must be between 1 and {page_max}.")
+
+    segments = await store.data_annotation().get_changed_segments(data_annotation.id, since=since, since_id=sinceId,
+                                                                  limit=limit + 1)
+    has_more = len(segments) > limit
+    segments = segments[:limit]
+
+    result = [DataAnnotationDeltaSegment(uuid=segment.uuid, status=segment.status,
+                                         segmentType=segment.segment_type or "",
+                                         document=segment.document or "", instruction=segment.instruction or "",
+                                         input=segment.input or "", question=segment.question or "",
+                                         intent=segment.intent or "", output=segment.output or "",
+                                         changeSeq=segment.change_seq,
+                                         updatedAt=segment.updated_at.strftime("%Y-%m-%d %H:%M:%S"))
+              for segment in segments]
+    if segments:
+        watermark, watermark_id = segments[-1].change_seq, segments[-1].id
+    else:
+        watermark, watermark_id = since, sinceId
+    return SuccessResponse(data=DataAnnotationDeltaResponse(list=result, watermark=watermark, watermarkId=watermark_id,
+                                                            hasMore=has_more))
 
 
 @router.delete("/task/{annotationId}/delete", tags=["annotation"], description="删除标注任务")
@@ -186,7 +346,8 @@ async def annotation_info(request: Request, annotationId: str, db: Session = Dep
                                     total=data_annotation.total, createdAt=str(data_annotation.created_at),
                                     completedAt=str(data_annotation.completed_at),
                                     completed=data_annotation.completed,
-                                    abandoned=data_annotation.abandoned))
+                                    abandoned=data_annotation.abandoned,
+                                    modelName=task_model_name(data_annotation)))
 
 
 @router.put("/task/{annotationId}/clean", tags=["annotation"], description="清理标注任务")
@@ -202,14 +363,15 @@ async def clean_annotation(request: Request, annotationId: str, db: Session = De
         logger.warn(f"The annotation task is not pending or processing, cannot be cleaned: {annotationId}")
         raise HTTPException(status_code=400, detail="The annotation task is not pending, cannot be cleaned.")
 
-    data_annotation.status = DataAnnotationStatus.CLEANED
-    data_annotation.completed_at = datetime.now()
-
+    # 只更新状态列，与并发的标注互不覆盖；任务在此期间已经标完时不再清理
     try:
-        await store.data_annotation().update_data_annotation(data_annotation.id, data_annotation)
+        cleaned = await store.data_annotation().clean_data_annotation(data_annotation.id)
     except Exception as e:
         logger.error(f"Clean annotation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Clean annotation failed: {e}")
+    if not cleaned:
+        logger.warn(f"The annotation task is not pending or processing, cannot be cleaned: {annotationId}")
+        raise HTTPException(status_code=400, detail="The annotation task is not pending, cannot be cleaned.")
 
     return SuccessResponse()
 
@@ -227,16 +389,18 @@ async def create_annotation(request: Request, req: AnnotationCreateRequest, db:
         logger.warn(f"Data sequence must be a list of two integers: {req.dataSequence}")
         raise HTTPException(status_code=400, detail="Data sequence must be a list of two integers.")
 
+    if req.modelName and req.modelName not in allowed_models(get_config()):
+        logger.warn(f"Model not allowed: {req.modelName}")
+        raise HTTPException(status_code=400, detail="Model not allowed.")
+
     data_sequence = "-".join(map(str, req.dataSequence))
     total = req.dataSequence[1] - req.dataSequence[0]
 
-    segments = await store.dataset_segments().get_by_dataset_id_and_sn(dataset.id, req.dataSequence[0],
-                                                                       req.dataSequence[1])
-    if not segments:
+    if not await store.dataset_segments().exists_by_dataset_id_and_sn(dataset.id, req.dataSequence[0],
+                                                                      req.dataSequence[1]):
         logger.warn(f"Segments not found: {req.dataSequence}")
         raise HTTPException(status_code=400, detail="Segments not found.")
 
-    annotation_segments: List[DataAnnotationSegments] = []
     try:
         data_annotation: DataAnnotation = await store.data_annotation().create(
             DataAnnotation(dataset_id=dataset.id, uuid=f"annotation-{uuid.uuid4()}", name=req.name, remark=req.remark,
@@ -244,20 +408,15 @@ async def create_annotation(request: Request, req: AnnotationCreateRequest, db:
                            principal=req.principal,
                            status=DataAnnotationStatus.PENDING,
                            data_sequence=data_sequence,
-                           total=total))
+                           total=total, model_name=req.modelName or None))
     except Exception as e:
         logger.error(f"Create annotation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Create annotation failed: {e}")
 
-    for segment in segments:
-        annotation_segments.append(
-            DataAnnotationSegments(data_annotation_id=data_annotation.id, segment_id=segment.id,
-                                   uuid=f"das-{uuid.uuid4()}",
-                                   annotation_type=data_annotation.annotation_type,
-                                   segment_content=segment.content, status=DataAnnotationStatus.PENDING, ))
     try:
-        # 将数据集里的内容放到标注任务里
-        await store.data_annotation().add_annotation_segments(annotation_segments)
+        # 将数据集里的内容放到标注任务里，在数据库内一次完成
+        await store.data_annotation().copy_segments_from_dataset(data_annotation, dataset.id, req.dataSequence[0],
+                                                                 req.dataSequence[1])
     except Exception as e:
         logger.error(f"Create annotation segments failed: {e}")
         await store.data_annotation().delete(data_annotation.id)
@@ -269,7 +428,8 @@ async def create_annotation(request: Request, req: AnnotationCreateRequest, db:
                                                        status=data_annotation.status,
                                                        createdAt=str(data_annotation.created_at),
                                                        dataSequence=list(
-                                                           map(int, data_annotation.data_sequence.split("-")))))
+                                                           map(int, data_annotation.data_sequence.split("-"))),
+                                                       modelName=task_model_name(data_annotation)))
 
 
 @router.get("/task/list", tags=["annotation"], description="获取标注任务列表")
@@ -294,7 +454,7 @@ async def list_annotation(request: Request, status: str = None, page: int = 1, p
                                    completedAt=str(annotation.completed_at),
                                    completed=annotation.completed,
                                    abandoned=annotation.abandoned, trainTotal=annotation.train_total,
-                                   testTotal=annotation.test_total))
+                                   testTotal=annotation.test_total, modelName=task_model_name(annotation)))
 
     return SuccessResponse(
         data=DataAnnotationsResponse(list=result_list, total=total, page=page, pageSize=page_size))
@@ -314,26 +474,45 @@ async def annotation_segment_next(request: Request, annotationId: str, db: Sessi
         raise HTTPException(status_code=400,
                             detail="The annotation task is not pending or processing, cannot be annotated.")
 
-    # 根据sn号获取标注记录
-    annotation_segment_info = await store.data_annotation().get_annotation_one_segment(data_annotation.id,
-                                                                                       status=DataAnnotationStatus.PENDING,
-                                                                                       segment=True)
-    if not annotation_segment_info:
+    # 领取一条待标注样本，租期内不会再分配给其他标注人
+    config = get_config()
+    segments = await store.data_annotation().claim_annotation_segments(data_annotation.id, request.state.email,
+                                                                       size=1,
+                                                                       lease_seconds=config.annotation_lease_seconds)
+    # 标注开始时在后台加载冲突检测索引
+    schedule_conflict_warmup(data_annotation)
+    if not segments:
         logger.warn(f"Segment not found: {annotationId}")
         return SuccessResponse(data=None)
 
-    return SuccessResponse(
-        data=DataAnnotationSegmentResponse(uuid=annotation_segment_info.uuid,
-                                           segmentContent=annotation_segment_info.segment_content,
-                                           createdAt=annotation_segment_info.created_at.strftime("%Y-%m-%d %H:%M:%S")),
-        updatedAt=annotation_segment_info.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
-        status=annotation_segment_info.status, annotationType=annotation_segment_info.annotation_type,
-        document=annotation_segment_info.document, instruction=annotation_segment_info.instruction,
-        input=annotation_segment_info.input, question=annotation_segment_info.question,
-        intent=annotation_segment_info.intent, output=annotation_segment_info.output,
-        creatorEmail=annotation_segment_info.creator_email,
-        index=annotation_segment_info.Segments.serial_number
-    )
+    return SuccessResponse(data=segment_to_response(segments[0]))
+
+
+@router.get("/task/{annotationId}/segment/claim", tags=["annotation"], description="批量领取标注任务样本")
+async def annotation_segment_claim(request: Request, annotationId: str, size: int = 1, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId, datasets=False)
+    if not data_annotation:
+        logger.warn(f"Annotation not found: {annotationId}")
+        raise HTTPException(status_code=404, detail="Annotation not found.")
+
+    if data_annotation.status != DataAnnotationStatus.PENDING and data_annotation.status != DataAnnotationStatus.PROCESSING:
+        logger.warn(f"The annotation task is not pending or processing, cannot be annotated: {annotationId}")
+        raise HTTPException(status_code=400,
+                            detail="The annotation task is not pending or processing, cannot be annotated.")
+
+    config = get_config()
+    if size < 1 or size > config.annotation_prefetch_max:
+        logger.warn(f"Claim size out of range: {size}")
+        raise HTTPException(status_code=400,
+                            detail=f"The claim size must be between 1 and {config.annotation_prefetch_max}.")
+
+    segments = await store.data_annotation().claim_annotation_segments(data_annotation.id, request.state.email,
+                                                                       size=size,
+                                                                       lease_seconds=config.annotation_lease_seconds)
+    schedule_conflict_warmup(data_annotation)
+    return SuccessResponse(data=[segment_to_response(segment) for segment in segments])
 
 
 @router.get("/task/{annotationId}/segment/{segmentId}/info", tags=["annotation"], description="获取一条标注任务样本")
@@ -349,24 +528,14 @@ async def annotation_segment_next(request: Request, annotationId: str, segmentId
         logger.warn(f"The annotation task is not pending, cannot be annotated: {annotationId}")
         raise HTTPException(status_code=400, detail="The annotation task is not pending, cannot be annotated.")
 
-    # 根据sn号获取标注记录
+    # 根据样本ID获取标注记录
     annotation_segment_info = await store.data_annotation().get_annotation_segment_by_uuid(data_annotation.id,
                                                                                            segmentId)
     if not annotation_segment_info:
         logger.warn(f"Segment not found: {annotationId}")
         raise HTTPException(status_code=404, detail="Segment not found.")
 
-    return SuccessResponse(
-        data=DataAnnotationSegmentResponse(uuid=annotation_segment_info.uuid,
-                                           segmentContent=annotation_segment_info.segment_content,
-                                           createdAt=annotation_segment_info.created_at.strftime("%Y-%m-%d %H:%M:%S")),
-        updatedAt=annotation_segment_info.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
-        status=annotation_segment_info.status, annotationType=annotation_segment_info.annotation_type,
-        document=annotation_segment_info.document, instruction=annotation_segment_info.instruction,
-        input=annotation_segment_info.input, question=annotation_segment_info.question,
-        intent=annotation_segment_info.intent, output=annotation_segment_info.output,
-        creatorEmail=annotation_segment_info.creator_email,
-    )
+    return SuccessResponse(data=segment_to_response(annotation_segment_info))
 
 
 @router.get("/task/{annotationId}/segment/{index}/get", tags=["annotation"], description="获取一条标注任务样本")
@@ -382,23 +551,17 @@ async def annotation_segment_get(request: Request, annotationId: str, index: int
         logger.warn(f"The annotation task is not pending, cannot be annotated: {annotationId}")
         raise HTTPException(status_code=400, detail="The annotation task is not pending, cannot be annotated.")
 
-    # 根据sn号获取标注记录
-    annotation_segment_info = await store.data_annotation().get_annotation_one_segment(data_annotation.id, index)
+    # 按任务内序号获取标注记录，同时返回前后样本的序号用于翻页
+    annotation_segment_info = await store.data_annotation().get_annotation_one_segment(data_annotation.id, index,
+                                                                                       segment=True)
     if not annotation_segment_info:
         logger.warn(f"Segment not found: {annotationId}")
         raise HTTPException(status_code=404, detail="Segment not found.")
 
-    return SuccessResponse(
-        data=DataAnnotationSegmentResponse(uuid=annotation_segment_info.uuid,
-                                           segmentContent=annotation_segment_info.segment_content,
-                                           createdAt=annotation_segment_info.created_at.strftime("%Y-%m-%d %H:%M:%S")),
-        updatedAt=annotation_segment_info.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
-        status=annotation_segment_info.status, annotationType=annotation_segment_info.annotation_type,
-        document=annotation_segment_info.document, instruction=annotation_segment_info.instruction,
-        input=annotation_segment_info.input, question=annotation_segment_info.question,
-        intent=annotation_segment_info.intent, output=annotation_segment_info.output,
-        creatorEmail=annotation_segment_info.creator_email,
-    )
+    response = segment_to_response(annotation_segment_info)
+    response.previousOrdinal = index - 1 if index > 0 else -1
+    response.nextOrdinal = index + 1 if index + 1 < (data_annotation.total or 0) else -1
+    return SuccessResponse(data=response)
 
 
 @router.post("/task/{annotationId}/segment/{annotationSegmentId}/mark", tags=["annotation"],
@@ -419,25 +582,100 @@ async def annotation_mark(request: Request, annotationId: str, annotationSegment
         logger.warn(f"Segment not found: {annotationSegmentId}")
         raise HTTPException(status_code=404, detail="Segment not found.")
 
-    segment.creator_email = email
-    segment.status = DataAnnotationStatus.COMPLETED
-    segment.document = req.document
-    segment.instruction = req.instruction
-    segment.input = req.input
-    segment.question = req.question
-    segment.intent = req.intent
-    segment.output = req.output
-    segment.updated_at = datetime.now()
+    update_data = {
+        "creator_email": email,
+        "status": DataAnnotationStatus.COMPLETED,
+        "document": req.document,
+        "instruction": req.instruction,
+        "input": req.input,
+        "question": req.question,
+        "intent": req.intent,
+        "output": req.output,
+    }
 
     try:
-        data_annotation.completed = data_annotation.completed + 1
-        data_annotation.train_total = data_annotation.train_total + 1
-        await store.data_annotation().update_annotation_segment(data_annotation, segment)
+        await store.data_annotation().update_annotation_segment(data_annotation.id, segment.id, update_data)
     except Exception as e:
         logger.error(f"Mark annotation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Mark annotation failed: {e}")
+    schedule_search_sync(data_annotation.dataset_id, only_resident=True)
 
-    return SuccessResponse()
+    conflicts = {}
+    # 冲突检测只是提示，失败时不影响标注结果
+    try:
+        conflicts = await check_intent_conflicts(store, data_annotation, [segment.uuid])
+    except Exception as e:
+        logger.warn(f"Check intent conflicts failed: {e}")
+
+    return SuccessResponse(data=DataAnnotationSegmentMarkResponse(conflicts=conflicts.get(segment.uuid, [])))
+
+
+@router.post("/task/{annotationId}/segments/mark:batch", tags=["annotation"], description="批量标注或放弃任务样本")
+async def annotation_batch_mark(request: Request, annotationId: str, req: DataAnnotationSegmentBatchMarkRequest,
+                                db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    email = request.state.email
+    store: Repository = get_repository(db)
+    data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId, datasets=False)
+    if not data_annotation:
+        logger.warn(f"Annotation not found: {annotationId}")
+        raise HTTPException(status_code=404, detail="Annotation not found.")
+
+    batch_max = get_config().annotation_batch_mark_max
+    if not req.items or len(req.items) > batch_max:
+        logger.warn(f"Batch mark size out of range: {len(req.items)}")
+        raise HTTPException(status_code=400, detail=f"The number of items must be between 1 and {batch_max}.")
+
+    # 先整体校验，非法的条目单独返回错误，其余条目在一个事务内批量更新
+    errors = {}
+    items = {}
+    for item in req.items:
+        if item.segmentId in items or item.segmentId in errors:
+            errors[item.segmentId] = "Duplicate segment in batch."
+            items.pop(item.segmentId, None)
+        elif item.action == "mark":
+            items[item.segmentId] = {
+                "creator_email": email,
+                "status": DataAnnotationStatus.COMPLETED,
+                "document": item.document,
+                "instruction": item.instruction,
+                "input": item.input,
+                "question": item.question,
+                "intent": item.intent,
+                "output": item.output,
+            }
+        elif item.action == "abandon":
+            items[item.segmentId] = {
+                "creator_email": email,
+                "status": DataAnnotationStatus.ABANDONED,
+            }
+        else:
+            errors[item.segmentId] = f"Unsupported action: {item.action}"
+
+    if items:
+        try:
+            errors.update(await store.data_annotation().batch_update_annotation_segments(data_annotation.id, items))
+        except Exception as e:
+            logger.error(f"Batch mark annotation failed: {e}")
+            raise HTTPException(status_code=500, detail=f"Batch mark annotation failed: {e}")
+        schedule_search_sync(data_annotation.dataset_id, only_resident=True)
+
+    # 标注成功的条目同样做冲突检测，先同步一次索引再逐条检查
+    conflicts = {}
+    marked = [uid for uid, update_data in items.items()
+              if update_data["status"] == DataAnnotationStatus.COMPLETED and errors.get(uid) is None]
+    try:
+        conflicts = await check_intent_conflicts(store, data_annotation, marked)
+    except Exception as e:
+        logger.warn(f"Check intent conflicts failed: {e}")
+
+    results = [DataAnnotationSegmentBatchMarkResult(segmentId=item.segmentId, success=errors.get(item.segmentId) is None,
+                                                    message=errors.get(item.segmentId) or "",
+                                                    conflicts=conflicts.get(item.segmentId, []))
+               for item in req.items]
+    succeeded = len([r for r in results if r.success])
+    return SuccessResponse(data=DataAnnotationSegmentBatchMarkResponse(results=results, succeeded=succeeded,
+                                                                       failed=len(results) - succeeded))
 
 
 @router.put("/task/{annotationId}/segment/{annotationSegmentId}/abandoned", tags=["annotation"],
@@ -458,24 +696,147 @@ async def abandoned_annotation(request: Request, annotationId: str, annotationSe
         logger.warn(f"Segment not found: {annotationSegmentId}")
         raise HTTPException(status_code=404, detail="Segment not found.")
 
-    segment.status = DataAnnotationStatus.ABANDONED
-    segment.updated_at = datetime.now()
-    segment.creator_email = email
+    update_data = {
+        "creator_email": email,
+        "status": DataAnnotationStatus.ABANDONED,
+    }
 
     try:
-        data_annotation.abandoned = data_annotation.abandoned + 1
-        await store.data_annotation().update_annotation_segment(data_annotation, segment)
+        await store.data_annotation().update_annotation_segment(data_annotation.id, segment.id, update_data)
     except Exception as e:
         logger.error(f"Abandoned annotation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Mark annotation failed: {e}")
+    schedule_search_sync(data_annotation.dataset_id, only_resident=True)
 
     return SuccessResponse()
 
 
-@router.post("/task/{annotationId}/detect/annotation/sync", tags=["annotation"], description="同步检查标注任务是否完成")
-async def detect_annotation(request: Request, annotationId: str, db: Session = Depends(get_db)):
-    tenant_id = request.state.tenant_id
-    store: Repository = get_repository(db)
+async def save_intent_results(store: Repository, annotation_id: int, job_id: int,
+                              eval_result: SimilarQuestionIntent) -> DataAnnotationDetectResponse:
+    # 问题对的数量随样本数平方增长，只保存前 annotation_detect_result_max 条，统计数仍然是完整的
+    result_max = get_config().annotation_detect_result_max
+    mismatched = eval_result.mismatchedIntents
+    mismatched_rows = (dict(intent1=item.intent1, intent2=item.intent2,
+                            question1=item.questionPair[0], question2=item.questionPair[1],
+                            answer1=item.answer1, answer2=item.answer2,
+                            line_number1=item.lineNumbers[0], line_number2=item.lineNumbers[1])
+                       for item in mismatched[:result_max])
+    similar_rows = (dict(intent1=item.intentPair[0], intent2=item.intentPair[1], similarity=item.similarity)
+                    for item in eval_result.similarIntents)
+    await store.data_annotation().add_detect_results(annotation_id, job_id, mismatched_rows, similar_rows)
+
+    return DataAnnotationDetectResponse(
+        mismatchedTotal=len(mismatched),
+        mismatchedIntentPairs=len({(item.intent1, item.intent2) for item in mismatched}),
+        similarTotal=len(eval_result.similarIntents),
+        truncated=len(mismatched) > result_max,
+    )
+
+
+async def save_context_results(store: Repository, annotation_id: int, job_id: int,
+                               eval_result: ContextConsistency) -> DataAnnotationDetectResponse:
+    result_max = get_config().annotation_detect_result_max
+    ungrounded = eval_result.ungroundedOutputs
+    duplicates = eval_result.duplicateQuestions
+    ungrounded_rows = (dict(question=item.question, output=item.output, score=item.score,
+                            line_number=item.lineNumber) for item in ungrounded[:result_max])
+    duplicate_rows = (dict(question1=item.questionPair[0], question2=item.questionPair[1],
+                           answer1=item.answer1, answer2=item.answer2, similarity=item.similarity,
+                           line_number1=item.lineNumbers[0], line_number2=item.lineNumbers[1])
+                      for item in duplicates[:result_max])
+    await store.data_annotation().add_context_results(annotation_id, job_id, ungrounded_rows, duplicate_rows)
+
+    return DataAnnotationDetectResponse(
+        ungroundedTotal=len(ungrounded),
+        duplicateQuestionTotal=len(duplicates),
+        truncated=len(ungrounded) > result_max or len(duplicates) > result_max,
+    )
+
+
+async def heartbeat_detect_job(store: Repository, job_id: int):
+    """作业排队和运行期间定期刷新 updated_at，进程退出后心跳停止，作业由 fail_stale_detect_jobs 标为失败"""
+    interval = get_config().annotation_detect_heartbeat_seconds
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await store.data_annotation().update_detect_job(job_id, {}):
+                return
+        except Exception as e:
+            logger.warn(f"Detect job heartbeat failed: {e}")
+
+
+async def fail_stale_detect_jobs(store: Repository, job_id: int = None) -> int:
+    """把没有心跳的待运行或运行中作业标为失败，启动时检查全部作业，查询作业时只检查该作业"""
+    before = datetime.now() - timedelta(seconds=get_config().annotation_detect_stale_seconds)
+    count = await store.data_annotation().fail_stale_detect_jobs(before, job_id)
+    if count:
+        logger.warn(f"Marked {count} stale detect jobs as failed")
+    return count
+
+
+async def track_detect_job(job_id: int, annotation_id: int, handle: DetectJobHandle):
+    """等待检测作业结束并记录状态和结果，作业在请求结束后继续运行，这里使用独立的会话"""
+    db = SessionLocal()
+    heartbeat = None
+    try:
+        store: Repository = get_repository(db)
+        heartbeat = asyncio.create_task(heartbeat_detect_job(store, job_id))
+        started = asyncio.ensure_future(handle.started.wait())
+        await asyncio.wait([started, handle.future], return_when=asyncio.FIRST_COMPLETED)
+        started.cancel()
+        if handle.started.is_set():
+            await store.data_annotation().update_detect_job(job_id, {
+                "status": DataAnnotationDetectJobStatus.RUNNING,
+                "started_at": datetime.now(),
+            })
+
+        try:
+            eval_result = await handle.future
+        except (asyncio.CancelledError, DetectCancelledError):
+            if not handle.cancelled.is_set():
+                raise
+            logger.info(f"Detect job cancelled: {handle.job_id}")
+            await store.data_annotation().update_detect_job(job_id, {
+                "status": DataAnnotationDetectJobStatus.CANCELLED,
+                "finished_at": datetime.now(),
+            })
+            return
+        except Exception as e:
+            logger.warn(f"Detect annotation failed: {e}")
+            await store.data_annotation().update_detect_job(job_id, {
+                "status": DataAnnotationDetectJobStatus.FAILED,
+                "message": str(e)[:1000],
+                "finished_at": datetime.now(),
+            })
+            return
+
+        if isinstance(eval_result, ContextConsistency):
+            result = await save_context_results(store, annotation_id, job_id, eval_result)
+        else:
+            result = await save_intent_results(store, annotation_id, job_id, eval_result)
+        finished = await store.data_annotation().update_detect_job(job_id, {
+            "status": DataAnnotationDetectJobStatus.COMPLETED,
+            "result": json.dumps(result.dict(), ensure_ascii=False),
+            "finished_at": datetime.now(),
+        })
+        if not finished:
+            # 作业已经在其他进程中被取消，丢弃结果
+            logger.info(f"Detect job finished after cancelled: {handle.job_id}")
+            await store.data_annotation().delete_detect_results(job_id)
+            return
+
+        # 只保留最新一次检测的结果
+        await store.data_annotation().delete_stale_detect_results(annotation_id, job_id)
+    except Exception as e:
+        logger.error(f"Track detect job failed: {e}")
+    finally:
+        if heartbeat:
+            heartbeat.cancel()
+        db.close()
+
+
+async def submit_detect_job(store: Repository, tenant_id: int, annotationId: str, model_name: str = None) -> (
+        DataAnnotationDetectJob, asyncio.Task):
     data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId, segments=True)
     if not data_annotation:
         logger.warn(f"Annotation not found: {annotationId}")
@@ -485,35 +846,249 @@ async def detect_annotation(request: Request, annotationId: str, db: Session = D
         logger.warn(f"The annotation task is not completed: {annotationId}")
         raise HTTPException(status_code=400, detail="The annotation task is not completed.")
 
-    # SBERT模型进行文本相似度比较
-    # 获取所有已标注后的内容
-    if DataAnnotationType(data_annotation.annotation_type) == DataAnnotationType.FAQ:
-        # 获取所有已标注后的内容
-        eval_data: List[QuestionIntent] = []
-        for segment in data_annotation.Segments:
-            eval_data.append(QuestionIntent(input=segment.input, intent=segment.intent, output=segment.output))
+    annotation_type = DataAnnotationType(data_annotation.annotation_type)
 
-        try:
-            eval_result = await datasets_model.analyze_similar_questions_and_intents(data=eval_data)
-            # 保存检测结果
-            data_annotation.test_repo = json.dumps([item.dict() for item in eval_data], ensure_ascii=False)
-        except Exception as e:
-            logger.warn(f"Detect annotation failed: {e}")
-            raise HTTPException(status_code=500, detail=f"Detect annotation failed: {e}")
+    # 本次检测可以临时换用其他允许的模型，默认使用任务选择的模型
+    if model_name and model_name not in allowed_models(get_config()):
+        logger.warn(f"Model not allowed: {model_name}")
+        raise HTTPException(status_code=400, detail="Model not allowed.")
+    model_name = model_name or task_model_name(data_annotation)
+
+    # SBERT模型进行文本相似度比较，获取所有已标注后的内容
+    config = get_config()
+    if annotation_type == DataAnnotationType.FAQ:
+        eval_data = [QuestionIntent(input=segment.input, intent=segment.intent, output=segment.output)
+                     for segment in data_annotation.Segments]
+
+        def run_detect(cancelled):
+            with use_datasets_model(model_name) as model:
+                return model.analyze(eval_data, cancelled=cancelled)
     else:
-        logger.info(f"Annotation type not supported: {data_annotation.annotation_type}")
-        raise HTTPException(status_code=400, detail="Annotation type not supported.")
+        # RAG 的答案应当来自文档，通用任务没有文档，答案只与指令和输入比较
+        eval_data = [ContextAnswer(question=segment.question or "", document=segment.document or "",
+                                   output=segment.output or "")
+                     if annotation_type == DataAnnotationType.RAG else
+                     ContextAnswer(question="\n".join(filter(None, [segment.instruction, segment.input])),
+                                   output=segment.output or "")
+                     for segment in data_annotation.Segments]
+
+        def run_detect(cancelled):
+            with use_datasets_model(model_name) as model:
+                return model.analyze_context(
+                    eval_data, config.annotation_grounding_threshold, config.annotation_duplicate_question_threshold,
+                    config.annotation_document_chunk_size, cancelled=cancelled)
+
+    job_uuid = f"detect-{uuid.uuid4()}"
+    try:
+        # 模型在作业线程中加载，不阻塞事件循环
+        handle = detect_runner.submit(job_uuid, run_detect)
+    except DetectQueueFullError as e:
+        logger.warn(f"Detect annotation rejected: {e}")
+        raise HTTPException(status_code=429, detail=str(e))
 
     try:
-        await store.data_annotation().update_data_annotation(data_annotation.id, data_annotation)
+        job = await store.data_annotation().create_detect_job(DataAnnotationDetectJob(
+            uuid=job_uuid, tenant_id=tenant_id, data_annotation_id=data_annotation.id,
+            status=DataAnnotationDetectJobStatus.PENDING))
     except Exception as e:
-        logger.error(f"Detect annotation failed: {e}")
-        raise HTTPException(status_code=500, detail=f"Detect annotation failed: {e}")
+        detect_runner.cancel(job_uuid)
+        logger.error(f"Create detect job failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Create detect job failed: {e}")
+
+    task = asyncio.create_task(track_detect_job(job.id, data_annotation.id, handle))
+    detect_tasks.add(task)
+    task.add_done_callback(detect_tasks.discard)
+    return job, task
+
+
+def detect_job_to_response(job: DataAnnotationDetectJob) -> DataAnnotationDetectJobResponse:
+    return DataAnnotationDetectJobResponse(
+        jobId=job.uuid,
+        status=job.status,
+        message=job.message or "",
+        createdAt=job.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        startedAt=job.started_at.strftime("%Y-%m-%d %H:%M:%S") if job.started_at else "",
+        finishedAt=job.finished_at.strftime("%Y-%m-%d %H:%M:%S") if job.finished_at else "",
+        result=DataAnnotationDetectResponse(**json.loads(job.result)) if job.result else None,
+    )
+
+
+@router.post("/task/{annotationId}/detect/annotation", tags=["annotation"], description="提交检测标注任务的作业")
+async def submit_detect_annotation(request: Request, annotationId: str, modelName: str = None,
+                                   db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    job, _ = await submit_detect_job(store, tenant_id, annotationId, modelName)
+    return SuccessResponse(data=detect_job_to_response(job))
+
+
+@router.get("/task/{annotationId}/detect/annotation/jobs/{jobId}", tags=["annotation"],
+            description="查询检测作业的状态和结果")
+async def get_detect_annotation_job(request: Request, annotationId: str, jobId: str, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId)
+    if not data_annotation:
+        logger.warn(f"Annotation not found: {annotationId}")
+        raise HTTPException(status_code=404, detail="Annotation not found.")
+
+    job = await store.data_annotation().get_detect_job_by_uuid(data_annotation.id, jobId)
+    if not job:
+        logger.warn(f"Detect job not found: {jobId}")
+        raise HTTPException(status_code=404, detail="Detect job not found.")
+
+    if job.status in (DataAnnotationDetectJobStatus.PENDING, DataAnnotationDetectJobStatus.RUNNING) and \
+            await fail_stale_detect_jobs(store, job.id):
+        # 在请求的会话中更新并提交，刷新读到的是新的状态而不是事务开始时的快照
+        db.refresh(job)
+
+    return SuccessResponse(data=detect_job_to_response(job))
+
+
+@router.put("/task/{annotationId}/detect/annotation/jobs/{jobId}/cancel", tags=["annotation"],
+            description="取消检测作业")
+async def cancel_detect_annotation_job(request: Request, annotationId: str, jobId: str,
+                                       db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId)
+    if not data_annotation:
+        logger.warn(f"Annotation not found: {annotationId}")
+        raise HTTPException(status_code=404, detail="Annotation not found.")
+
+    job = await store.data_annotation().get_detect_job_by_uuid(data_annotation.id, jobId)
+    if not job:
+        logger.warn(f"Detect job not found: {jobId}")
+        raise HTTPException(status_code=404, detail="Detect job not found.")
+
+    # 作业可能运行在其他进程中，此时只更新状态，结束时结果会被丢弃
+    detect_runner.cancel(job.uuid)
+    cancelled = await store.data_annotation().update_detect_job(job.id, {
+        "status": DataAnnotationDetectJobStatus.CANCELLED,
+        "finished_at": datetime.now(),
+    })
+    if not cancelled:
+        logger.warn(f"Detect job already finished: {jobId}")
+        raise HTTPException(status_code=400, detail="Detect job already finished.")
+
+    db.refresh(job)
+    return SuccessResponse(data=detect_job_to_response(job))
+
+
+async def get_detect_job_for_results(store: Repository, tenant_id: int, annotationId: str,
+                                     jobId: str = None) -> DataAnnotationDetectJob:
+    data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId)
+    if not data_annotation:
+        logger.warn(f"Annotation not found: {annotationId}")
+        raise HTTPException(status_code=404, detail="Annotation not found.")
+
+    if jobId:
+        job = await store.data_annotation().get_detect_job_by_uuid(data_annotation.id, jobId)
+    else:
+        job = await store.data_annotation().get_latest_detect_job(data_annotation.id)
+    if not job or job.status != DataAnnotationDetectJobStatus.COMPLETED:
+        logger.warn(f"Completed detect job not found: {annotationId} {jobId}")
+        raise HTTPException(status_code=404, detail="Completed detect job not found.")
+    return job
+
+
+@router.get("/task/{annotationId}/detect/mismatched", tags=["annotation"], description="分页获取意图不一致的相似问题")
+async def list_mismatched_intents(request: Request, annotationId: str, jobId: str = None, intent: str = None,
+                                  intent1: str = None, intent2: str = None, page: int = 1, page_size: int = 20,
+                                  db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    job = await get_detect_job_for_results(store, tenant_id, annotationId, jobId)
+    rows, total = await store.data_annotation().get_mismatched_intents(job.id, intent, intent1, intent2, page,
+                                                                       page_size)
+    result_list = [MismatchedIntents(questionPair=[row.question1, row.question2], intent1=row.intent1,
+                                     intent2=row.intent2, answer1=row.answer1 or "", answer2=row.answer2 or "",
+                                     lineNumbers=[row.line_number1, row.line_number2]) for row in rows]
+    return SuccessResponse(data=DataAnnotationMismatchedIntentsResponse(list=result_list, total=total, page=page,
+                                                                         pageSize=page_size))
+
+
+@router.get("/task/{annotationId}/detect/similar", tags=["annotation"], description="分页获取相似的意图")
+async def list_similar_intents(request: Request, annotationId: str, jobId: str = None, intent: str = None,
+                               page: int = 1, page_size: int = 20, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    job = await get_detect_job_for_results(store, tenant_id, annotationId, jobId)
+    rows, total = await store.data_annotation().get_similar_intents(job.id, intent, page, page_size)
+    result_list = [SimilarIntents(intentPair=[row.intent1, row.intent2], similarity=row.similarity) for row in rows]
+    return SuccessResponse(data=DataAnnotationSimilarIntentsResponse(list=result_list, total=total, page=page,
+                                                                      pageSize=page_size))
+
+
+@router.get("/task/{annotationId}/detect/ungrounded", tags=["annotation"], description="分页获取答案无依据的样本")
+async def list_ungrounded_outputs(request: Request, annotationId: str, jobId: str = None, page: int = 1,
+                                  page_size: int = 20, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    job = await get_detect_job_for_results(store, tenant_id, annotationId, jobId)
+    rows, total = await store.data_annotation().get_ungrounded_outputs(job.id, page, page_size)
+    result_list = [UngroundedOutput(question=row.question or "", output=row.output, score=row.score,
+                                    lineNumber=row.line_number) for row in rows]
+    return SuccessResponse(data=DataAnnotationUngroundedOutputsResponse(list=result_list, total=total, page=page,
+                                                                         pageSize=page_size))
+
+
+@router.get("/task/{annotationId}/detect/duplicates", tags=["annotation"], description="分页获取近似重复的问题")
+async def list_duplicate_questions(request: Request, annotationId: str, jobId: str = None, page: int = 1,
+                                   page_size: int = 20, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    job = await get_detect_job_for_results(store, tenant_id, annotationId, jobId)
+    rows, total = await store.data_annotation().get_duplicate_questions(job.id, page, page_size)
+    result_list = [DuplicateQuestions(questionPair=[row.question1, row.question2], answer1=row.answer1 or "",
+                                      answer2=row.answer2 or "", similarity=row.similarity,
+                                      lineNumbers=[row.line_number1, row.line_number2]) for row in rows]
+    return SuccessResponse(data=DataAnnotationDuplicateQuestionsResponse(list=result_list, total=total, page=page,
+                                                                          pageSize=page_size))
+
+
+@router.get("/task/{annotationId}/detect/intents/matrix", tags=["annotation"], description="意图两两之间的相似度矩阵")
+async def intent_similarity_matrix(request: Request, annotationId: str, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    data_annotation = await store.data_annotation().get_by_uuid(tenant_id=tenant_id, uid=annotationId)
+    if not data_annotation:
+        logger.warn(f"Annotation not found: {annotationId}")
+        raise HTTPException(status_code=404, detail="Annotation not found.")
+
+    rows = await store.data_annotation().count_completed_intents(data_annotation.id,
+                                                                 get_config().annotation_intent_matrix_max)
+    intents = [intent for intent, _ in rows]
+    try:
+        loop = asyncio.get_running_loop()
+        model_name = task_model_name(data_annotation)
+
+        def similarity_matrix():
+            with use_datasets_model(model_name) as model:
+                return model.intent_similarity_matrix(intents)
+
+        matrix = await loop.run_in_executor(None, similarity_matrix)
+    except Exception as e:
+        logger.error(f"Intent similarity matrix failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Intent similarity matrix failed: {e}")
+
+    return SuccessResponse(data=DataAnnotationIntentMatrixResponse(
+        intents=intents, counts=[total for _, total in rows], matrix=matrix.round(4).tolist()))
+
+
+@router.post("/task/{annotationId}/detect/annotation/sync", tags=["annotation"], description="同步检查标注任务是否完成")
+async def detect_annotation(request: Request, annotationId: str, modelName: str = None,
+                            db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+    job, task = await submit_detect_job(store, tenant_id, annotationId, modelName)
+    # 客户端断开时不取消作业，结果仍然可以通过作业查询
+    await asyncio.shield(task)
 
-    # 根据标内容的类型生成对应的文件
-    # 异步调用模型对内容进行检测
+    db.refresh(job)
+    if job.status == DataAnnotationDetectJobStatus.CANCELLED:
+        raise HTTPException(status_code=409, detail="Detect job cancelled.")
+    if job.status != DataAnnotationDetectJobStatus.COMPLETED:
+        raise HTTPException(status_code=500, detail=f"Detect annotation failed: {job.message}")
 
-    return SuccessResponse(data=DataAnnotationDetectResponse(
-        similarIntents=eval_result.similarIntents,
-        mismatchedIntents=eval_result.mismatchedIntents
-    ))
+    return SuccessResponse(data=detect_job_to_response(job).result)
@@ -1,16 +1,25 @@
+import asyncio
 import os
 import uuid
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator, Dict, Any
 
 from fastapi import APIRouter, Depends, Form, UploadFile, File, HTTPException, Request
 from requests import Session
 
+from app.config.config import get_config
+from app.core.datasets.datasets_model import split_questions
+from app.core.datasets.model_registry import use_datasets_model
+from app.core.datasets.search_index import DatasetSearcher, SearchEntry
 from app.logger.logger import get_logger
-from app.models.base import get_db
+from app.models.base import get_db, SessionLocal
+from app.models.data_annotation import DataAnnotation, DataAnnotationSegments, DataAnnotationStatus, \
+    DataAnnotationType
 from app.models.datasets import Datasets, DatasetSegments
 from app.protocol.api_protocol import ErrorResponse, SuccessResponse, ErrorException
-from app.protocol.datasets_protocol import DatasetsResponse, DatasetCreateRequest, DatasetResponse
+from app.protocol.datasets_protocol import DatasetsResponse, DatasetCreateRequest, DatasetResponse, \
+    DatasetSearchResponse
 from app.repository.repository import Repository, get_repository
+from app.utils.stream_reader import split_upload_file, SegmentTooLongError
 
 router = APIRouter(
     prefix="/datasets",
@@ -21,6 +30,38 @@ router = APIRouter(
 
 logger = get_logger("datasets")
 
+# 语义搜索，每个进程为最近搜索的数据集维护向量索引
+dataset_searcher = DatasetSearcher(use_datasets_model, get_config().datasets_search_max_indexes,
+                                   get_config().datasets_search_ann_min_size)
+
+
+async def iter_dataset_segments(file: UploadFile, dataset_id: int, split_type: str, split_max: int,
+                                chunk_size: int) -> AsyncIterator[Dict[str, Any]]:
+    """按块读取上传文件，逐条生成数据集切片的行数据"""
+    sn = 0
+    i = -1
+    try:
+        async for content in split_upload_file(file, split_type, chunk_size, max_length=split_max):
+            i += 1
+            if len(content.strip()) == 0:
+                continue
+            if len(content.strip()) > split_max:
+                raise SegmentTooLongError(i, split_max)
+            yield dict(uuid=f"segment-{uuid.uuid4()}", dataset_id=dataset_id, content=content,
+                       word_count=len(content.split()), serial_number=sn)
+            sn += 1
+    except SegmentTooLongError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def remove_failed_dataset(store: Repository, dataset: Datasets):
+    try:
+        await store.dataset_segments().delete_by_dataset_id(dataset.id)
+        await store.datasets().delete(dataset, unscoped=True)
+    except Exception as e:
+        logger.error(f"Failed to remove dataset {dataset.id} after a failed upload: {e}")
+
 
 @router.post("/create", tags=["datasets"], description="Create a new dataset.")
 async def create_dataset(request: Request, name: str = Form(...), formatType: str = "txt",
@@ -35,34 +76,15 @@ async def create_dataset(request: Request, name: str = Form(...), formatType: st
     if dataset:
         raise HTTPException(status_code=400, detail="Dataset name already exists.")
 
-    # 获取文件大小，单位为字节
-    file_size = file.file.seek(0, 2)  # 移动到文件的末尾，返回文件大小
-    file.file.seek(0)  # 重置文件指针到开始位置，以便后续读取
-
-    # 设置文件大小限制为 100MB
-    max_file_size = 100 * 1024 * 1024  # 100MB 转换为字节
-
-    # 判断文件大小
-    if file_size > max_file_size:
-        logger.warn(f"File size exceeds limit (100MB)." + f"file size: {file_size}")
-        # 如果文件大于 100MB，返回错误
-        raise HTTPException(status_code=413, detail="File size exceeds limit (100MB).")
-
-    content = await file.read()
-    content_str = content.decode("utf-8")
-    # 如果format_type == 'txt'，则按照split_type和split_max进行切割
-    content_list = []
-    if formatType == 'txt':
-        content_list = content_str.split(split_type)
-
     # 创建数据集
     tenant_id = request.state.tenant_id
     creator_email = request.state.email
+    config = get_config()
 
     try:
         uid = f"dataset-{uuid.uuid4()}"
         dataset = await store.datasets().create(
-            Datasets(name=name, segment_count=len(content_list), uuid=uid, remark=remark, format_type=formatType,
+            Datasets(name=name, segment_count=0, uuid=uid, remark=remark, format_type=formatType,
                      creator_email=creator_email,
                      tenant_id=tenant_id,
                      split_type=split_type,
@@ -71,32 +93,37 @@ async def create_dataset(request: Request, name: str = Form(...), formatType: st
         logger.error(f"Failed to create dataset: {e}")
         raise ErrorException(code=500, message=str(e))
 
-    segment_list: List[DatasetSegments] = []
-    sn = 0
-    for i, content in enumerate(content_list):
-        if len(content.strip()) == 0:
-            continue
-        if len(content.strip()) > splitMax:
-            logger.error(f"Segment {i} exceeds limit {splitMax}.")
-            raise HTTPException(status_code=400, detail=f"Segment {i} exceeds limit {splitMax}.")
-        segment_list.append(
-            DatasetSegments(uuid=f"segment-{uuid.uuid4()}", dataset_id=dataset.id, content=content,
-                            word_count=len(content.split()), serial_number=sn))
-        sn += 1
+    # 按块读取文件并切割，分批写入数据库，内存占用与文件大小无关
+    segment_count = 0
     try:
-        await store.dataset_segments().add_segments(segment_list)
+        # 如果format_type == 'txt'，则按照split_type和split_max进行切割
+        if formatType == 'txt':
+            segments = iter_dataset_segments(file, dataset.id, split_type, splitMax, config.datasets_upload_chunk_size)
+            batch: List[Dict[str, Any]] = []
+            async for segment in segments:
+                batch.append(segment)
+                if len(batch) >= config.datasets_ingest_batch_size:
+                    segment_count += await store.dataset_segments().add_segments(batch)
+                    batch = []
+            if batch:
+                segment_count += await store.dataset_segments().add_segments(batch)
     except Exception as e:
-        # await store.datasets().delete(dataset, unscoped=True)
+        # 已经提交的批次和数据集一起删除，不留下 segment_count 为 0 的半成品
+        await remove_failed_dataset(store, dataset)
+        if isinstance(e, HTTPException):
+            raise
         logger.error(f"Failed to create dataset: {e}")
         raise ErrorException(code=500, message=str(e))
 
-    dataset.segment_count = len(segment_list)
+    dataset.segment_count = segment_count
     try:
         await store.datasets().update(dataset.id, dataset)
     except Exception as e:
         logger.error(f"Failed to update dataset: {e}")
         raise ErrorException(code=500, message=str(e))
 
+    # 新数据集在后台建好本进程的检索索引，第一次搜索不用等待
+    schedule_search_sync(dataset.id)
     return SuccessResponse(data=DatasetResponse(uuid=uid, name=name))
 
 
@@ -134,3 +161,116 @@ async def datasets_list(request: Request, page: int = 1, page_size: int = 10,
                                               splitMax=dataset.split_max))
 
     return SuccessResponse(data=DatasetsResponse(list=dataset_result, total=total, page=page, pageSize=page_size))
+
+
+def annotation_search_entries(annotation: DataAnnotation, segment: DataAnnotationSegments) -> List[SearchEntry]:
+    """已完成的标注样本按问题检索，FAQ 的 input 中每个问题单独一行"""
+    if segment.status != DataAnnotationStatus.COMPLETED:
+        return []
+    if annotation.annotation_type == DataAnnotationType.FAQ and segment.input:
+        texts = split_questions(segment.input)
+    else:
+        texts = [segment.question, segment.input]
+    texts = list(dict.fromkeys(text.strip() for text in texts if text and text.strip()))
+    return [SearchEntry(owner=segment.uuid, source="annotation", text=text, annotation_uuid=annotation.uuid)
+            for text in texts]
+
+
+async def sync_search_index(store: Repository, dataset_id: int, model_name: str):
+    """把新增的切片和标注任务中变更的样本加入本进程的检索索引，只编码水位之后的部分"""
+    loop = asyncio.get_running_loop()
+    batch_size = get_config().datasets_search_sync_batch
+    while True:
+        after = dataset_searcher.segment_watermark(dataset_id, model_name)
+        rows = await store.dataset_segments().get_segments_after(dataset_id, after, batch_size)
+        if not rows:
+            break
+        segments = [(row.id, SearchEntry(owner=row.uuid, source="segment", text=row.content,
+                                         serial_number=row.serial_number)) for row in rows]
+        # 编码是 CPU 密集的操作，放到线程池中执行
+        await loop.run_in_executor(None, dataset_searcher.add_segments, dataset_id, model_name, segments)
+        if len(rows) < batch_size:
+            break
+
+    # 所有任务的变更用一条查询按各自水位分页读取
+    annotations = {annotation.id: annotation
+                   for annotation in await store.data_annotation().get_annotations_by_dataset(dataset_id)}
+    watermarks = dataset_searcher.annotation_watermarks(dataset_id, model_name, list(annotations.keys()))
+    while annotations:
+        changed = await store.data_annotation().get_changed_segments_by_tasks(watermarks, batch_size)
+        if not changed:
+            break
+        entries = {}
+        for segment in changed:
+            entries[segment.uuid] = annotation_search_entries(annotations[segment.data_annotation_id], segment)
+            watermarks[segment.data_annotation_id] = (segment.change_seq, segment.id)
+        page_watermarks = {segment.data_annotation_id: watermarks[segment.data_annotation_id] for segment in changed}
+        await loop.run_in_executor(None, dataset_searcher.apply_annotations, dataset_id, model_name,
+                                   page_watermarks, entries)
+        if len(changed) < batch_size:
+            break
+
+
+# 每个数据集同时只有一个后台同步，同步期间又有写入时结束后再同步一轮
+search_sync_tasks: Dict[int, asyncio.Task] = {}
+search_sync_pending = set()
+
+
+async def run_search_sync(dataset_id: int, model_name: str):
+    try:
+        while True:
+            search_sync_pending.discard(dataset_id)
+            db = SessionLocal()
+            try:
+                await sync_search_index(get_repository(db), dataset_id, model_name)
+            except Exception as e:
+                logger.error(f"Failed to sync search index of dataset {dataset_id}: {e}")
+                break
+            finally:
+                db.close()
+            if dataset_id not in search_sync_pending:
+                break
+    finally:
+        search_sync_tasks.pop(dataset_id, None)
+
+
+def schedule_search_sync(dataset_id: int, model_name: str = "", only_resident: bool = False) -> bool:
+    """
+    在后台同步数据集的检索索引，返回是否仍在同步；写入时传 only_resident，只同步本进程已有的索引
+    """
+    model_name = model_name or get_config().datasets_model_name
+    if only_resident and not dataset_searcher.has_index(dataset_id, model_name):
+        return False
+    if dataset_id in search_sync_tasks:
+        search_sync_pending.add(dataset_id)
+        return True
+    search_sync_tasks[dataset_id] = asyncio.create_task(run_search_sync(dataset_id, model_name))
+    return True
+
+
+@router.get("/{datasetId}/search", tags=["datasets"],
+            description="Semantic search over dataset segments and annotated questions.")
+async def search_dataset(request: Request, datasetId: str, q: str, top_k: int = 10, db: Session = Depends(get_db)):
+    tenant_id = request.state.tenant_id
+    store: Repository = get_repository(db)
+
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query is empty.")
+    top_k = max(1, min(top_k, get_config().datasets_search_top_k_max))
+
+    dataset = await store.datasets().find_by_uuid(tenant_id, datasetId)
+    if dataset is None:
+        logger.warn(f"Dataset {datasetId} not found.")
+        raise HTTPException(status_code=404, detail="Dataset not found.")
+
+    # 搜索只查询当前索引，新增和变更的样本由后台同步加入，不在请求中编码整个数据集
+    model_name = get_config().datasets_model_name
+    try:
+        indexing = schedule_search_sync(dataset.id, model_name)
+        loop = asyncio.get_running_loop()
+        hits = await loop.run_in_executor(None, dataset_searcher.search, dataset.id, model_name, q.strip(), top_k)
+    except Exception as e:
+        logger.error(f"Failed to search dataset: {e}")
+        raise ErrorException(code=500, message=str(e))
+
+    return SuccessResponse(data=DatasetSearchResponse(list=hits, query=q, indexing=indexing))
@@ -52,6 +52,18 @@ store = get_repository(SessionLocal)
 app.include_router(datasets.router, prefix="/mgr")
 app.include_router(data_annotation.router, prefix="/mgr")
 
+
+@app.on_event("startup")
+async def fail_orphaned_detect_jobs():
+    # 重启前未完成的检测作业不会再有心跳，超过失效时间后标为失败
+    db = SessionLocal()
+    try:
+        await data_annotation.fail_stale_detect_jobs(get_repository(db))
+    except Exception as e:
+        logger.error(f"Failed to clean up stale detect jobs: {e}")
+    finally:
+        db.close()
+
 # app.include_router(assistants.router, prefix="/v0")
 # app.include_router(chat.router, prefix="/v0")
 # app.include_router(models.router, prefix="/api/models")
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import uuid
+from typing import Iterable, Iterator, Optional
+
+from app.logger.logger import get_logger
+
+logger = get_logger("export_cache")
+
+
+class ExportCache:
+    """
+    导出文件缓存，文件名由任务、格式和内容版本计算得出，内容变化后版本号变化，旧文件自然失效并按 LRU 淘汰
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(annotation_uuid: str, format_type: str, version: int) -> str:
+        """The content address of an export, also used as its ETag."""
+        return hashlib.sha256(f"{annotation_uuid}:{format_type}:{version}".encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def get(self, key: str) -> Optional[str]:
+        """返回缓存文件路径，不存在返回 None；命中时刷新访问时间"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def tee(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        把 chunks 原样输出，同时写入缓存；完整输出后才落到正式路径，中途断开则丢弃
+        同步生成器，StreamingResponse 在线程池中迭代，文件写入不阻塞事件循环
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.path(key)}.{uuid.uuid4().hex}.tmp"
+        completed = False
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self.path(key))
+            completed = True
+        finally:
+            if not completed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def evict(self):
+        """按最近访问时间淘汰缓存，直到总大小不超过 max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or not entry.name.endswith(".bin"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+            logger.info(f"Evicted export cache: {path}")
@@ -0,0 +1,98 @@
+import json
+from typing import Iterable, Iterator, Callable, Dict
+
+from app.models.data_annotation import DataAnnotationSegments
+from app.utils.zip_stream import StreamBuffer
+
+# 导出的列，列式格式按此顺序写出
+EXPORT_COLUMNS = ["input", "question", "intent", "output", "segment_type"]
+
+
+def _conversation(segment: DataAnnotationSegments) -> dict:
+    return {"messages": [{
+        "role": "system",
+        "content": segment.input
+    }, {
+        "role": "user",
+        "content": segment.question
+    }, {
+        "role": "assistant",
+        "content": segment.output
+    }]}
+
+
+def _alpaca(segment: DataAnnotationSegments) -> dict:
+    return {"instruction": segment.question, "input": segment.input, "output": segment.output}
+
+
+def _sharegpt(segment: DataAnnotationSegments) -> dict:
+    return {"system": segment.input, "conversations": [{
+        "from": "human",
+        "value": segment.question
+    }, {
+        "from": "gpt",
+        "value": segment.output
+    }]}
+
+
+# 行式格式：每行一个 JSON，按训练集/测试集打包成 zip
+JSONL_FORMATS: Dict[str, Callable[[DataAnnotationSegments], dict]] = {
+    "conversation": _conversation,
+    "alpaca": _alpaca,
+    "sharegpt": _sharegpt,
+}
+
+# 列式格式：所有样本写入一个文件，用 segment_type 列区分训练集/测试集，可以直接内存映射读取
+COLUMNAR_FORMATS = ("arrow", "parquet")
+
+
+def segments_to_jsonl(segments: Iterable[DataAnnotationSegments], format_type: str) -> Iterator[bytes]:
+    """把样本按 format_type 转成 jsonl 字节流"""
+    to_record = JSONL_FORMATS[format_type]
+    for segment in segments:
+        yield (json.dumps(to_record(segment), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def segments_to_columnar(segments: Iterable[DataAnnotationSegments], format_type: str,
+                         batch_size: int = 10000) -> Iterator[bytes]:
+    """
+    把样本按批写成 Arrow IPC 文件或 Parquet 文件，边写边输出
+    :param segments: 样本
+    :param format_type: arrow 或 parquet
+    :param batch_size: 每个 record batch（parquet 为 row group）的行数
+    :return: 文件的字节块
+    """
+    # pyarrow 只有列式导出需要，按需导入
+    import pyarrow as pa
+
+    schema = pa.schema([(name, pa.string()) for name in EXPORT_COLUMNS])
+    buffer = StreamBuffer()
+    if format_type == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(buffer, schema)
+    else:
+        writer = pa.ipc.new_file(buffer, schema)
+
+    def to_batch(columns: Dict[str, list]) -> pa.RecordBatch:
+        return pa.record_batch([pa.array(columns[name], type=pa.string()) for name in EXPORT_COLUMNS],
+                               schema=schema)
+
+    columns = {name: [] for name in EXPORT_COLUMNS}
+    rows = 0
+    for segment in segments:
+        for name in EXPORT_COLUMNS:
+            columns[name].append(getattr(segment, name))
+        rows += 1
+        if rows >= batch_size:
+            writer.write_batch(to_batch(columns))
+            columns = {name: [] for name in EXPORT_COLUMNS}
+            rows = 0
+            data = buffer.drain()
+            if data:
+                yield data
+    if rows:
+        writer.write_batch(to_batch(columns))
+    writer.close()
+    data = buffer.drain()
+    if data:
+        yield data
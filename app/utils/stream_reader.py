@@ -0,0 +1,62 @@
+import codecs
+from typing import AsyncIterator
+
+from fastapi import UploadFile
+
+# 每次从上传文件读取的字节数
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class SegmentTooLongError(ValueError):
+    """A segment of the upload is longer than the allowed maximum."""
+
+    def __init__(self, index: int, max_length: int):
+        super().__init__(f"Segment {index} exceeds limit {max_length}.")
+        self.index = index
+        self.max_length = max_length
+
+
+async def split_upload_file(file: UploadFile, separator: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                            encoding: str = "utf-8", max_length: int = 0) -> AsyncIterator[str]:
+    """
+    按块读取上传文件并按分隔符切割，逐段返回
+    :param file: 上传的文件
+    :param separator: 分隔符
+    :param chunk_size: 每次读取的字节数
+    :param encoding: 文件编码
+    :param max_length: 单段去掉首尾空白后的最大长度，未切完的部分超过时抛出 SegmentTooLongError，0 不限制
+    :return: 切割后的文本段
+    """
+    if not separator:
+        raise ValueError("separator must not be empty")
+
+    # 增量解码器可以正确处理被切断在块边界上的多字节字符
+    decoder = codecs.getincrementaldecoder(encoding)()
+    # 只保留还没切出的尾部，每块只在新读入的部分（加上可能跨块的分隔符前缀）中查找分隔符
+    tail = ""
+    index = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        final = not chunk
+        text = decoder.decode(chunk, final=final)
+        if final:
+            tail += text
+            break
+        start = max(0, len(tail) - len(separator) + 1)
+        tail += text
+        pos = 0
+        while True:
+            found = tail.find(separator, max(start, pos))
+            if found < 0:
+                break
+            yield tail[pos:found]
+            index += 1
+            pos = found + len(separator)
+        tail = tail[pos:]
+        # 尾部可能以被块边界切断的半个分隔符结尾，这部分不计入长度
+        if max_length and len(tail) > max_length + len(separator) - 1 and \
+                len(tail[:len(tail) - len(separator) + 1].strip()) > max_length:
+            raise SegmentTooLongError(index, max_length)
+
+    for piece in tail.split(separator):
+        yield piece
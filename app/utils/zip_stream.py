@@ -0,0 +1,48 @@
+import io
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+
+class StreamBuffer(io.RawIOBase):
+    """不可 seek 的写缓冲区，zipfile 写入后由调用方取走数据"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, Iterable[bytes]]],
+               compression: int = zipfile.ZIP_DEFLATED) -> Iterator[bytes]:
+    """
+    边生成边输出 zip 文件，不落盘也不在内存中保留完整文件
+    :param entries: (文件名, 文件内容块) 列表，内容块按顺序写入
+    :param compression: 压缩方式
+    :return: zip 文件的字节块
+    """
+    buffer = StreamBuffer()
+    # 输出流不可 seek，zipfile 会为每个文件写 data descriptor，不需要回写文件头
+    with zipfile.ZipFile(buffer, mode="w", compression=compression) as zf:
+        for name, chunks in entries:
+            with zf.open(name, mode="w", force_zip64=True) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
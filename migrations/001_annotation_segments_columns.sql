@@ -0,0 +1,28 @@
+-- 升级已有数据库：create_all 只创建缺少的表，不会给已有的表加列和索引
+-- 新增的表（data_annotation_detect_jobs 和各类检测结果表）仍由 DB_AUTO_MIGRATE 创建
+-- 需要 MySQL 8.0（ROW_NUMBER 窗口函数），在停机或只读时执行一次
+
+ALTER TABLE data_annotations
+    ADD COLUMN model_name VARCHAR(128) NULL COMMENT '检测使用的向量模型，为空时使用默认模型',
+    ADD COLUMN content_version INT NOT NULL DEFAULT 0 COMMENT '内容版本号';
+
+ALTER TABLE data_annotation_segments
+    ADD COLUMN ordinal INT NULL COMMENT '任务内序号',
+    ADD COLUMN lease_owner VARCHAR(64) NULL COMMENT '领取人',
+    ADD COLUMN lease_expires_at DATETIME NULL COMMENT '领取过期时间',
+    ADD COLUMN change_seq INT NULL COMMENT '变更序号，取变更时任务的内容版本号';
+
+-- 已有样本的变更序号记为 0，增量导出、搜索和冲突检测的同步从水位 (0, 0) 开始时能读到它们
+UPDATE data_annotation_segments SET change_seq = 0 WHERE change_seq IS NULL;
+
+-- 已有任务按 (created_at, id) 编号，与应用在查询时懒补齐的顺序一致
+UPDATE data_annotation_segments s
+    JOIN (SELECT id, ROW_NUMBER() OVER (PARTITION BY data_annotation_id ORDER BY created_at, id) - 1 AS rn
+          FROM data_annotation_segments) t ON s.id = t.id
+SET s.ordinal = t.rn
+WHERE s.ordinal IS NULL;
+
+CREATE INDEX idx_data_annotation_segments_status ON data_annotation_segments (data_annotation_id, status);
+CREATE INDEX idx_data_annotation_segments_lease ON data_annotation_segments (data_annotation_id, lease_owner);
+CREATE UNIQUE INDEX idx_data_annotation_segments_ordinal ON data_annotation_segments (data_annotation_id, ordinal);
+CREATE INDEX idx_data_annotation_segments_change_seq ON data_annotation_segments (data_annotation_id, change_seq);
@@ -0,0 +1,40 @@
+import asyncio
+import io
+
+import pytest
+
+from app.utils.stream_reader import split_upload_file, SegmentTooLongError
+
+
+class FakeUpload:
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    async def read(self, size: int) -> bytes:
+        return self._data.read(size)
+
+
+def split(text: str, separator: str, chunk_size: int, max_length: int = 0):
+    async def collect():
+        return [piece async for piece in split_upload_file(FakeUpload(text.encode("utf-8")), separator, chunk_size,
+                                                           max_length=max_length)]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_split_matches_str_split(chunk_size):
+    text = "a\n\n中文\n\n\nb\n\n"
+    assert split(text, "\n\n", chunk_size) == text.split("\n\n")
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_segment_of_max_length_before_cut_separator(chunk_size):
+    # 块边界可能落在分隔符中间，恰好 max_length 的段不能被误判为超长
+    assert split("xxxxx##yyy", "##", chunk_size, max_length=5) == ["xxxxx", "yyy"]
+
+
+def test_segment_too_long():
+    with pytest.raises(SegmentTooLongError) as e:
+        split("a##" + "x" * 20 + "##b", "##", 4, max_length=5)
+    assert e.value.index == 1